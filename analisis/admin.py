@@ -1,8 +1,14 @@
 from django.contrib import admin
-from .models import TextoAnalizado
+from .models import TextoAnalizado, Corpus
 
 @admin.register(TextoAnalizado)
 class TextoAnalizadoAdmin(admin.ModelAdmin):
-    list_display = ['titulo', 'fecha_subida']
+    list_display = ['titulo', 'fecha_subida', 'estado_modelo']
     list_filter = ['fecha_subida']
-    search_fields = ['titulo']
\ No newline at end of file
+    search_fields = ['titulo']
+
+@admin.register(Corpus)
+class CorpusAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'fecha_creacion', 'estado_modelo']
+    search_fields = ['nombre']
+    filter_horizontal = ['textos']
\ No newline at end of file
@@ -0,0 +1,150 @@
+import hashlib
+
+from django.db import IntegrityError, transaction
+
+from .models import Corpus, ModeloNgramas, Ngrama
+from .cache_modelos import calcular_hash_archivo, calcular_hash_corpus, contar_textos, obtener_corpus
+from .cache_modelos import _hash_con_poda
+from .poda import iterar_ngramas_podados, opciones_poda
+from .utils import construir_trie_conteos, fusionar_conteos
+
+# Filas por INSERT al volcar los conteos
+TAMANO_LOTE_INSERCION = 5000
+
+
+class ModeloSQL:
+    """
+    Modelo de n-gramas guardado en la base de datos. Tiene la misma interfaz
+    que ModeloBinario, pero los "ids" son las propias palabras: cada consulta
+    de sugerencias es una única búsqueda por el índice (modelo, orden,
+    clave_contexto).
+    """
+
+    def __init__(self, modelo_db, n_grama):
+        self.modelo_db = modelo_db
+        self.n_grama = n_grama
+        self.total_palabras = modelo_db.total_palabras
+        self.total_ngramas = modelo_db.totales_ngramas.get(str(n_grama), 0)
+
+    def codificar_contexto(self, palabras):
+        return tuple(palabras)
+
+    def palabra(self, palabra):
+        return palabra
+
+    def sugerencias(self, contexto, k):
+        """Las k continuaciones más frecuentes: tuplas (palabra, conteo, conteo_contexto)"""
+        contexto = ' '.join(contexto)
+        return list(
+            Ngrama.objects
+            .filter(modelo=self.modelo_db, orden=self.n_grama, clave_contexto=clave_contexto(contexto),
+                    contexto=contexto)
+            .order_by('-conteo')
+            .values_list('palabra', 'conteo', 'conteo_contexto')[:k]
+        )
+
+def clave_contexto(contexto):
+    """
+    Hash de longitud fija de un contexto: es lo que se indexa, porque a los
+    órdenes altos el contexto puede superar lo que admite un índice
+    """
+    return hashlib.sha256(contexto.encode('utf-8')).hexdigest()
+
+def _origen(origen):
+    """Filtro, hash del contenido y función de conteo de un texto o de un corpus"""
+    if isinstance(origen, Corpus):
+        textos = list(origen.textos.order_by('id'))
+
+        def contar(n, usar_fronteras):
+            return fusionar_conteos(contar_textos(textos, n, usar_fronteras), n)
+
+        return {'corpus': origen}, calcular_hash_corpus(textos), contar
+
+    def contar(n, usar_fronteras):
+        corpus = obtener_corpus(origen, usar_fronteras)
+        return corpus['vocabulario'], construir_trie_conteos(corpus['ids'], n)
+
+    return {'texto': origen}, calcular_hash_archivo(origen.archivo), contar
+
+def guardar_conteos_sql(filtro, hash_contenido, vocabulario, trie, orden_maximo, usar_fronteras, poda=None):
+    """
+    Vuelca en una sola transacción los conteos hasta orden_maximo, con
+    inserciones por lotes. Si ya hay un volcado del mismo contenido con menos
+    órdenes, solo se insertan los que le faltan; los de versiones anteriores
+    del mismo texto o corpus se borran. Con opciones de poda solo se guardan
+    los n-gramas que la superan, como en los modelos compilados; los totales
+    son los del modelo sin podar.
+    """
+    decodificar = vocabulario.decodificar
+    palabras = vocabulario.palabras
+
+    with transaction.atomic():
+        anteriores = ModeloNgramas.objects.filter(usar_fronteras=usar_fronteras, **filtro)
+        modelo_db = anteriores.filter(hash_contenido=hash_contenido).order_by('-orden_maximo').first()
+        if modelo_db is None:
+            anteriores.delete()
+            modelo_db = ModeloNgramas.objects.create(
+                usar_fronteras=usar_fronteras,
+                orden_maximo=0,
+                hash_contenido=hash_contenido,
+                total_palabras=trie.raiz[0],
+                **filtro
+            )
+        else:
+            anteriores.exclude(pk=modelo_db.pk).delete()
+
+        lote = []
+        totales = modelo_db.totales_ngramas
+        for orden in range(modelo_db.orden_maximo + 1, orden_maximo + 1):
+            totales[str(orden)] = sum(len(hijos) for _, _, hijos in trie.contextos(orden - 1))
+            for ngrama, conteo, conteo_contexto in iterar_ngramas_podados(trie, orden, poda):
+                contexto = decodificar(ngrama[:-1])
+                lote.append(Ngrama(
+                    modelo=modelo_db,
+                    orden=orden,
+                    contexto=contexto,
+                    clave_contexto=clave_contexto(contexto),
+                    palabra=palabras[ngrama[-1]],
+                    conteo=conteo,
+                    conteo_contexto=conteo_contexto
+                ))
+                if len(lote) >= TAMANO_LOTE_INSERCION:
+                    Ngrama.objects.bulk_create(lote)
+                    lote = []
+        Ngrama.objects.bulk_create(lote)
+        modelo_db.orden_maximo = max(modelo_db.orden_maximo, orden_maximo)
+        modelo_db.save(update_fields=['orden_maximo', 'totales_ngramas'])
+
+    return modelo_db
+
+def obtener_modelo_sql(origen, n, usar_fronteras=False, construir=True):
+    """
+    Devuelve el ModeloSQL de un texto o corpus para el orden n. Vale cualquier
+    volcado del contenido actual con orden máximo >= n; si no lo hay se cuenta
+    y se guarda, salvo con construir=False, que devuelve None. Se guarda con
+    las opciones de poda de MODELOS_PODA: cambiarlas lo invalida.
+    """
+    usar_fronteras = bool(usar_fronteras)
+    poda = opciones_poda()
+    filtro, hash_contenido, contar = _origen(origen)
+    hash_contenido = _hash_con_poda(hash_contenido, poda)
+
+    modelo_db = ModeloNgramas.objects.filter(
+        usar_fronteras=usar_fronteras,
+        hash_contenido=hash_contenido,
+        orden_maximo__gte=n,
+        **filtro
+    ).first()
+
+    if modelo_db is None:
+        if not construir:
+            return None
+        vocabulario, trie = contar(n, usar_fronteras)
+        try:
+            modelo_db = guardar_conteos_sql(filtro, hash_contenido, vocabulario, trie, n, usar_fronteras, poda)
+        except IntegrityError:
+            # Otro proceso ha volcado los mismos órdenes a la vez: vale su volcado
+            modelo_db = ModeloNgramas.objects.get(usar_fronteras=usar_fronteras, hash_contenido=hash_contenido,
+                                                  orden_maximo__gte=n, **filtro)
+
+    return ModeloSQL(modelo_db, n)
@@ -0,0 +1,178 @@
+import mmap
+import struct
+from array import array
+
+from .poda import NivelesProbabilidad
+
+# Cabecera: firma, n, palabras, contextos, entradas, total_palabras, total_ngramas,
+# bits de cuantización (0 si los conteos son exactos)
+CABECERA = struct.Struct('=4s7I')
+FIRMA = b'NGB1'
+
+
+def escribir_modelo_binario(archivo, modelo):
+    """
+    Escribe un modelo compilado (con continuaciones) en `archivo`, abierto
+    en binario, en un formato compacto pensado para abrirse con mmap. Tras la
+    cabecera, todo son arrays de enteros sin signo de 32 bits:
+
+    - contextos: tuplas de n-1 ids, ordenadas, una tras otra
+    - conteos_contexto: C(contexto) de cada contexto
+    - desplazamientos: inicio de las entradas de cada contexto (uno más al final)
+    - palabras y conteos: las continuaciones de cada contexto, de mayor a menor conteo.
+      Si el modelo está cuantizado, en lugar de conteos se guardan los niveles
+      de probabilidad en enteros de uno o dos bytes, con relleno hasta
+      múltiplo de 4 para que las secciones siguientes sigan alineadas
+    - vocabulario: desplazamientos de cada palabra en el bloque UTF-8 final y
+      los ids en orden alfabético, para buscar palabras por bisección
+    """
+    n_grama = modelo['n_grama']
+    vocabulario = modelo['vocabulario']
+    prefijos = modelo['prefijos']
+    continuaciones = modelo['continuaciones']
+    cuantizador = modelo.get('cuantizador')
+    # Los niveles van de más a menos probable; los conteos, al revés
+    signo = 1 if cuantizador else -1
+
+    contextos = array('I')
+    conteos_contexto = array('I')
+    desplazamientos = array('I', [0])
+    palabras = array('I')
+    conteos = array(cuantizador.tipo if cuantizador else 'I')
+    for contexto in sorted(continuaciones):
+        conteo_contexto, rangos, conteos_rango = continuaciones[contexto]
+        contextos.extend(contexto)
+        conteos_contexto.append(conteo_contexto)
+        # A igual conteo, orden alfabético (posición en el índice de prefijos)
+        for conteo, rango in sorted(zip(conteos_rango, rangos), key=lambda par: (signo * par[0], par[1])):
+            palabras.append(prefijos.ids[rango])
+            conteos.append(conteo)
+        desplazamientos.append(len(palabras))
+
+    codificadas = [palabra.encode('utf-8') for palabra in vocabulario.palabras]
+    desplazamientos_vocabulario = array('I', [0])
+    for codificada in codificadas:
+        desplazamientos_vocabulario.append(desplazamientos_vocabulario[-1] + len(codificada))
+
+    cabecera = CABECERA.pack(FIRMA, n_grama, len(vocabulario), len(conteos_contexto), len(palabras),
+                             modelo['total_palabras'], modelo['total_ngramas'],
+                             cuantizador.bits if cuantizador else 0)
+
+    archivo.write(cabecera)
+    for seccion in (contextos, conteos_contexto, desplazamientos, palabras, conteos):
+        archivo.write(seccion.tobytes())
+    archivo.write(bytes(-len(conteos) * conteos.itemsize % 4))
+    for seccion in (desplazamientos_vocabulario, array('I', prefijos.ids)):
+        archivo.write(seccion.tobytes())
+    archivo.write(b''.join(codificadas))
+
+
+class ModeloBinario:
+    """
+    Modelo de n-gramas abierto con mmap: no se carga nada en memoria propia,
+    las páginas del archivo las comparte el sistema entre todos los procesos
+    que lo abren. Los contextos y las palabras se buscan por bisección
+    directamente sobre los arrays del archivo.
+    """
+
+    def __init__(self, ruta):
+        with open(ruta, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (firma, self.n_grama, total_vocabulario, total_contextos, total_entradas,
+         self.total_palabras, self.total_ngramas, bits) = CABECERA.unpack_from(self._mmap)
+        if firma != FIRMA:
+            raise ValueError(f'{ruta} no es un modelo binario')
+        self.cuantizador = NivelesProbabilidad(bits) if bits else None
+
+        vista = memoryview(self._mmap)
+        posicion = CABECERA.size
+
+        def seccion(elementos, tipo='I'):
+            nonlocal posicion
+            fin = posicion + array(tipo).itemsize * elementos
+            datos = vista[posicion:fin].cast(tipo)
+            # Las secciones empiezan siempre en múltiplos de 4
+            posicion = fin + (-fin % 4)
+            return datos
+
+        self.longitud_contexto = self.n_grama - 1
+        self.contextos = seccion(total_contextos * self.longitud_contexto)
+        self.conteos_contexto = seccion(total_contextos)
+        self.desplazamientos = seccion(total_contextos + 1)
+        self.palabras = seccion(total_entradas)
+        self.conteos = seccion(total_entradas, self.cuantizador.tipo if self.cuantizador else 'I')
+        self.desplazamientos_vocabulario = seccion(total_vocabulario + 1)
+        self.orden_alfabetico = seccion(total_vocabulario)
+        self._inicio_texto = posicion
+        self.total_contextos = total_contextos
+
+    def __len__(self):
+        return len(self.orden_alfabetico)
+
+    def _palabra_codificada(self, id_palabra):
+        inicio = self._inicio_texto + self.desplazamientos_vocabulario[id_palabra]
+        fin = self._inicio_texto + self.desplazamientos_vocabulario[id_palabra + 1]
+        return self._mmap[inicio:fin]
+
+    def palabra(self, id_palabra):
+        return self._palabra_codificada(id_palabra).decode('utf-8')
+
+    def decodificar(self, ids):
+        return ' '.join(self.palabra(i) for i in ids)
+
+    def id_palabra(self, palabra):
+        """Id de una palabra (None si no está); el orden de los bytes UTF-8 es el alfabético"""
+        buscada = palabra.encode('utf-8')
+        orden = self.orden_alfabetico
+        bajo, alto = 0, len(orden)
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if self._palabra_codificada(orden[medio]) < buscada:
+                bajo = medio + 1
+            else:
+                alto = medio
+        if bajo < len(orden) and self._palabra_codificada(orden[bajo]) == buscada:
+            return orden[bajo]
+        return None
+
+    def codificar_contexto(self, palabras):
+        """Tupla de ids de un contexto consultado; None si alguna palabra no existe"""
+        ids = tuple(self.id_palabra(palabra) for palabra in palabras)
+        return None if None in ids else ids
+
+    def buscar_contexto(self, contexto_ids):
+        """Posición del contexto en la tabla ordenada, o None si no aparece"""
+        longitud = self.longitud_contexto
+        if len(contexto_ids) != longitud:
+            return None
+        buscado = list(contexto_ids)
+        contextos = self.contextos
+        bajo, alto = 0, self.total_contextos
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if contextos[medio * longitud:(medio + 1) * longitud].tolist() < buscado:
+                bajo = medio + 1
+            else:
+                alto = medio
+        if bajo < self.total_contextos and contextos[bajo * longitud:(bajo + 1) * longitud].tolist() == buscado:
+            return bajo
+        return None
+
+    def sugerencias(self, contexto_ids, k):
+        """
+        Las k continuaciones más frecuentes: tuplas (id_palabra, conteo,
+        conteo_contexto). En un modelo cuantizado el conteo es el que
+        corresponde al nivel guardado.
+        """
+        posicion = self.buscar_contexto(contexto_ids)
+        if posicion is None:
+            return []
+        inicio = self.desplazamientos[posicion]
+        fin = min(self.desplazamientos[posicion + 1], inicio + k)
+        conteo_contexto = self.conteos_contexto[posicion]
+        if self.cuantizador:
+            conteo = self.cuantizador.conteo
+            return [(self.palabras[i], conteo(self.conteos[i], conteo_contexto), conteo_contexto)
+                    for i in range(inicio, fin)]
+        return [(self.palabras[i], self.conteos[i], conteo_contexto) for i in range(inicio, fin)]
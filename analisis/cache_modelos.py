@@ -0,0 +1,617 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from array import array
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+
+from .binario import ModeloBinario, escribir_modelo_binario
+from .poda import firma_poda, opciones_poda
+from .prefijos import IndicePrefijos
+from .registro import RegistroModelos, guardar_juntos
+from .utils import TOP_K_INDICE, codificar_texto, compilar_modelo_ngramas, leer_por_bloques
+from .utils import compilar_modelo_desde_trie, contar_documento, fusionar_conteos, pool_procesos
+from .utils import TOKENIZADOR, contar_incremento, actualizar_modelo_compilado, copiar_modelo_compilado
+
+# Bloqueo de archivos entre procesos: flock en POSIX, msvcrt en Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Modelos ya cargados en este proceso: (texto_id, n, fronteras) -> (hash, modelo)
+# Los de un corpus usan como id f"k{corpus_id}". Los tres registros comparten
+# el presupuesto MODELOS_MEMORIA_MAXIMA_MB y expulsan los menos usados.
+_modelos_en_memoria = RegistroModelos('modelos')
+
+# Textos ya codificados: (texto_id, fronteras) -> (hash, corpus)
+_corpus_en_memoria = RegistroModelos('corpus')
+
+# Modelos binarios abiertos con mmap: (texto_id, n, fronteras) -> (hash, ModeloBinario)
+_binarios_en_memoria = RegistroModelos('binarios')
+
+# Hashes ya calculados: ruta -> ((tamaño, mtime), hash del contenido). Se
+# recuerdan como mucho MAX_HASHES_MEMORIZADOS rutas, olvidando las menos usadas
+_hashes_archivos = OrderedDict()
+_candado_hashes = threading.Lock()
+MAX_HASHES_MEMORIZADOS = 4096
+
+# Un candado por modelo, (texto_id, tipo, fronteras) -> RLock: los hilos que
+# piden a la vez un modelo que falta lo construyen y lo guardan una sola vez
+_candados_construccion = {}
+_candado_candados = threading.Lock()
+
+# Las ampliaciones de texto (anexar_texto) se aplican de una en una: entre
+# hilos con este candado y entre procesos con _bloqueo_entre_procesos
+_candado_anexar = threading.Lock()
+
+TAMANO_BLOQUE_HASH = 1024 * 1024
+
+# Se incrementa cuando cambia la estructura del modelo compilado, para que los
+# archivos guardados con un formato anterior no se vuelvan a cargar
+VERSION_MODELO = 11
+
+
+def obtener_directorio_cache():
+    """Devuelve (y crea si hace falta) el directorio donde se guardan los modelos"""
+    directorio = getattr(settings, 'MODELOS_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache_modelos'))
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+def obtener_workers_fragmentos():
+    """Procesos para contar en paralelo los fragmentos de un texto grande"""
+    return getattr(settings, 'MODELOS_WORKERS_FRAGMENTOS', None) or os.cpu_count() or 1
+
+def calcular_hash_archivo(archivo):
+    """
+    Calcula el SHA-256 del contenido del archivo.
+    El resultado se memoriza por ruta junto con su tamaño y fecha de
+    modificación para no volver a leer el archivo completo en cada petición.
+    """
+    ruta = archivo.path
+    estado = os.stat(ruta)
+    firma = (estado.st_size, estado.st_mtime_ns)
+
+    with _candado_hashes:
+        memorizado = _hashes_archivos.get(ruta)
+        if memorizado is not None and memorizado[0] == firma:
+            _hashes_archivos.move_to_end(ruta)
+            return memorizado[1]
+
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE_HASH), b''):
+            sha.update(bloque)
+    hash_contenido = sha.hexdigest()
+
+    # La firma nueva sustituye a la anterior de la misma ruta
+    with _candado_hashes:
+        _hashes_archivos[ruta] = (firma, hash_contenido)
+        _hashes_archivos.move_to_end(ruta)
+        while len(_hashes_archivos) > MAX_HASHES_MEMORIZADOS:
+            _hashes_archivos.popitem(last=False)
+    return hash_contenido
+
+def _candado_construccion(texto_id, tipo, usar_fronteras):
+    """Candado del modelo (texto_id, tipo, fronteras), creado al pedirlo por primera vez"""
+    with _candado_candados:
+        return _candados_construccion.setdefault((texto_id, tipo, bool(usar_fronteras)), threading.RLock())
+
+def escribir_atomico(ruta, escribir):
+    """
+    Llama a escribir(f) con un archivo temporal propio en el mismo directorio
+    y lo mueve después a `ruta`: quien lee nunca ve un archivo a medias y dos
+    hilos o procesos que escriben la misma ruta no comparten el temporal.
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(ruta), prefix=os.path.basename(ruta) + '.',
+                                     suffix='.tmp', delete=False) as f:
+        ruta_temporal = f.name
+        try:
+            escribir(f)
+        except BaseException:
+            f.close()
+            os.remove(ruta_temporal)
+            raise
+    os.replace(ruta_temporal, ruta)
+
+@contextmanager
+def _bloqueo_entre_procesos(ruta):
+    """
+    Bloqueo exclusivo sobre un archivo auxiliar: la sección se ejecuta de una
+    en una entre todos los procesos que comparten el directorio de caché.
+    """
+    with open(ruta, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            # LK_LOCK reintenta durante unos segundos y después falla
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _hash_con_poda(hash_contenido, poda):
+    """
+    Hash con el que se guardan los modelos y análisis construidos con unas
+    opciones de poda: cambiarlas invalida lo construido con las anteriores.
+    Sin poda es el hash del contenido.
+    """
+    if not poda:
+        return hash_contenido
+    return hashlib.sha256(f"{hash_contenido}:{firma_poda(poda)}".encode()).hexdigest()
+
+def _nombre_archivo_cache(texto_id, tipo, usar_fronteras, hash_contenido='', extension='pickle'):
+    """
+    Nombre del archivo en caché. `tipo` es el orden n del modelo, 'c' para el
+    corpus codificado (vocabulario + ids) que comparten todos los modelos,
+    'p<n>' para los conteos parciales de un texto y 'b<n>' para el modelo binario.
+    Sin hash devuelve solo el prefijo común a todas las versiones.
+    """
+    prefijo = f"{texto_id}_{tipo}_{int(usar_fronteras)}_"
+    if not hash_contenido:
+        return prefijo
+    return f"{prefijo}v{VERSION_MODELO}_{hash_contenido[:32]}.{extension}"
+
+def _leer_modelo_disco(ruta):
+    """(tamaño estimado, valor) guardados en el archivo, o None si no se puede leer"""
+    try:
+        with open(ruta, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+def _guardar_modelo_disco(directorio, nombre, modelo, prefijo, tamano=None):
+    """
+    Escribe el modelo de forma atómica y borra versiones anteriores del mismo
+    texto. Junto al modelo se guarda `tamano`, la memoria estimada que ocupa,
+    para no tener que recorrerlo de nuevo al cargarlo.
+    """
+    escribir_atomico(os.path.join(directorio, nombre),
+                     lambda f: pickle.dump((tamano, modelo), f, protocol=pickle.HIGHEST_PROTOCOL))
+
+    for existente in os.listdir(directorio):
+        if existente.startswith(prefijo) and existente.endswith('.pickle') and existente != nombre:
+            try:
+                os.remove(os.path.join(directorio, existente))
+            except OSError:
+                pass
+
+def _obtener_del_cache(memoria, clave, hash_contenido, tipo, construir):
+    """
+    Busca en memoria, luego en disco y, si no existe, construye y guarda.
+    Con construir=None solo consulta la caché y devuelve None si no está.
+    Con memoria=None el valor solo se guarda en disco. El tamaño en memoria se
+    estima una vez, al construir, y se guarda en disco con el valor.
+    Los hilos que piden a la vez el mismo valor esperan a que uno lo cargue.
+    """
+    if memoria is not None:
+        en_memoria = memoria.buscar(clave, hash_contenido)
+        if en_memoria is not None:
+            return en_memoria
+
+    texto_id, usar_fronteras = clave[0], clave[-1]
+    directorio = obtener_directorio_cache()
+    prefijo = _nombre_archivo_cache(texto_id, tipo, usar_fronteras)
+    nombre = _nombre_archivo_cache(texto_id, tipo, usar_fronteras, hash_contenido)
+
+    with _candado_construccion(texto_id, tipo, usar_fronteras):
+        # Otro hilo puede haberlo cargado mientras se esperaba el candado
+        if memoria is not None:
+            en_memoria = memoria.buscar(clave, hash_contenido, contar=False)
+            if en_memoria is not None:
+                return en_memoria
+
+        leido = _leer_modelo_disco(os.path.join(directorio, nombre))
+        if leido is not None:
+            tamano, valor = leido
+        else:
+            if construir is None:
+                return None
+            valor = construir()
+            tamano = memoria.estimar(valor) if memoria is not None else None
+            _guardar_modelo_disco(directorio, nombre, valor, prefijo, tamano)
+
+        if memoria is not None:
+            memoria.guardar(clave, hash_contenido, valor, tamano)
+    return valor
+
+def _guardar_en_cache(memoria, clave, hash_contenido, tipo, valor, tamano=None):
+    """
+    Guarda un valor ya calculado en disco y en memoria, reemplazando versiones
+    anteriores. `tamano` es la memoria estimada que ocupa, si ya se conoce.
+    """
+    texto_id, usar_fronteras = clave[0], clave[-1]
+    if tamano is None and memoria is not None:
+        tamano = memoria.estimar(valor)
+    _guardar_modelo_disco(obtener_directorio_cache(),
+                          _nombre_archivo_cache(texto_id, tipo, usar_fronteras, hash_contenido),
+                          valor,
+                          _nombre_archivo_cache(texto_id, tipo, usar_fronteras),
+                          tamano)
+    if memoria is not None:
+        memoria.guardar(clave, hash_contenido, valor, tamano)
+
+def _ordenes_en_disco(texto_id, prefijo_tipo, usar_fronteras, hash_contenido):
+    """Órdenes n con archivo en caché para este contenido: modelos compilados (prefijo '') o binarios ('b')"""
+    ordenes = []
+    for existente in os.listdir(obtener_directorio_cache()):
+        partes = existente.split('_')
+        if (len(partes) == 5 and partes[0] == str(texto_id) and partes[2] == str(int(usar_fronteras))
+                and partes[3] == f"v{VERSION_MODELO}" and partes[4].startswith(hash_contenido[:32] + '.')
+                and partes[1].startswith(prefijo_tipo) and partes[1][len(prefijo_tipo):].isdigit()):
+            ordenes.append(int(partes[1][len(prefijo_tipo):]))
+    return sorted(ordenes)
+
+def obtener_corpus(texto_obj, usar_fronteras=False, construir=True, hash_contenido=None):
+    """
+    Devuelve el texto limpio y codificado {'vocabulario', 'ids', 'prefijos'}.
+    Se calcula una sola vez por contenido y lo comparten los modelos de
+    todos los órdenes construidos a partir de ese texto.
+    Con construir=False devuelve None si todavía no está en caché.
+    `hash_contenido` es el hash del archivo si quien llama ya lo ha calculado.
+    """
+    usar_fronteras = bool(usar_fronteras)
+    if hash_contenido is None:
+        hash_contenido = calcular_hash_archivo(texto_obj.archivo)
+
+    def construir_corpus():
+        with texto_obj.archivo.open('r') as archivo:
+            vocabulario, ids = codificar_texto(leer_por_bloques(archivo), usar_fronteras)
+        return {
+            'vocabulario': vocabulario,
+            'ids': ids,
+            'prefijos': IndicePrefijos(vocabulario, ids, TOP_K_INDICE)
+        }
+
+    return _obtener_del_cache(_corpus_en_memoria, (texto_obj.id, usar_fronteras),
+                              hash_contenido, 'c', construir_corpus if construir else None)
+
+def obtener_modelo(texto_obj, n, usar_fronteras=False, construir=True, workers=1):
+    """
+    Devuelve el modelo compilado para (texto, n, fronteras).
+    Busca primero en memoria, luego en disco y solo si no existe lo construye.
+    La clave incluye el hash del contenido, así que cualquier cambio en el
+    archivo invalida el modelo automáticamente.
+    Con construir=False devuelve None si el modelo todavía no existe.
+    Con workers > 1 los n-gramas se cuentan por fragmentos en paralelo.
+    Se construye con las opciones de poda de MODELOS_PODA (ver poda.py).
+    """
+    usar_fronteras = bool(usar_fronteras)
+    poda = opciones_poda()
+    # Corpus y modelo se buscan con el mismo hash: si el texto se amplía
+    # mientras tanto, nunca se combina un modelo con el corpus de otra versión
+    hash_archivo = calcular_hash_archivo(texto_obj.archivo)
+    hash_contenido = _hash_con_poda(hash_archivo, poda)
+    corpus = obtener_corpus(texto_obj, usar_fronteras, construir, hash_archivo)
+    if corpus is None:
+        return None
+
+    def construir_modelo():
+        modelo = compilar_modelo_ngramas(corpus['ids'], corpus['vocabulario'], n, usar_fronteras,
+                                         corpus['prefijos'], workers, poda)
+        # El vocabulario se guarda una sola vez, con el corpus
+        modelo.pop('vocabulario')
+        return modelo
+
+    modelo = _obtener_del_cache(_modelos_en_memoria, (texto_obj.id, n, usar_fronteras),
+                                hash_contenido, n, construir_modelo if construir else None)
+    if modelo is None:
+        return None
+
+    # Vocabulario e índice de prefijos son del corpus y se comparten entre órdenes
+    modelo['vocabulario'] = corpus['vocabulario']
+    modelo['prefijos'] = corpus['prefijos']
+    return modelo
+
+def clave_corpus(corpus_id):
+    """Identificador de un corpus en la caché, distinto del de cualquier texto"""
+    return f"k{corpus_id}"
+
+def contar_textos(textos, n, usar_fronteras):
+    """
+    Conteos parciales (vocabulario, trie) de cada texto. Los ya contados se
+    leen de disco; el resto se cuentan en paralelo en un pool de procesos y
+    se guardan, así que al añadir o quitar un texto solo se cuenta ese.
+    """
+    directorio = obtener_directorio_cache()
+    parciales = {}
+    pendientes = []
+    for texto_obj in textos:
+        hash_contenido = calcular_hash_archivo(texto_obj.archivo)
+        parcial = _obtener_del_cache(None, (texto_obj.id, n, usar_fronteras), hash_contenido, f"p{n}", None)
+        if parcial is None:
+            pendientes.append((texto_obj, hash_contenido))
+        else:
+            parciales[texto_obj.id] = parcial
+
+    if len(pendientes) == 1:
+        texto_obj, _ = pendientes[0]
+        contados = [contar_documento(texto_obj.archivo.path, n, usar_fronteras)]
+    elif pendientes:
+        workers = getattr(settings, 'MODELOS_WORKERS_CONTEO', None)
+        with pool_procesos(workers) as pool:
+            contados = list(pool.map(contar_documento,
+                                     [texto_obj.archivo.path for texto_obj, _ in pendientes],
+                                     [n] * len(pendientes),
+                                     [usar_fronteras] * len(pendientes)))
+    else:
+        contados = []
+
+    for (texto_obj, hash_contenido), parcial in zip(pendientes, contados):
+        _guardar_modelo_disco(
+            directorio,
+            _nombre_archivo_cache(texto_obj.id, f"p{n}", usar_fronteras, hash_contenido),
+            parcial,
+            _nombre_archivo_cache(texto_obj.id, f"p{n}", usar_fronteras)
+        )
+        parciales[texto_obj.id] = parcial
+
+    return [parciales[texto_obj.id] for texto_obj in textos]
+
+def calcular_hash_corpus(textos):
+    """Hash combinado de los textos de un corpus (ids y contenidos)"""
+    sha = hashlib.sha256()
+    for texto_obj in textos:
+        sha.update(f"{texto_obj.id}:{calcular_hash_archivo(texto_obj.archivo)};".encode())
+    return sha.hexdigest()
+
+def obtener_modelo_corpus(corpus_obj, n, usar_fronteras=False, construir=True):
+    """
+    Devuelve el modelo compilado de un corpus de varios textos, con la misma
+    estructura que obtener_modelo. Se construye por map-reduce: cada texto se
+    cuenta por separado y los conteos parciales se suman en un único trie.
+    La clave combina los hashes de todos los textos, así que añadir, quitar o
+    modificar uno invalida el modelo.
+    Con construir=False devuelve None si el modelo todavía no existe.
+    """
+    usar_fronteras = bool(usar_fronteras)
+    poda = opciones_poda()
+    textos = list(corpus_obj.textos.order_by('id'))
+    hash_corpus = _hash_con_poda(calcular_hash_corpus(textos), poda)
+
+    def construir_modelo():
+        vocabulario, trie = fusionar_conteos(contar_textos(textos, n, usar_fronteras), n)
+        hijos_raiz = trie.raiz[1] or {}
+        prefijos = IndicePrefijos(vocabulario, (), TOP_K_INDICE,
+                                  frecuencias=[hijos_raiz[i][0] for i in range(len(vocabulario))])
+        modelo = compilar_modelo_desde_trie(trie, vocabulario, n, usar_fronteras, prefijos, poda)
+        modelo['prefijos'] = prefijos
+        return modelo
+
+    return _obtener_del_cache(_modelos_en_memoria, (clave_corpus(corpus_obj.id), n, usar_fronteras),
+                              hash_corpus, n, construir_modelo if construir else None)
+
+def _obtener_binario(clave, hash_contenido, obtener_compilado, construir):
+    """
+    Abre con mmap el modelo binario de la clave (texto_id, n, fronteras). Si
+    no existe en disco se escribe a partir del modelo compilado, salvo con
+    construir=False, que devuelve None.
+    """
+    en_memoria = _binarios_en_memoria.buscar(clave, hash_contenido)
+    if en_memoria is not None:
+        return en_memoria
+
+    texto_id, n, usar_fronteras = clave
+    directorio = obtener_directorio_cache()
+    prefijo = _nombre_archivo_cache(texto_id, f"b{n}", usar_fronteras)
+    nombre = _nombre_archivo_cache(texto_id, f"b{n}", usar_fronteras, hash_contenido, 'ngb')
+    ruta = os.path.join(directorio, nombre)
+
+    # Las peticiones y el pool de construcción pueden pedir el mismo binario a la vez
+    with _candado_construccion(texto_id, f"b{n}", usar_fronteras):
+        en_memoria = _binarios_en_memoria.buscar(clave, hash_contenido, contar=False)
+        if en_memoria is not None:
+            return en_memoria
+
+        if not os.path.exists(ruta):
+            modelo = obtener_compilado(construir=construir)
+            if modelo is None:
+                return None
+            escribir_atomico(ruta, lambda f: escribir_modelo_binario(f, modelo))
+            for existente in os.listdir(directorio):
+                if existente.startswith(prefijo) and existente.endswith('.ngb') and existente != nombre:
+                    try:
+                        os.remove(os.path.join(directorio, existente))
+                    except OSError:
+                        pass
+
+        binario = ModeloBinario(ruta)
+        _binarios_en_memoria.guardar(clave, hash_contenido, binario)
+    return binario
+
+def obtener_modelo_binario(texto_obj, n, usar_fronteras=False, construir=True):
+    """
+    Versión mmap del modelo de (texto, n, fronteras), para las consultas de
+    sugerencias más frecuentes: todos los procesos del servidor comparten las
+    mismas páginas en caché del sistema y abrirlo no cuesta nada.
+    """
+    usar_fronteras = bool(usar_fronteras)
+    return _obtener_binario(
+        (texto_obj.id, n, usar_fronteras),
+        _hash_con_poda(calcular_hash_archivo(texto_obj.archivo), opciones_poda()),
+        lambda construir: obtener_modelo(texto_obj, n, usar_fronteras, construir),
+        construir
+    )
+
+def obtener_modelo_binario_corpus(corpus_obj, n, usar_fronteras=False, construir=True):
+    """Como obtener_modelo_binario, para el modelo conjunto de un corpus"""
+    usar_fronteras = bool(usar_fronteras)
+    return _obtener_binario(
+        (clave_corpus(corpus_obj.id), n, usar_fronteras),
+        _hash_con_poda(calcular_hash_corpus(list(corpus_obj.textos.order_by('id'))), opciones_poda()),
+        lambda construir: obtener_modelo_corpus(corpus_obj, n, usar_fronteras, construir),
+        construir
+    )
+
+def obtener_artefacto(texto_obj, tipo, usar_fronteras, construir):
+    """
+    Resultado ya calculado de una página de análisis de un texto (cualquier
+    objeto serializable), guardado en disco junto a sus modelos. `tipo`
+    identifica la página y sus parámetros; construir() lo calcula si falta.
+    Como los modelos, depende también de las opciones de poda.
+    """
+    return _obtener_del_cache(None, (texto_obj.id, tipo, bool(usar_fronteras)),
+                              _hash_con_poda(calcular_hash_archivo(texto_obj.archivo), opciones_poda()),
+                              tipo, construir)
+
+def anexar_texto(texto_obj, contenido):
+    """
+    Añade `contenido` al final del archivo del texto y actualiza sus modelos
+    en caché sin recontar el texto completo: solo se tokeniza lo añadido, con
+    las últimas n-1 palabras anteriores como contexto, y las diferencias de
+    conteos se aplican al corpus codificado, al índice de prefijos y a cada
+    modelo compilado y binario. El resultado es el mismo que reconstruirlos
+    con el texto ampliado; lo que no estaba en caché se construirá cuando se
+    pida. Devuelve los órdenes actualizados de cada variante.
+    Los modelos podados no guardan los conteos que se necesitarían para
+    actualizarlos: con MODELOS_PODA solo se actualiza el corpus codificado y
+    los modelos se reconstruyen al pedirlos.
+    Las peticiones en curso siguen leyendo los objetos anteriores: los cambios
+    se aplican a copias, que sustituyen a los anteriores en memoria de una
+    vez. Copiar, guardar los pickles y escribir el archivo binario cuesta lo
+    mismo que recorrer el modelo, así que ampliar es proporcional al tamaño
+    del modelo; lo que se ahorra es tokenizar y contar el texto completo.
+    Dos procesos que amplían el mismo texto se esperan el uno al otro.
+    """
+    bloqueo = os.path.join(obtener_directorio_cache(), f"{texto_obj.id}_anexar.lock")
+    with _candado_anexar, _bloqueo_entre_procesos(bloqueo):
+        poda = opciones_poda()
+        hash_anterior = calcular_hash_archivo(texto_obj.archivo)
+        nuevos = TOKENIZADOR.limpiar(contenido)
+
+        previos = []
+        for usar_fronteras in (False, True):
+            corpus = obtener_corpus(texto_obj, usar_fronteras, construir=False, hash_contenido=hash_anterior)
+            if corpus is None:
+                continue
+            modelos = {}
+            binarios = []
+            if not poda:
+                for n in _ordenes_en_disco(texto_obj.id, '', usar_fronteras, hash_anterior):
+                    modelo = obtener_modelo(texto_obj, n, usar_fronteras, construir=False)
+                    if modelo is not None:
+                        modelos[n] = modelo
+                binarios = _ordenes_en_disco(texto_obj.id, 'b', usar_fronteras, hash_anterior)
+            previos.append((usar_fronteras, corpus, modelos, binarios))
+
+        variantes = []
+        for usar_fronteras, corpus, modelos, binarios in previos:
+            vocabulario = corpus['vocabulario'].copia()
+            ids = array('I', corpus['ids'])
+            prefijos = corpus['prefijos'].copia()
+
+            # Con fronteras todo el texto es una oración: el </s> final se
+            # mueve detrás de lo añadido
+            quitados, agregados = [], list(nuevos)
+            if usar_fronteras and nuevos:
+                if ids:
+                    quitados = [ids.pop()]
+                    agregados.append('</s>')
+                else:
+                    agregados = ['<s>'] + agregados + ['</s>']
+
+            total_vocabulario = len(vocabulario)
+            ids_agregados = vocabulario.codificar(agregados)
+            orden_maximo = max(modelos, default=1)
+            # Primero se quita y después se añade, sin compensar: así los
+            # n-gramas que solo cambian de sitio quedan en el mismo orden que
+            # al contar el texto ampliado desde el principio
+            deltas = [contar_incremento(ids, quitados, orden_maximo, signo=-1),
+                      contar_incremento(ids, ids_agregados, orden_maximo)]
+            ids.extend(ids_agregados)
+
+            cambios_palabras = {}
+            for delta in deltas:
+                for ngrama, cambio in delta.items():
+                    if len(ngrama) == 1:
+                        cambios_palabras[ngrama[0]] = cambios_palabras.get(ngrama[0], 0) + cambio
+            # Las palabras nuevas se insertan en el índice en su posición
+            # alfabética y desplazan los rangos de las posteriores
+            inserciones = prefijos.agregar_palabras(vocabulario, total_vocabulario)
+            prefijos.actualizar_frecuencias(cambios_palabras)
+
+            actualizados = {}
+            for n, modelo in modelos.items():
+                modelo = copiar_modelo_compilado(modelo)
+                actualizar_modelo_compilado(modelo, deltas[0], prefijos, inserciones)
+                actualizar_modelo_compilado(modelo, deltas[1], prefijos)
+                actualizados[n] = {campo: valor for campo, valor in modelo.items()
+                                   if campo not in ('vocabulario', 'prefijos')}
+            variantes.append((usar_fronteras, {'vocabulario': vocabulario, 'ids': ids, 'prefijos': prefijos},
+                              actualizados, binarios))
+
+        # Mientras se escriben el archivo y los modelos, quien pida uno de
+        # ellos espera en su candado en lugar de reconstruirlo; se toman en el
+        # mismo orden que _obtener_binario (binario, modelo, corpus)
+        candados = [_candado_construccion(texto_obj.id, f"b{n}", usar_fronteras)
+                    for usar_fronteras, _, _, binarios in variantes for n in binarios]
+        candados += [_candado_construccion(texto_obj.id, n, usar_fronteras)
+                     for usar_fronteras, _, modelos, _ in variantes for n in modelos]
+        candados += [_candado_construccion(texto_obj.id, 'c', usar_fronteras) for usar_fronteras, *_ in variantes]
+        with ExitStack() as pila:
+            for candado in candados:
+                pila.enter_context(candado)
+
+            with texto_obj.archivo.open('a') as archivo:
+                archivo.write('\n' + contenido)
+            hash_contenido = calcular_hash_archivo(texto_obj.archivo)
+
+            # Lo añadido es pequeño frente al modelo: se conserva la estimación
+            # de memoria anterior en lugar de recorrer de nuevo todo el modelo
+            guardados = []
+            for usar_fronteras, corpus, modelos, _ in variantes:
+                valores = [(_corpus_en_memoria, (texto_obj.id, usar_fronteras), corpus)]
+                valores += [(_modelos_en_memoria, (texto_obj.id, n, usar_fronteras), modelo)
+                            for n, modelo in modelos.items()]
+                for memoria, clave, valor in valores:
+                    tamano = memoria.tamano(clave)
+                    if tamano is None:
+                        tamano = memoria.estimar(valor)
+                    guardados.append((memoria, clave, hash_contenido, valor, tamano))
+            for memoria, clave, _, valor, tamano in guardados:
+                tipo = clave[1] if memoria is _modelos_en_memoria else 'c'
+                _guardar_en_cache(None, clave, hash_contenido, tipo, valor, tamano)
+            guardar_juntos(guardados)
+
+            for usar_fronteras, _, _, binarios in variantes:
+                for n in binarios:
+                    obtener_modelo_binario(texto_obj, n, usar_fronteras)
+
+    return {'tokens_nuevos': len(nuevos), 'actualizados': [{
+        'fronteras': usar_fronteras,
+        'total_palabras': len(corpus['ids']),
+        'ordenes': sorted(modelos),
+        'binarios': binarios,
+    } for usar_fronteras, corpus, modelos, binarios in variantes]}
+
+def invalidar_modelos(texto_id):
+    """Elimina de memoria y de disco todos los modelos de un texto (o de un corpus)"""
+    for memoria in (_modelos_en_memoria, _corpus_en_memoria, _binarios_en_memoria):
+        memoria.eliminar_si(lambda clave: clave[0] == texto_id)
+    with _candado_candados:
+        for clave in [clave for clave in _candados_construccion if clave[0] == texto_id]:
+            del _candados_construccion[clave]
+
+    directorio = obtener_directorio_cache()
+    for existente in os.listdir(directorio):
+        if existente.startswith(f"{texto_id}_"):
+            try:
+                os.remove(os.path.join(directorio, existente))
+            except OSError:
+                pass
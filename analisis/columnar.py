@@ -0,0 +1,209 @@
+from collections.abc import ItemsView, Mapping, ValuesView
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .poda import conteo_minimo, cuantizador_poda
+from .vocabulario import Vocabulario
+
+# NumPy es opcional: sin él solo está disponible el motor de Python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def usar_motor_columnar():
+    """True si MOTOR_NGRAMAS pide el motor de NumPy ('numpy'); por defecto 'python'"""
+    motor = getattr(settings, 'MOTOR_NGRAMAS', 'python')
+    if motor == 'python':
+        return False
+    if motor != 'numpy':
+        raise ImproperlyConfigured(f'MOTOR_NGRAMAS desconocido: {motor}')
+    if np is None:
+        raise ImproperlyConfigured('MOTOR_NGRAMAS = "numpy" necesita tener NumPy instalado')
+    return True
+
+
+class _Elementos(ItemsView):
+    def __iter__(self):
+        return self._mapping._elementos()
+
+class _Valores(ValuesView):
+    def __iter__(self):
+        return (datos for _, datos in self._mapping._elementos())
+
+
+class ProbabilidadesColumnares(Mapping):
+    """
+    Resultado de calcular_probabilidad_ngramas_columnar: se comporta como el
+    diccionario {ngrama: datos} del motor de Python, con las mismas claves,
+    datos y orden, pero guarda los n-gramas, conteos y probabilidades en
+    arrays paralelos y solo crea el diccionario de cada n-grama cuando se
+    lee (al recorrerlo una plantilla o al responder en JSON).
+    Con cuantización (`cuantizador`, un NivelesProbabilidad) no se guardan
+    probabilidades: `niveles` es el nivel de cada n-grama, un entero de 8 o
+    16 bits, y sus valores se buscan en las tablas del cuantizador al leerlo.
+    """
+
+    def __init__(self, palabras, ngramas, conteos, conteos_contexto, probabilidades=None,
+                 log_probabilidades=None, niveles=None, cuantizador=None):
+        self.palabras = palabras
+        self.orden = ngramas.shape[1]
+        self.ngramas = ngramas
+        self.conteos = conteos
+        self.conteos_contexto = conteos_contexto
+        self.probabilidades = probabilidades
+        self.log_probabilidades = log_probabilidades
+        self.niveles = niveles
+        self.cuantizador = cuantizador
+        self._posiciones = None
+
+    def __len__(self):
+        return len(self.conteos)
+
+    def _clave(self, posicion):
+        palabras = self.palabras
+        return ' '.join(palabras[id_palabra] for id_palabra in self.ngramas[posicion].tolist())
+
+    def _datos(self, posicion):
+        ids = self.ngramas[posicion].tolist()
+        if self.cuantizador is not None:
+            nivel = int(self.niveles[posicion])
+            probabilidad = self.cuantizador.probabilidades[nivel]
+            log_probabilidad = self.cuantizador.logaritmos[nivel]
+        else:
+            probabilidad = float(self.probabilidades[posicion])
+            log_probabilidad = float(self.log_probabilidades[posicion])
+        return {
+            'frecuencia_ngrama': int(self.conteos[posicion]),
+            'contexto': ' '.join(self.palabras[id_palabra] for id_palabra in ids[:-1]),
+            'frecuencia_contexto': int(self.conteos_contexto[posicion]),
+            'probabilidad': probabilidad,
+            'log_probabilidad': log_probabilidad,
+            'palabra_objetivo': self.palabras[ids[-1]],
+            'orden_ngrama': self.orden
+        }
+
+    def __iter__(self):
+        return (self._clave(posicion) for posicion in range(len(self)))
+
+    def __getitem__(self, clave):
+        if self._posiciones is None:
+            self._posiciones = {self._clave(posicion): posicion for posicion in range(len(self))}
+        return self._datos(self._posiciones[clave])
+
+    def _elementos(self):
+        for posicion in range(len(self)):
+            yield self._clave(posicion), self._datos(posicion)
+
+    def items(self):
+        return _Elementos(self)
+
+    def values(self):
+        return _Valores(self)
+
+    def mas_frecuentes(self, k):
+        """Los k n-gramas más frecuentes, como sorted(...)[:k] sobre el diccionario"""
+        posiciones = np.argsort(-self.conteos, kind='stable')[:k]
+        return [(self._clave(posicion), self._datos(posicion)) for posicion in posiciones.tolist()]
+
+    def __getstate__(self):
+        # El índice de claves se reconstruye al leerlo; no se guarda en disco
+        return {**self.__dict__, '_posiciones': None}
+
+
+def _contar_ventanas(ids, n, total_vocabulario):
+    """
+    Cuenta las ventanas de longitud 1 a n sin bucles de Python: cada ventana
+    de longitud k se codifica como un único entero a partir del código de su
+    prefijo de longitud k-1 y de su última palabra, y np.unique las agrupa.
+    Devuelve, por longitud k, (código por posición, conteo por código,
+    primera posición por código); los códigos siguen el orden de np.unique.
+    """
+    niveles = {}
+    _, primeras, codigos, conteos = np.unique(ids, return_index=True, return_inverse=True, return_counts=True)
+    niveles[1] = (codigos, conteos, primeras)
+    for k in range(2, n + 1):
+        combinados = niveles[k - 1][0][:len(ids) - k + 1] * total_vocabulario + ids[k - 1:]
+        _, primeras, codigos, conteos = np.unique(combinados, return_index=True, return_inverse=True,
+                                                  return_counts=True)
+        niveles[k] = (codigos, conteos, primeras)
+    return niveles
+
+def _conservar_columnar(poda, n, conteos, conteos_contexto, contextos, posiciones, niveles, total):
+    """
+    Máscara de los n-gramas (ya en el orden del trie) que sobreviven a la poda,
+    con el mismo criterio que continuaciones_conservadas.
+    """
+    conservar = conteos >= conteo_minimo(poda, n)
+
+    umbral = poda['umbral_entropia']
+    if umbral:
+        # Contexto sin su primera palabra y n-grama sin su primera palabra,
+        # leídos en la posición siguiente del texto
+        siguientes = posiciones + 1
+        codigos_corto, conteos_corto_por_codigo, _ = niveles[n - 1]
+        conteos_ngrama_corto = conteos_corto_por_codigo[codigos_corto[siguientes]]
+        if n > 2:
+            codigos_contexto_corto, conteos_contexto_corto_por_codigo, _ = niveles[n - 2]
+            conteos_contexto_corto = conteos_contexto_corto_por_codigo[codigos_contexto_corto[siguientes]]
+        else:
+            conteos_contexto_corto = np.full(len(conteos), total)
+        perdida = conteos / total * np.abs(np.log(conteos / conteos_contexto)
+                                           - np.log(conteos_ngrama_corto / conteos_contexto_corto))
+        conservar &= perdida >= umbral
+
+    maximo = poda['max_continuaciones']
+    if maximo:
+        # Puesto de cada superviviente en su contexto, de más a menos
+        # frecuente y, a igual conteo, en el orden del trie
+        candidatos = np.flatnonzero(conservar)
+        orden = candidatos[np.lexsort((candidatos, -conteos[candidatos], contextos[candidatos]))]
+        grupos = contextos[orden]
+        inicios = np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]])
+        puestos = np.arange(len(orden)) - np.repeat(inicios, np.diff(np.r_[inicios, len(orden)]))
+        conservar[orden[puestos >= maximo]] = False
+    return conservar
+
+def calcular_probabilidad_ngramas_columnar(tokens, n, poda=None):
+    """
+    Motor de NumPy de calcular_probabilidad_ngramas_general: mismo resultado
+    (ver ProbabilidadesColumnares), con los conteos, los conteos de contexto y
+    las probabilidades calculados de una vez sobre arrays.
+    """
+    if n < 2 or len(tokens) < n:
+        return {}
+
+    vocabulario = Vocabulario()
+    ids = np.asarray(vocabulario.codificar(tokens), dtype=np.int64)
+    niveles = _contar_ventanas(ids, n, len(vocabulario))
+    total = len(ids)
+
+    # Cada n-grama distinto se representa por su primera aparición
+    _, conteos, posiciones = niveles[n]
+    codigos_contexto, conteos_contexto_por_codigo, _ = niveles[n - 1]
+    contextos = codigos_contexto[posiciones]
+
+    # Orden del trie: por primera aparición de cada prefijo, del más corto al más largo
+    claves = [niveles[k][2][niveles[k][0][posiciones]] for k in range(n, 0, -1)]
+    orden = np.lexsort(claves)
+    posiciones, conteos, contextos = posiciones[orden], conteos[orden], contextos[orden]
+    conteos_contexto = conteos_contexto_por_codigo[contextos]
+
+    if poda:
+        conservar = _conservar_columnar(poda, n, conteos, conteos_contexto, contextos, posiciones, niveles, total)
+        posiciones, conteos, conteos_contexto = posiciones[conservar], conteos[conservar], conteos_contexto[conservar]
+
+    probabilidades = conteos / conteos_contexto
+    ngramas = ids[posiciones[:, None] + np.arange(n)].astype(np.uint32)
+    cuantizador = cuantizador_poda(poda)
+    if cuantizador:
+        # Solo el nivel de cada n-grama, en el entero más pequeño que lo admite
+        niveles = np.minimum(cuantizador.niveles - 1, np.rint(-np.log(probabilidades) / cuantizador.paso))
+        return ProbabilidadesColumnares(vocabulario.palabras, ngramas, conteos, conteos_contexto,
+                                        niveles=niveles.astype(np.min_scalar_type(cuantizador.niveles - 1)),
+                                        cuantizador=cuantizador)
+
+    return ProbabilidadesColumnares(vocabulario.palabras, ngramas, conteos, conteos_contexto,
+                                    probabilidades, np.log(probabilidades))
@@ -0,0 +1,107 @@
+class TrieConteos:
+    """
+    Trie de conteos para todos los órdenes hasta `orden_maximo`.
+
+    Cada nodo es una lista [conteo, hijos] y representa la secuencia de ids del
+    camino desde la raíz: su conteo es el número de ventanas del texto iguales a
+    esa secuencia. Recorriendo los tokens una sola vez quedan contados a la vez
+    los unigramas, bigramas, ... hasta los n-gramas de orden máximo, y de ahí se
+    derivan tanto los n-gramas de cada orden como los conteos de sus contextos.
+    """
+
+    def __init__(self, orden_maximo):
+        self.orden_maximo = orden_maximo
+        self.raiz = [0, {}]
+        # Nodos de las ventanas que todavía pueden crecer con el siguiente token
+        self._abiertos = [self.raiz]
+
+    def agregar(self, id_palabra):
+        """Cuenta todas las ventanas que terminan en el token recibido"""
+        siguientes = []
+        for padre in self._abiertos:
+            hijos = padre[1]
+            if hijos is None:
+                hijos = padre[1] = {}
+            nodo = hijos.get(id_palabra)
+            if nodo is None:
+                nodo = hijos[id_palabra] = [0, None]
+            nodo[0] += 1
+            siguientes.append(nodo)
+
+        self.raiz[0] += 1
+        self._abiertos = [self.raiz] + siguientes[:self.orden_maximo - 1]
+
+    def agregar_secuencia(self, ids):
+        for id_palabra in ids:
+            self.agregar(id_palabra)
+
+    def cortar(self):
+        """Termina la secuencia actual: ninguna ventana cruza este punto"""
+        self._abiertos = [self.raiz]
+
+    def contar(self, ngrama, veces=1):
+        """
+        Suma `veces` a una única ventana (no a sus prefijos), creando su camino
+        si hace falta. Los prefijos deben quedar contados por otra vía.
+        """
+        nodo = self.raiz
+        for id_palabra in ngrama:
+            if nodo[1] is None:
+                nodo[1] = {}
+            hijo = nodo[1].get(id_palabra)
+            if hijo is None:
+                hijo = nodo[1][id_palabra] = [0, None]
+            nodo = hijo
+        nodo[0] += veces
+
+    def sumar(self, otro, mapa_ids):
+        """
+        Suma los conteos de otro trie (de un documento contado por separado).
+        mapa_ids traduce los ids del vocabulario del otro trie a los de este.
+        """
+        pendientes = [(self.raiz, otro.raiz)]
+        while pendientes:
+            destino, origen = pendientes.pop()
+            destino[0] += origen[0]
+            if not origen[1]:
+                continue
+            if destino[1] is None:
+                destino[1] = {}
+            hijos = destino[1]
+            for id_palabra, hijo in origen[1].items():
+                id_palabra = mapa_ids[id_palabra]
+                nodo = hijos.get(id_palabra)
+                if nodo is None:
+                    nodo = hijos[id_palabra] = [0, None]
+                pendientes.append((nodo, hijo))
+
+    def conteo(self, ngrama):
+        """Número de apariciones de una tupla de ids (0 si no existe)"""
+        nodo = self.raiz
+        for id_palabra in ngrama:
+            hijos = nodo[1]
+            if not hijos or id_palabra not in hijos:
+                return 0
+            nodo = hijos[id_palabra]
+        return nodo[0]
+
+    def _nodos(self, nodo, profundidad, camino):
+        if profundidad == 0:
+            yield camino, nodo
+            return
+        if nodo[1]:
+            for id_palabra, hijo in nodo[1].items():
+                yield from self._nodos(hijo, profundidad - 1, camino + (id_palabra,))
+
+    def contextos(self, profundidad):
+        """Genera (contexto, conteo, hijos) para todas las secuencias de esa longitud"""
+        for camino, nodo in self._nodos(self.raiz, profundidad, ()):
+            yield camino, nodo[0], nodo[1] or {}
+
+    def iterar_ngramas(self, n):
+        """Genera (ngrama, conteo_ngrama, conteo_contexto) para el orden n"""
+        if n < 1 or n > self.orden_maximo:
+            return
+        for contexto, conteo_contexto, hijos in self.contextos(n - 1):
+            for id_palabra, hijo in hijos.items():
+                yield contexto + (id_palabra,), hijo[0], conteo_contexto
@@ -0,0 +1,119 @@
+import math
+import time
+import heapq
+import threading
+from collections import OrderedDict
+
+# Expansiones memorizadas entre peticiones: (clave_modelo, tipo, haz, contexto) -> [(id_palabra, log_p)]
+MAX_EXPANSIONES_MEMORIZADAS = 50000
+
+_expansiones = OrderedDict()
+_candado = threading.Lock()
+
+
+def expandir_memorizado(clave, expandir, contexto):
+    """
+    Mejores continuaciones de un contexto, calculadas con expandir(contexto)
+    una sola vez por modelo: las pulsaciones consecutivas de un mismo usuario
+    vuelven a pedir casi los mismos contextos y los reutilizan. La clave debe
+    cambiar con el contenido del modelo (ver _clave_frases en views.py).
+    """
+    clave = (*clave, contexto)
+    with _candado:
+        memorizadas = _expansiones.get(clave)
+        if memorizadas is not None:
+            _expansiones.move_to_end(clave)
+            return memorizadas
+
+    memorizadas = expandir(contexto)
+    with _candado:
+        _expansiones[clave] = memorizadas
+        while len(_expansiones) > MAX_EXPANSIONES_MEMORIZADAS:
+            _expansiones.popitem(last=False)
+    return memorizadas
+
+def expansor_binario(modelo, haz):
+    """Continuaciones más frecuentes en un ModeloBinario, con log P = log(C(h w) / C(h))"""
+    def expandir(contexto):
+        return [(id_palabra, math.log(conteo / conteo_contexto))
+                for id_palabra, conteo, conteo_contexto in modelo.sugerencias(contexto, haz)]
+    return expandir
+
+def expansor_continuaciones(modelo, haz):
+    """
+    Igual que expansor_binario con un modelo compilado: mismas continuaciones,
+    mismo orden (a igual conteo, alfabético) y mismas probabilidades.
+    """
+    continuaciones = modelo['continuaciones']
+    ids = modelo['prefijos'].ids
+    cuantizador = modelo.get('cuantizador')
+
+    def expandir(contexto):
+        datos = continuaciones.get(contexto)
+        if not datos:
+            return []
+        conteo_contexto, rangos, conteos = datos
+        if cuantizador is None:
+            mejores = heapq.nsmallest(haz, zip(conteos, rangos), key=lambda par: (-par[0], par[1]))
+            return [(ids[rango], math.log(conteo / conteo_contexto)) for conteo, rango in mejores]
+        # Niveles: de menor a mayor, con el mismo conteo aproximado que el binario
+        mejores = heapq.nsmallest(haz, zip(conteos, rangos))
+        return [(ids[rango], math.log(cuantizador.conteo(nivel, conteo_contexto) / conteo_contexto))
+                for nivel, rango in mejores]
+    return expandir
+
+def expansor_suavizado(sugerir, suavizado, haz):
+    """Continuaciones según un método de suavizado (ver METODOS_SUAVIZADO), con log del puntaje"""
+    def expandir(contexto):
+        return [(id_palabra, math.log(puntaje))
+                for id_palabra, puntaje, *_ in sugerir(suavizado, contexto, haz) if puntaje > 0]
+    return expandir
+
+def buscar_frases(expandir, contexto, longitud_contexto, palabras, k, haz, segundos, fin=None, iniciales=None):
+    """
+    Búsqueda en haz de las k continuaciones más probables de hasta `palabras`
+    palabras detrás de `contexto` (tupla de ids). En cada paso cada hipótesis
+    se amplía con sus `haz` mejores continuaciones (expandir recibe las
+    últimas longitud_contexto palabras) y se conservan las `haz` mejores por
+    log-probabilidad total. Una hipótesis termina antes si su contexto no
+    tiene continuaciones o si llega a `fin` (el id de </s>). `iniciales`
+    sustituye a la primera expansión (p. ej. las palabras que completan un
+    prefijo). Si se agota el presupuesto de `segundos` se devuelve lo mejor
+    encontrado hasta entonces.
+    Devuelve ([(ids, log_probabilidad)], truncada).
+    """
+    limite = time.perf_counter() + segundos
+    haces = [((), 0.0)]
+    terminadas = []
+    truncada = False
+
+    for paso in range(palabras):
+        candidatas = []
+        for ids, log_probabilidad in haces:
+            if time.perf_counter() > limite:
+                truncada = True
+                break
+            if paso == 0 and iniciales is not None:
+                expansiones = iniciales
+            else:
+                historia = contexto + ids
+                expansiones = expandir(historia[max(0, len(historia) - longitud_contexto):])
+            if not expansiones:
+                if ids:
+                    terminadas.append((ids, log_probabilidad))
+                continue
+            for id_palabra, log_p in expansiones:
+                hipotesis = (ids + (id_palabra,), log_probabilidad + log_p)
+                (terminadas if id_palabra == fin else candidatas).append(hipotesis)
+
+        if truncada:
+            # Las hipótesis sin ampliar siguen siendo frases válidas
+            terminadas.extend(hipotesis for hipotesis in haces if hipotesis[0])
+            haces = candidatas
+            break
+        haces = heapq.nlargest(haz, candidatas, key=lambda hipotesis: hipotesis[1])
+        if not haces:
+            break
+
+    mejores = heapq.nlargest(k, terminadas + haces, key=lambda hipotesis: hipotesis[1])
+    return mejores, truncada
@@ -0,0 +1,236 @@
+import gc
+import os
+import sys
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from analisis.models import TextoAnalizado
+from analisis.cache_modelos import invalidar_modelos, obtener_modelo_binario
+from analisis.columnar import np, calcular_probabilidad_ngramas_columnar
+from analisis.metricas import percentil
+from analisis.utils import STOPWORDS_ES, limpiar_texto, limpiar_texto_con_fronteras
+from analisis.utils import generar_ngramas, calcular_probabilidad_ngramas_general
+from analisis.views import obtener_sugerencias
+
+# resource solo existe en sistemas tipo Unix: en Windows no se mide la memoria del proceso
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Formato del JSON de resultados; una referencia de otra versión no se compara
+VERSION_RESULTADOS = 1
+
+SILABAS = ['la', 'me', 'sa', 'to', 'ra', 'ción', 'pe', 'dro', 'mo', 'ca', 'bi', 'lle',
+           'gua', 'ñu', 'él', 'tri', 'con', 'es', 'pán', 'qui', 'ro', 'ven', 'tú', 'sol']
+PUNTUACION = ['.', '.', '.', ',', ',', ';', '?', '!']
+
+
+def generar_corpus(total_palabras, semilla):
+    """
+    Texto sintético en castellano: palabras inventadas a partir de sílabas
+    con acentos y eñes, mezcladas con stopwords reales, con frecuencias que
+    siguen la ley de Zipf y oraciones con mayúscula inicial y puntuación.
+    Con la misma semilla el texto es siempre el mismo.
+    """
+    aleatorio = random.Random(semilla)
+    vocabulario = sorted(STOPWORDS_ES)
+    inventadas = set()
+    while len(inventadas) < max(100, total_palabras // 20):
+        inventadas.add(''.join(aleatorio.choices(SILABAS, k=aleatorio.randint(1, 4))))
+    vocabulario += sorted(inventadas)
+    aleatorio.shuffle(vocabulario)
+    pesos = [1 / rango for rango in range(1, len(vocabulario) + 1)]
+
+    palabras = aleatorio.choices(vocabulario, weights=pesos, k=total_palabras)
+    partes = []
+    inicio_oracion = True
+    for palabra in palabras:
+        partes.append(palabra.capitalize() if inicio_oracion else palabra)
+        inicio_oracion = False
+        if aleatorio.random() < 0.08:
+            signo = aleatorio.choice(PUNTUACION)
+            partes[-1] += signo
+            inicio_oracion = signo in '.?!'
+    return ' '.join(partes)
+
+def medir(funcion, repeticiones):
+    """Mejor tiempo (s) de varias ejecuciones y pico de memoria (bytes) de una más"""
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    gc.collect()
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'segundos': min(tiempos), 'memoria_pico': pico}
+
+def memoria_maxima_proceso():
+    """Memoria residente máxima del proceso en bytes, o None si no se puede medir"""
+    if resource is None:
+        return None
+    maxima = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS la da en bytes; Linux y el resto de Unix, en KiB
+    return maxima if sys.platform == 'darwin' else maxima * 1024
+
+
+class Command(BaseCommand):
+    help = ('Mide los puntos críticos del análisis de n-gramas con corpus sintéticos '
+            'y compara los resultados con una referencia guardada')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--palabras', type=int, nargs='+', default=[10000, 100000],
+                            help='Tamaños de los corpus sintéticos, en palabras')
+        parser.add_argument('-n', '--n-grama', type=int, nargs='+', default=[2, 3, 4],
+                            help='Órdenes de n-grama a medir')
+        parser.add_argument('--consultas', type=int, default=200,
+                            help='Peticiones a la API de sugerencias por orden')
+        parser.add_argument('--repeticiones', type=int, default=3,
+                            help='Ejecuciones de cada medida (se toma la mejor)')
+        parser.add_argument('--semilla', type=int, default=1234, help='Semilla del generador de corpus')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+        parser.add_argument('--referencia', help='Resultados JSON anteriores con los que comparar')
+        parser.add_argument('--tolerancia', type=float, default=0.2,
+                            help='Empeoramiento relativo admitido frente a la referencia (0.2 = 20 %%)')
+
+    def handle(self, *args, **opciones):
+        for n in opciones['n_grama']:
+            if n < 2 or n > 20:
+                raise CommandError(f'Orden de n-grama no válido: {n}')
+        # Sin consultas no habría latencias de las que sacar percentiles
+        if opciones['consultas'] < 1:
+            raise CommandError('--consultas debe ser al menos 1')
+
+        metricas = {}
+        for total_palabras in opciones['palabras']:
+            contenido = generar_corpus(total_palabras, opciones['semilla'])
+            metricas.update(self.medir_corpus(contenido, total_palabras, opciones))
+
+        resultados = {
+            'version': VERSION_RESULTADOS,
+            'parametros': {clave: opciones[clave] for clave in
+                           ('palabras', 'n_grama', 'consultas', 'repeticiones', 'semilla')},
+            'memoria_maxima_proceso': memoria_maxima_proceso(),
+            'metricas': metricas,
+        }
+
+        if opciones['salida']:
+            with open(opciones['salida'], 'w', encoding='utf-8') as f:
+                json.dump(resultados, f, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultados guardados en {opciones['salida']}")
+
+        if opciones['referencia']:
+            self.comparar(resultados, opciones['referencia'], opciones['tolerancia'])
+
+    def medir_corpus(self, contenido, total_palabras, opciones):
+        repeticiones = opciones['repeticiones']
+        metricas = {}
+
+        def registrar(nombre, medida):
+            metricas[f"{total_palabras}/{nombre}"] = medida
+            self.stdout.write(f"{total_palabras:>9} {nombre:<40} {medida['segundos'] * 1000:10.2f} ms"
+                              f" {medida['memoria_pico'] / 1024 / 1024:9.2f} MB")
+
+        registrar('limpiar_texto', medir(lambda: limpiar_texto(contenido), repeticiones))
+        registrar('limpiar_texto_con_fronteras',
+                  medir(lambda: limpiar_texto_con_fronteras(contenido), repeticiones))
+
+        tokens = limpiar_texto(contenido)
+        for n in opciones['n_grama']:
+            registrar(f'generar_ngramas/{n}', medir(lambda: generar_ngramas(tokens, n), repeticiones))
+            registrar(f'calcular_probabilidad_ngramas_general/{n}',
+                      medir(lambda: calcular_probabilidad_ngramas_general(tokens, n), repeticiones))
+            if np is not None:
+                registrar(f'calcular_probabilidad_ngramas_columnar/{n}',
+                          medir(lambda: calcular_probabilidad_ngramas_columnar(tokens, n), repeticiones))
+
+        for nombre, medida in self.medir_sugerencias(contenido, total_palabras, opciones).items():
+            metricas[f"{total_palabras}/{nombre}"] = medida
+            self.stdout.write(f"{total_palabras:>9} {nombre:<40} p50 {medida['p50'] * 1000:.2f} ms"
+                              f"  p95 {medida['p95'] * 1000:.2f} ms  p99 {medida['p99'] * 1000:.2f} ms")
+        return metricas
+
+    def medir_sugerencias(self, contenido, total_palabras, opciones):
+        """
+        Latencia de extremo a extremo de la API de sugerencias con un texto
+        temporal cuyos modelos se construyen antes de medir. El texto, su
+        archivo y sus modelos viven en un directorio temporal y dentro de una
+        transacción que se deshace al terminar, aunque la medida falle: la
+        base de datos y MEDIA_ROOT reales no cambian.
+        """
+        fabrica = RequestFactory()
+        aleatorio = random.Random(opciones['semilla'])
+        palabras = contenido.split()
+        medidas = {}
+
+        with tempfile.TemporaryDirectory(prefix='bench_ngrams_') as directorio, \
+                override_settings(MEDIA_ROOT=os.path.join(directorio, 'media'),
+                                  MODELOS_CACHE_DIR=os.path.join(directorio, 'cache')), \
+                transaction.atomic():
+            texto_obj = TextoAnalizado(titulo=f'bench_ngrams {total_palabras}')
+            texto_obj.archivo.save(f'bench_ngrams_{total_palabras}.txt', ContentFile(contenido.encode('utf-8')))
+            try:
+                for n in opciones['n_grama']:
+                    obtener_modelo_binario(texto_obj, n)
+                    latencias = []
+                    for _ in range(opciones['consultas']):
+                        inicio_consulta = aleatorio.randrange(max(1, len(palabras) - n))
+                        cuerpo = json.dumps({
+                            'texto_id': texto_obj.id,
+                            'texto': ' '.join(palabras[inicio_consulta:inicio_consulta + n - 1]),
+                            'n_grama': n,
+                        })
+                        peticion = fabrica.post('/api/sugerencias/', cuerpo, content_type='application/json')
+                        inicio = time.perf_counter()
+                        respuesta = obtener_sugerencias(peticion)
+                        latencias.append(time.perf_counter() - inicio)
+                        if respuesta.status_code != 200:
+                            raise CommandError(f'La API de sugerencias respondió {respuesta.status_code}: '
+                                               f'{respuesta.content.decode()}')
+                    medidas[f'obtener_sugerencias/{n}'] = {
+                        'p50': percentil(latencias, 50),
+                        'p95': percentil(latencias, 95),
+                        'p99': percentil(latencias, 99),
+                    }
+            finally:
+                # Los modelos cargados en memoria tampoco deben sobrevivir al texto
+                invalidar_modelos(texto_obj.id)
+                transaction.set_rollback(True)
+        return medidas
+
+    def comparar(self, resultados, ruta_referencia, tolerancia):
+        """Falla si alguna medida empeora más de la tolerancia respecto a la referencia"""
+        try:
+            with open(ruta_referencia, encoding='utf-8') as f:
+                referencia = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'No se pudo leer la referencia {ruta_referencia}: {e}')
+        if referencia.get('version') != VERSION_RESULTADOS:
+            raise CommandError(f'La referencia {ruta_referencia} es de otro formato de resultados')
+
+        regresiones = []
+        for nombre, medida in resultados['metricas'].items():
+            anterior = referencia['metricas'].get(nombre)
+            if anterior is None:
+                continue
+            for clave, valor in medida.items():
+                base = anterior.get(clave)
+                if base and valor > base * (1 + tolerancia):
+                    regresiones.append(f"{nombre} {clave}: {base:.6g} -> {valor:.6g} (+{(valor / base - 1) * 100:.0f} %)")
+
+        if regresiones:
+            raise CommandError('Regresiones respecto a la referencia:\n' + '\n'.join(regresiones))
+        self.stdout.write(self.style.SUCCESS(f'Sin regresiones respecto a {ruta_referencia}'))
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analisis.models import TextoAnalizado, Corpus
+from analisis.cache_modelos import obtener_modelo, obtener_modelo_corpus, obtener_workers_fragmentos
+from analisis.almacen import obtener_modelo_sql
+
+
+class Command(BaseCommand):
+    help = 'Construye y deja en caché los modelos de n-gramas de un texto o de un corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('id', type=int, help='Id del texto (o del corpus con --corpus)')
+        parser.add_argument('-n', '--n-grama', type=int, nargs='+', default=[2, 3],
+                            help='Órdenes a construir (por defecto 2 y 3)')
+        parser.add_argument('--corpus', action='store_true', help='El id es de un corpus de varios textos')
+        parser.add_argument('--fronteras', action='store_true', help='Incluir fronteras de oración')
+        parser.add_argument('--paralelo', action='store_true',
+                            help='Contar los n-gramas del texto por fragmentos en varios procesos')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Procesos para --paralelo (por defecto MODELOS_WORKERS_FRAGMENTOS)')
+        parser.add_argument('--sql', action='store_true',
+                            help='Guardar además los conteos en el almacén de n-gramas de la base de datos')
+
+    def handle(self, *args, **opciones):
+        workers = 1
+        if opciones['paralelo']:
+            workers = opciones['workers'] or obtener_workers_fragmentos()
+
+        try:
+            if opciones['corpus']:
+                origen = Corpus.objects.get(id=opciones['id'])
+            else:
+                origen = TextoAnalizado.objects.get(id=opciones['id'])
+        except (TextoAnalizado.DoesNotExist, Corpus.DoesNotExist):
+            raise CommandError(f"No existe el {'corpus' if opciones['corpus'] else 'texto'} {opciones['id']}")
+
+        for n in opciones['n_grama']:
+            if n < 2 or n > 20:
+                raise CommandError(f'Orden de n-grama no válido: {n}')
+
+            inicio = time.perf_counter()
+            if opciones['corpus']:
+                modelo = obtener_modelo_corpus(origen, n, opciones['fronteras'])
+            else:
+                modelo = obtener_modelo(origen, n, opciones['fronteras'], workers=workers)
+            if opciones['sql']:
+                obtener_modelo_sql(origen, n, opciones['fronteras'])
+            duracion = time.perf_counter() - inicio
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{origen}: {n}-gramas listos en {duracion:.2f} s "
+                f"({modelo['total_palabras']} palabras, {modelo['total_ngramas']} n-gramas)"
+            ))
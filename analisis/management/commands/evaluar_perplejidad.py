@@ -0,0 +1,77 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analisis.models import TextoAnalizado, Corpus
+from analisis.cache_modelos import obtener_modelo, obtener_modelo_corpus
+from analisis.perplejidad import dividir_oraciones, evaluar_oraciones
+
+
+class Command(BaseCommand):
+    help = ('Evalúa con documentos de prueba el modelo de un texto o corpus: log-verosimilitud, '
+            'perplejidad y tasa de palabras fuera del vocabulario para varios órdenes de n-grama')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivos', nargs='+', help='Documentos de prueba (texto plano)')
+        origen = parser.add_mutually_exclusive_group(required=True)
+        origen.add_argument('--texto', type=int, help='Id del texto con el que se entrena el modelo')
+        origen.add_argument('--corpus', type=int, help='Id del corpus con el que se entrena el modelo')
+        parser.add_argument('-n', '--n-grama', type=int, nargs='+', default=[2, 3, 4, 5, 6],
+                            help='Órdenes de n-grama a evaluar')
+        parser.add_argument('--fronteras', action='store_true', help='Usar el modelo con fronteras <s> y </s>')
+        parser.add_argument('--por-oracion', action='store_true',
+                            help='Incluir la perplejidad de cada oración en el JSON de salida')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+
+    def handle(self, *args, **opciones):
+        ordenes = sorted(set(opciones['n_grama']))
+        for n in ordenes:
+            if n < 2 or n > 20:
+                raise CommandError(f'Orden de n-grama no válido: {n}')
+
+        oraciones = []
+        for ruta in opciones['archivos']:
+            try:
+                with open(ruta, encoding='utf-8') as f:
+                    oraciones.extend(dividir_oraciones(f.read()))
+            except OSError as e:
+                raise CommandError(f'No se pudo leer {ruta}: {e}')
+        if not oraciones:
+            raise CommandError('Los documentos de prueba no tienen ninguna oración')
+
+        # Todos los órdenes se evalúan con el modelo del orden mayor
+        inicio = time.perf_counter()
+        if opciones['texto']:
+            origen = TextoAnalizado.objects.filter(id=opciones['texto']).first()
+            obtener = obtener_modelo
+        else:
+            origen = Corpus.objects.filter(id=opciones['corpus']).first()
+            obtener = obtener_modelo_corpus
+        if origen is None:
+            raise CommandError('No existe el texto o corpus indicado')
+        modelo = obtener(origen, ordenes[-1], opciones['fronteras'])
+        self.stdout.write(f"Modelo de orden {ordenes[-1]} listo en {time.perf_counter() - inicio:.2f} s; "
+                          f"{len(oraciones)} oraciones de prueba")
+
+        inicio = time.perf_counter()
+        resultados = evaluar_oraciones(modelo, oraciones, ordenes)
+        segundos = time.perf_counter() - inicio
+
+        for resultado in resultados:
+            perplejidad = resultado['perplejidad']
+            self.stdout.write(
+                f"n={resultado['n_grama']:<2} log-verosimilitud {resultado['log_verosimilitud']:.2f}  "
+                f"perplejidad {f'{perplejidad:.2f}' if perplejidad is not None else '-'}  "
+                f"tokens {resultado['tokens']}  OOV {resultado['tasa_oov'] * 100:.2f} %"
+            )
+        self.stdout.write(f"Evaluación de {len(ordenes)} órdenes en {segundos:.2f} s")
+
+        if opciones['salida']:
+            if not opciones['por_oracion']:
+                for resultado in resultados:
+                    del resultado['oraciones']
+            with open(opciones['salida'], 'w', encoding='utf-8') as f:
+                json.dump({'ordenes': resultados, 'total_oraciones': len(oraciones), 'segundos': segundos},
+                          f, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultados guardados en {opciones['salida']}")
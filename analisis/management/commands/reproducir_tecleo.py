@@ -0,0 +1,218 @@
+import re
+import json
+import time
+import random
+import threading
+import urllib.error
+import urllib.request
+from http.cookiejar import CookieJar
+from itertools import product
+
+from django.conf import settings
+from django.db import connections
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from analisis.models import TextoAnalizado
+from analisis.cache_modelos import obtener_modelo_binario
+from analisis.metricas import percentil
+
+RUTA_SUGERENCIAS = '/api/sugerencias/'
+# Página con formulario que deja la cookie CSRF
+RUTA_TOKEN = '/subir/'
+PALABRA = re.compile(r'[^\W\d_]+')
+
+# Opciones que se guardan junto a los resultados
+OPCIONES_RESULTADOS = ('textos', 'usuarios', 'sesiones', 'palabras', 'n_grama', 'max_sugerencias',
+                       'completar', 'pausa', 'url', 'semilla')
+
+
+def formatear_ms(segundos):
+    """Duración en milisegundos para el resumen, o n/a si no hubo medidas"""
+    return 'n/a' if segundos is None else f"{segundos * 1000:.2f} ms"
+
+def formatear_porcentaje(fraccion):
+    """Fracción como porcentaje para el resumen, o n/a si no hubo medidas"""
+    return 'n/a' if fraccion is None else f"{fraccion * 100:.2f} %"
+
+def generar_sesiones(textos, total, palabras_por_sesion, aleatorio):
+    """
+    Sesiones de tecleo: (texto_id, frase) con frases reales tomadas de
+    posiciones al azar de los textos subidos.
+    """
+    palabras_textos = []
+    for texto_obj in textos:
+        with texto_obj.archivo.open('r') as archivo:
+            palabras = PALABRA.findall(archivo.read())
+        if len(palabras) > palabras_por_sesion:
+            palabras_textos.append((texto_obj.id, palabras))
+    if not palabras_textos:
+        raise CommandError(f'Ningún texto tiene más de {palabras_por_sesion} palabras')
+
+    sesiones = []
+    for _ in range(total):
+        texto_id, palabras = aleatorio.choice(palabras_textos)
+        inicio = aleatorio.randrange(len(palabras) - palabras_por_sesion)
+        sesiones.append((texto_id, ' '.join(palabras[inicio:inicio + palabras_por_sesion]).lower()))
+    return sesiones
+
+
+class ClienteLocal:
+    """Peticiones con el cliente de pruebas de Django, en este mismo proceso"""
+
+    def __init__(self):
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+        self.cliente = Client(HTTP_HOST=hosts[0] if hosts else 'localhost')
+
+    def enviar(self, cuerpo):
+        respuesta = self.cliente.post(RUTA_SUGERENCIAS, cuerpo, content_type='application/json')
+        return respuesta.status_code
+
+
+class ClienteHTTP:
+    """Peticiones a un servidor en marcha, con su cookie y token CSRF como el navegador"""
+
+    def __init__(self, url_base):
+        self.url_base = url_base.rstrip('/')
+        galletas = CookieJar()
+        self.abridor = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(galletas))
+        self.abridor.open(f"{self.url_base}{RUTA_TOKEN}").read()
+        self.token = next((galleta.value for galleta in galletas if galleta.name == 'csrftoken'), '')
+
+    def enviar(self, cuerpo):
+        peticion = urllib.request.Request(
+            f"{self.url_base}{RUTA_SUGERENCIAS}", data=cuerpo.encode('utf-8'), method='POST',
+            headers={'Content-Type': 'application/json', 'X-CSRFToken': self.token,
+                     'Referer': f"{self.url_base}{RUTA_TOKEN}"}
+        )
+        try:
+            with self.abridor.open(peticion) as respuesta:
+                respuesta.read()
+                return respuesta.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class Command(BaseCommand):
+    help = ('Reproduce sesiones de tecleo contra la API de sugerencias (una petición por '
+            'carácter) con varios usuarios simultáneos y mide rendimiento, latencia y errores')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--textos', type=int, nargs='+', help='Ids de los textos (por defecto todos)')
+        parser.add_argument('--usuarios', type=int, default=10, help='Usuarios simultáneos')
+        parser.add_argument('--sesiones', type=int, default=5, help='Frases que teclea cada usuario')
+        parser.add_argument('--palabras', type=int, default=6, help='Palabras por frase')
+        parser.add_argument('-n', '--n-grama', type=int, nargs='+', default=[3],
+                            help='Órdenes de n-grama a probar')
+        parser.add_argument('--max-sugerencias', type=int, nargs='+', default=[5],
+                            help='Valores de max_sugerencias a probar')
+        parser.add_argument('--completar', action='store_true', help='Pedir que se complete la palabra en curso')
+        parser.add_argument('--pausa', type=float, default=0,
+                            help='Milisegundos entre pulsaciones de cada usuario')
+        parser.add_argument('--url', help='Servidor en marcha (p. ej. http://127.0.0.1:8000); '
+                                          'sin ella se usa el cliente de pruebas de Django')
+        parser.add_argument('--semilla', type=int, default=1234, help='Semilla para elegir las frases')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+
+    def handle(self, *args, **opciones):
+        textos = TextoAnalizado.objects.order_by('id')
+        if opciones['textos']:
+            textos = textos.filter(id__in=opciones['textos'])
+        textos = list(textos)
+        if not textos:
+            raise CommandError('No hay textos con los que generar las sesiones')
+        for n in opciones['n_grama']:
+            if n < 2 or n > 20:
+                raise CommandError(f'Orden de n-grama no válido: {n}')
+
+        aleatorio = random.Random(opciones['semilla'])
+        sesiones = generar_sesiones(textos, opciones['usuarios'] * opciones['sesiones'],
+                                    opciones['palabras'], aleatorio)
+
+        # Los modelos se construyen antes para no medir su construcción
+        for texto_obj, n in product(textos, opciones['n_grama']):
+            obtener_modelo_binario(texto_obj, n)
+
+        resultados = []
+        for n, max_sugerencias in product(opciones['n_grama'], opciones['max_sugerencias']):
+            resultado = self.ejecutar(sesiones, n, max_sugerencias, opciones)
+            resultados.append(resultado)
+            self.stdout.write(
+                f"n={n:<2} max_sugerencias={max_sugerencias:<2} "
+                f"{resultado['peticiones']} peticiones en {resultado['segundos']:.2f} s "
+                f"({resultado['peticiones_por_segundo']:.1f}/s)  "
+                f"p50 {formatear_ms(resultado['p50'])}  p95 {formatear_ms(resultado['p95'])}  "
+                f"p99 {formatear_ms(resultado['p99'])}  máx {formatear_ms(resultado['maximo'])}  "
+                f"errores {formatear_porcentaje(resultado['tasa_error'])}  construyendo {resultado['construyendo']}"
+            )
+
+        if opciones['salida']:
+            with open(opciones['salida'], 'w', encoding='utf-8') as f:
+                json.dump({'opciones': {clave: opciones[clave] for clave in OPCIONES_RESULTADOS},
+                           'resultados': resultados}, f, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultados guardados en {opciones['salida']}")
+
+    def ejecutar(self, sesiones, n, max_sugerencias, opciones):
+        """Reparte las sesiones entre los usuarios, las reproduce a la vez y resume las medidas"""
+        usuarios = opciones['usuarios']
+        pausa = opciones['pausa'] / 1000
+        latencias = []
+        estados = {}
+        candado = threading.Lock()
+
+        try:
+            clientes = [ClienteHTTP(opciones['url']) if opciones['url'] else ClienteLocal()
+                        for _ in range(usuarios)]
+        except OSError as e:
+            raise CommandError(f"No se pudo conectar con {opciones['url']}: {e}")
+
+        def usuario(cliente, propias):
+            medidas = []
+            for texto_id, frase in propias:
+                for posicion in range(1, len(frase) + 1):
+                    cuerpo = json.dumps({
+                        'texto_id': texto_id,
+                        'texto': frase[:posicion],
+                        'n_grama': n,
+                        'max_sugerencias': max_sugerencias,
+                        'completar': opciones['completar'],
+                    })
+                    inicio = time.perf_counter()
+                    try:
+                        estado = cliente.enviar(cuerpo)
+                    except OSError:
+                        estado = 'sin_conexion'
+                    medidas.append((time.perf_counter() - inicio, estado))
+                    if pausa:
+                        time.sleep(pausa)
+            connections.close_all()
+            with candado:
+                for duracion, estado in medidas:
+                    latencias.append(duracion)
+                    estados[estado] = estados.get(estado, 0) + 1
+
+        hilos = [threading.Thread(target=usuario, args=(clientes[i], sesiones[i::usuarios])) for i in range(usuarios)]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        segundos = time.perf_counter() - inicio
+
+        # Sin peticiones (p. ej. frases vacías) no hay latencias: se informa n/a
+        peticiones = len(latencias)
+        errores = sum(total for estado, total in estados.items() if estado not in (200, 202))
+        return {
+            'n_grama': n,
+            'max_sugerencias': max_sugerencias,
+            'peticiones': peticiones,
+            'segundos': segundos,
+            'peticiones_por_segundo': peticiones / segundos if segundos else 0.0,
+            'p50': percentil(latencias, 50),
+            'p95': percentil(latencias, 95),
+            'p99': percentil(latencias, 99),
+            'maximo': max(latencias, default=None),
+            'tasa_error': errores / peticiones if peticiones else None,
+            'construyendo': estados.get(202, 0),
+            'estados': {str(estado): total for estado, total in estados.items()},
+        }
@@ -0,0 +1,167 @@
+import math
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+# Límites (s) de los intervalos de los histogramas de latencia
+LIMITES_HISTOGRAMA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Etapas medidas durante la petición en curso: lista de (nombre, segundos)
+_etapas_peticion = ContextVar('etapas_peticion', default=None)
+
+# Histogramas por nombre: [conteos por intervalo (+ uno final para el resto), suma, total]
+_histogramas = {}
+# Peticiones atendidas: (vista, método, estado) -> número
+_peticiones = {}
+_candado = threading.Lock()
+
+_SIN_MEDICION = nullcontext()
+
+
+def metricas_activadas():
+    return getattr(settings, 'METRICAS_ACTIVADAS', False)
+
+def percentil(valores, p):
+    """Percentil p (0-100) por el método del rango más cercano; None sin valores"""
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+def observar(nombre, segundos):
+    """Añade una duración al histograma de la etapa"""
+    with _candado:
+        histograma = _histogramas.get(nombre)
+        if histograma is None:
+            histograma = _histogramas[nombre] = [[0] * (len(LIMITES_HISTOGRAMA) + 1), 0.0, 0]
+        intervalo = 0
+        while intervalo < len(LIMITES_HISTOGRAMA) and segundos > LIMITES_HISTOGRAMA[intervalo]:
+            intervalo += 1
+        histograma[0][intervalo] += 1
+        histograma[1] += segundos
+        histograma[2] += 1
+
+@contextmanager
+def _medir(nombre):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        observar(nombre, duracion)
+        etapas = _etapas_peticion.get()
+        if etapas is not None:
+            etapas.append((nombre, duracion))
+
+def etapa(nombre):
+    """
+    Mide el bloque `with etapa(nombre):` para el histograma de la etapa y la
+    cabecera Server-Timing de la petición en curso. Desactivadas las métricas
+    no hace nada.
+    """
+    if not metricas_activadas():
+        return _SIN_MEDICION
+    return _medir(nombre)
+
+def cabecera_server_timing(etapas):
+    """Valor de Server-Timing: una entrada por etapa, sumando las repetidas"""
+    totales = {}
+    for nombre, duracion in etapas:
+        totales[nombre] = totales.get(nombre, 0.0) + duracion
+    return ', '.join(f"{nombre};dur={duracion * 1000:.2f}" for nombre, duracion in totales.items())
+
+
+class MetricasMiddleware:
+    """
+    Mide la duración de cada petición, la cuenta por vista y estado y añade a
+    la respuesta la cabecera Server-Timing con las etapas medidas en ella.
+    Admite las dos cadenas de middleware: bajo ASGI no obliga a pasar las
+    vistas asíncronas por un hilo.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metricas_activadas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        etapas = []
+        testigo = _etapas_peticion.set(etapas)
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            _etapas_peticion.reset(testigo)
+        return self._registrar(request, respuesta, etapas, time.perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        etapas = []
+        testigo = _etapas_peticion.set(etapas)
+        inicio = time.perf_counter()
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            _etapas_peticion.reset(testigo)
+        return self._registrar(request, respuesta, etapas, time.perf_counter() - inicio)
+
+    def _registrar(self, request, respuesta, etapas, duracion):
+        vista = request.resolver_match.url_name if request.resolver_match else 'sin_ruta'
+        observar(f'peticion:{vista}', duracion)
+        with _candado:
+            clave = (vista, request.method, respuesta.status_code)
+            _peticiones[clave] = _peticiones.get(clave, 0) + 1
+
+        respuesta['Server-Timing'] = cabecera_server_timing(etapas + [('total', duracion)])
+        return respuesta
+
+
+def _etiquetas(**valores):
+    return ','.join(f'{clave}="{valor}"' for clave, valor in valores.items())
+
+def exportar_texto(extra=()):
+    """
+    Métricas en el formato de texto de Prometheus: histogramas de las etapas
+    y de las peticiones por vista, contadores de peticiones y las métricas
+    adicionales que se pasen como (nombre, etiquetas, valor).
+    """
+    with _candado:
+        histogramas = {nombre: (list(conteos), suma, total)
+                       for nombre, (conteos, suma, total) in _histogramas.items()}
+        peticiones = dict(_peticiones)
+
+    lineas = []
+    for metrica, prefijo, etiqueta in (('analisis_etapa_segundos', '', 'etapa'),
+                                       ('analisis_peticion_segundos', 'peticion:', 'vista')):
+        lineas.append(f'# TYPE {metrica} histogram')
+        for nombre in sorted(histogramas):
+            es_peticion = nombre.startswith('peticion:')
+            if es_peticion != bool(prefijo):
+                continue
+            conteos, suma, total = histogramas[nombre]
+            valor_etiqueta = nombre[len(prefijo):]
+            acumulado = 0
+            for limite, conteo in zip(LIMITES_HISTOGRAMA + ('+Inf',), conteos):
+                acumulado += conteo
+                lineas.append(f'{metrica}_bucket{{{_etiquetas(**{etiqueta: valor_etiqueta, "le": limite})}}} {acumulado}')
+            lineas.append(f'{metrica}_sum{{{_etiquetas(**{etiqueta: valor_etiqueta})}}} {suma:.6f}')
+            lineas.append(f'{metrica}_count{{{_etiquetas(**{etiqueta: valor_etiqueta})}}} {total}')
+
+    lineas.append('# TYPE analisis_peticiones_total counter')
+    for (vista, metodo, estado), total in sorted(peticiones.items()):
+        lineas.append(f'analisis_peticiones_total{{{_etiquetas(vista=vista, metodo=metodo, estado=estado)}}} {total}')
+
+    for nombre, etiquetas, valor in extra:
+        lineas.append(f'{nombre}{{{_etiquetas(**etiquetas)}}} {valor}' if etiquetas else f'{nombre} {valor}')
+    return '\n'.join(lineas) + '\n'
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='duracion_construccion',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='error_construccion',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='estado_modelo',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('construyendo', 'Construyendo'), ('listo', 'Listo'), ('error', 'Error')], default='pendiente', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='fin_construccion',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='inicio_construccion',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='textoanalizado',
+            name='progreso_modelo',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0002_estado_modelo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Corpus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado_modelo', models.CharField(choices=[('pendiente', 'Pendiente'), ('construyendo', 'Construyendo'), ('listo', 'Listo'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('progreso_modelo', models.PositiveSmallIntegerField(default=0)),
+                ('inicio_construccion', models.DateTimeField(blank=True, null=True)),
+                ('fin_construccion', models.DateTimeField(blank=True, null=True)),
+                ('duracion_construccion', models.FloatField(blank=True, null=True)),
+                ('error_construccion', models.TextField(blank=True)),
+                ('nombre', models.CharField(max_length=200)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('textos', models.ManyToManyField(related_name='corpus', to='analisis.textoanalizado')),
+            ],
+            options={
+                'verbose_name_plural': 'corpus',
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0003_corpus'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModeloNgramas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usar_fronteras', models.BooleanField(default=False)),
+                ('orden_maximo', models.PositiveSmallIntegerField()),
+                ('hash_contenido', models.CharField(max_length=64)),
+                ('total_palabras', models.PositiveIntegerField(default=0)),
+                ('totales_ngramas', models.JSONField(default=dict)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('corpus', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='modelos_ngramas', to='analisis.corpus')),
+                ('texto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='modelos_ngramas', to='analisis.textoanalizado')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Ngrama',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orden', models.PositiveSmallIntegerField()),
+                ('contexto', models.CharField(max_length=1000)),
+                ('palabra', models.CharField(max_length=200)),
+                ('conteo', models.PositiveIntegerField()),
+                ('conteo_contexto', models.PositiveIntegerField()),
+                ('modelo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ngramas', to='analisis.modelongramas')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['modelo', 'orden', 'contexto', '-conteo'], name='ngrama_contexto')],
+                'constraints': [models.UniqueConstraint(fields=('modelo', 'orden', 'contexto', 'palabra'), name='ngrama_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+def borrar_volcados(apps, schema_editor):
+    # Los volcados son una caché que se reconstruye al pedirla: los anteriores
+    # no tienen clave_contexto y se descartan
+    apps.get_model('analisis', 'ModeloNgramas').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0004_almacen_ngramas'),
+    ]
+
+    operations = [
+        migrations.RunPython(borrar_volcados, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='ngrama',
+            name='ngrama_unico',
+        ),
+        migrations.RemoveIndex(
+            model_name='ngrama',
+            name='ngrama_contexto',
+        ),
+        migrations.AlterField(
+            model_name='ngrama',
+            name='contexto',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='ngrama',
+            name='palabra',
+            field=models.TextField(),
+        ),
+        migrations.AddField(
+            model_name='ngrama',
+            name='clave_contexto',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='ngrama',
+            index=models.Index(fields=['modelo', 'orden', 'clave_contexto', '-conteo'], name='ngrama_contexto'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analisis', '0005_ngrama_clave_contexto'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ngrama',
+            constraint=models.UniqueConstraint(fields=('modelo', 'orden', 'clave_contexto', 'palabra'), name='ngrama_unico'),
+        ),
+    ]
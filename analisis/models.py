@@ -1,9 +1,87 @@
 from django.db import models
 
 # Create your models here.
-class TextoAnalizado(models.Model): 
+class EstadoConstruccion(models.Model):
+    """Estado de la construcción en segundo plano de los modelos de n-gramas"""
+    ESTADO_PENDIENTE = 'pendiente'
+    ESTADO_CONSTRUYENDO = 'construyendo'
+    ESTADO_LISTO = 'listo'
+    ESTADO_ERROR = 'error'
+    ESTADOS_MODELO = [
+        (ESTADO_PENDIENTE, 'Pendiente'),
+        (ESTADO_CONSTRUYENDO, 'Construyendo'),
+        (ESTADO_LISTO, 'Listo'),
+        (ESTADO_ERROR, 'Error'),
+    ]
+
+    estado_modelo = models.CharField(max_length=20, choices=ESTADOS_MODELO, default=ESTADO_PENDIENTE)
+    progreso_modelo = models.PositiveSmallIntegerField(default=0)
+    inicio_construccion = models.DateTimeField(null=True, blank=True)
+    fin_construccion = models.DateTimeField(null=True, blank=True)
+    duracion_construccion = models.FloatField(null=True, blank=True)
+    error_construccion = models.TextField(blank=True)
+
+    class Meta:
+        abstract = True
+
+class TextoAnalizado(EstadoConstruccion): 
     titulo = models.CharField(max_length=200) 
     archivo = models.FileField(upload_to='textos/') 
     fecha_subida = models.DateTimeField(auto_now_add=True) 
+
     def __str__(self): 
-        return self.titulo
\ No newline at end of file
+        return self.titulo
+
+class Corpus(EstadoConstruccion):
+    """Grupo de textos con un modelo de n-gramas común"""
+    nombre = models.CharField(max_length=200)
+    textos = models.ManyToManyField(TextoAnalizado, related_name='corpus')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'corpus'
+
+    def __str__(self):
+        return self.nombre
+
+class ModeloNgramas(models.Model):
+    """
+    Conteos de n-gramas de un texto o de un corpus guardados en la base de
+    datos (ver almacen.py), para responder sugerencias sin cargar el modelo
+    en memoria.
+    """
+    texto = models.ForeignKey(TextoAnalizado, null=True, blank=True, on_delete=models.CASCADE,
+                              related_name='modelos_ngramas')
+    corpus = models.ForeignKey(Corpus, null=True, blank=True, on_delete=models.CASCADE,
+                               related_name='modelos_ngramas')
+    usar_fronteras = models.BooleanField(default=False)
+    orden_maximo = models.PositiveSmallIntegerField()
+    hash_contenido = models.CharField(max_length=64)
+    total_palabras = models.PositiveIntegerField(default=0)
+    # Número de n-gramas distintos de cada orden: {"1": ..., "2": ...}
+    totales_ngramas = models.JSONField(default=dict)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.texto or self.corpus} ({self.orden_maximo}-gramas)"
+
+class Ngrama(models.Model):
+    """Un n-grama (contexto + palabra) de un ModeloNgramas con su conteo"""
+    modelo = models.ForeignKey(ModeloNgramas, on_delete=models.CASCADE, related_name='ngramas')
+    orden = models.PositiveSmallIntegerField()
+    # Sin límite de longitud: hasta 19 palabras de contexto en los órdenes altos
+    contexto = models.TextField()
+    palabra = models.TextField()
+    # SHA-256 del contexto, lo que se indexa (ver almacen.clave_contexto)
+    clave_contexto = models.CharField(max_length=64)
+    conteo = models.PositiveIntegerField()
+    conteo_contexto = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            # Sirve directamente la consulta de sugerencias: un contexto, de mayor a menor conteo
+            models.Index(fields=['modelo', 'orden', 'clave_contexto', '-conteo'], name='ngrama_contexto'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['modelo', 'orden', 'clave_contexto', 'palabra'], name='ngrama_unico'),
+        ]
@@ -0,0 +1,140 @@
+import math
+import re
+
+from .suavizado import DESCUENTO_POR_DEFECTO, TOTAL, TOTAL_CONTINUACION, DISTINTOS, DISTINTOS_CONTINUACION, HIJOS
+from .utils import TOKENIZADOR
+
+# Un documento se divide en oraciones por la puntuación final y los saltos de línea
+FIN_ORACION = re.compile(r'[.!?…]+|\n+')
+
+
+def dividir_oraciones(documento):
+    """Oraciones no vacías de un documento de prueba"""
+    return [oracion for oracion in FIN_ORACION.split(documento) if oracion.strip()]
+
+
+class TablasLogProbabilidad:
+    """
+    Log-probabilidades Kneser-Ney de un modelo compilado, las mismas que
+    probabilidad_kneser_ney, guardadas en tablas a medida que se calculan:
+    cada (contexto, palabra) se calcula una sola vez y los valores de los
+    órdenes inferiores se reutilizan en todas las posiciones y en todos los
+    órdenes que se evalúan con el mismo modelo. Así un barrido de órdenes
+    sobre un conjunto de prueba grande cuesta un acceso a diccionario por
+    posición repetida.
+    """
+
+    def __init__(self, modelo):
+        suavizado = modelo['suavizado']
+        self.orden_maximo = modelo['n_grama']
+        self.usar_fronteras = modelo['usar_fronteras']
+        self.vocabulario = modelo['vocabulario']
+        self.tabla = suavizado['tabla']
+        self.descuentos = suavizado['descuentos']
+        self.base = 1.0 / max(suavizado['total_vocabulario'], 1)
+        # (contexto, id_palabra) -> P con conteos de continuación (órdenes inferiores)
+        self._inferiores = {}
+        # (contexto, id_palabra) -> log P del orden más alto, con conteos
+        self._logaritmos = {}
+
+    def _interpolar(self, contexto, id_palabra, probabilidad, continuacion):
+        entrada = self.tabla.get(contexto)
+        if not entrada:
+            return probabilidad
+        if continuacion:
+            total, distintos, indice = entrada[TOTAL_CONTINUACION], entrada[DISTINTOS_CONTINUACION], 1
+        else:
+            total, distintos, indice = entrada[TOTAL], entrada[DISTINTOS], 0
+        if not total:
+            return probabilidad
+        descuento = self.descuentos.get(len(contexto) + 1, DESCUENTO_POR_DEFECTO)
+        valores = entrada[HIJOS].get(id_palabra)
+        conteo = valores[indice] if valores else 0
+        return max(conteo - descuento, 0) / total + descuento * distintos / total * probabilidad
+
+    def _inferior(self, contexto, id_palabra):
+        clave = (contexto, id_palabra)
+        probabilidad = self._inferiores.get(clave)
+        if probabilidad is None:
+            anterior = self._inferior(contexto[1:], id_palabra) if contexto else self.base
+            probabilidad = self._inferiores[clave] = self._interpolar(contexto, id_palabra, anterior, True)
+        return probabilidad
+
+    def log_probabilidad(self, contexto, id_palabra):
+        """ln P_KN(palabra|contexto), con el contexto como tupla de ids de hasta orden_maximo-1"""
+        clave = (contexto, id_palabra)
+        logaritmo = self._logaritmos.get(clave)
+        if logaritmo is None:
+            anterior = self._inferior(contexto[1:], id_palabra) if contexto else self.base
+            logaritmo = self._logaritmos[clave] = math.log(self._interpolar(contexto, id_palabra, anterior, False))
+        return logaritmo
+
+    def codificar(self, oracion):
+        """
+        Ids de los tokens de una oración, con la misma limpieza que el modelo
+        (None para las palabras fuera del vocabulario), y la posición del
+        primer token que se puntúa: con fronteras <s> solo sirve de contexto.
+        """
+        tokens = TOKENIZADOR.limpiar(oracion, fronteras=self.usar_fronteras)
+        ids = self.vocabulario.ids
+        return [ids.get(token) for token in tokens], 1 if self.usar_fronteras and tokens else 0
+
+    def puntuar(self, ids, inicio, n):
+        """
+        (log-verosimilitud, tokens puntuados, tokens fuera del vocabulario) de
+        una oración codificada con n-gramas de orden n. Las palabras fuera del
+        vocabulario no se puntúan y el contexto vuelve a empezar tras ellas.
+        """
+        log_verosimilitud = 0.0
+        puntuados = desconocidos = 0
+        inicio_contexto = 0
+        for posicion in range(inicio, len(ids)):
+            id_palabra = ids[posicion]
+            if id_palabra is None:
+                desconocidos += 1
+                inicio_contexto = posicion + 1
+                continue
+            contexto = tuple(ids[max(inicio_contexto, posicion - n + 1):posicion])
+            log_verosimilitud += self.log_probabilidad(contexto, id_palabra)
+            puntuados += 1
+        return log_verosimilitud, puntuados, desconocidos
+
+
+def _perplejidad(log_verosimilitud, tokens):
+    return math.exp(-log_verosimilitud / tokens) if tokens else None
+
+def evaluar_oraciones(modelo, oraciones, ordenes):
+    """
+    Log-verosimilitud total, perplejidad y tasa de palabras fuera del
+    vocabulario (OOV) de un lote de oraciones para cada orden de `ordenes`
+    (ninguno mayor que el del modelo), con el detalle por oración. Todos los
+    órdenes comparten las tablas de log-probabilidades.
+    """
+    tablas = TablasLogProbabilidad(modelo)
+    codificadas = [tablas.codificar(oracion) for oracion in oraciones]
+
+    resultados = []
+    for n in ordenes:
+        por_oracion = []
+        for ids, inicio in codificadas:
+            log_verosimilitud, puntuados, desconocidos = tablas.puntuar(ids, inicio, n)
+            por_oracion.append({
+                'log_verosimilitud': log_verosimilitud,
+                'tokens': puntuados,
+                'oov': desconocidos,
+                'perplejidad': _perplejidad(log_verosimilitud, puntuados),
+            })
+
+        log_verosimilitud = math.fsum(oracion['log_verosimilitud'] for oracion in por_oracion)
+        puntuados = sum(oracion['tokens'] for oracion in por_oracion)
+        desconocidos = sum(oracion['oov'] for oracion in por_oracion)
+        resultados.append({
+            'n_grama': n,
+            'log_verosimilitud': log_verosimilitud,
+            'perplejidad': _perplejidad(log_verosimilitud, puntuados),
+            'tokens': puntuados,
+            'oov': desconocidos,
+            'tasa_oov': desconocidos / (puntuados + desconocidos) if puntuados + desconocidos else 0.0,
+            'oraciones': por_oracion,
+        })
+    return resultados
@@ -0,0 +1,142 @@
+import json
+import math
+import heapq
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Opciones de MODELOS_PODA y su valor por defecto (sin poda ni cuantización)
+PODA_POR_DEFECTO = {
+    # {orden: conteo mínimo}; un orden sin entrada usa el del orden inferior
+    # más cercano que la tenga, así {3: 2} exige 2 apariciones desde el orden 3
+    'conteo_minimo': {},
+    # Continuaciones que se conservan como máximo en cada contexto
+    'max_continuaciones': None,
+    # Contribución mínima a la entropía relativa (ver perdida_entropia)
+    'umbral_entropia': None,
+    # Bits de los niveles de probabilidad del análisis y de las continuaciones
+    # que sirven las sugerencias (ver NivelesProbabilidad)
+    'bits_cuantizacion': None,
+}
+
+# Probabilidad más pequeña que distinguen los niveles: ln(1e-9)
+LOG_PROBABILIDAD_MINIMA = math.log(1e-9)
+
+
+def opciones_poda():
+    """MODELOS_PODA completado con los valores por defecto, o None si no poda ni cuantiza nada"""
+    configuradas = getattr(settings, 'MODELOS_PODA', None) or {}
+    desconocidas = set(configuradas) - set(PODA_POR_DEFECTO)
+    if desconocidas:
+        raise ImproperlyConfigured(f"Opciones de MODELOS_PODA desconocidas: {', '.join(sorted(desconocidas))}")
+    poda = {**PODA_POR_DEFECTO, **configuradas}
+    bits = poda['bits_cuantizacion']
+    if bits is not None and not 1 <= bits <= 16:
+        raise ImproperlyConfigured('MODELOS_PODA["bits_cuantizacion"] debe estar entre 1 y 16')
+    return poda if any(poda.values()) else None
+
+def cuantizador_poda(poda):
+    """NivelesProbabilidad de unas opciones de poda, o None si no cuantizan"""
+    return NivelesProbabilidad(poda['bits_cuantizacion']) if poda and poda['bits_cuantizacion'] else None
+
+def firma_poda(poda):
+    """Identificador corto de unas opciones de poda ('' sin poda), para las claves de caché"""
+    if not poda:
+        return ''
+    return hashlib.sha256(json.dumps(poda, sort_keys=True).encode()).hexdigest()[:12]
+
+def conteo_minimo(poda, orden):
+    """Conteo mínimo de los n-gramas de un orden"""
+    minimos = poda['conteo_minimo']
+    definidos = [definido for definido in minimos if int(definido) <= orden]
+    return minimos[max(definidos, key=int)] if definidos else 1
+
+def perdida_entropia(conteo_ngrama, conteo_contexto, conteo_ngrama_corto, conteo_contexto_corto, total_palabras):
+    """
+    Lo que aporta un n-grama a la entropía relativa del modelo (criterio de
+    Stolcke, con las estimaciones de máxima verosimilitud):
+    P(h, w) · |log P(w|h) - log P(w|h')|, con h' el contexto sin su primera
+    palabra, que es el que se usa si el n-grama se elimina.
+    """
+    return (conteo_ngrama / total_palabras
+            * abs(math.log(conteo_ngrama / conteo_contexto)
+                  - math.log(conteo_ngrama_corto / conteo_contexto_corto)))
+
+def continuaciones_conservadas(poda, contexto, conteos, conteo_contexto, conteo):
+    """
+    Ids de las continuaciones de un contexto que sobreviven a la poda, en su
+    orden original. `conteos` es {id_palabra: C(contexto palabra)} y
+    `conteo(ngrama)` da el conteo sin podar de cualquier n-grama (con () el
+    total de palabras). Se quitan los n-gramas por debajo del mínimo de su
+    orden y los que aportan menos que el umbral de entropía; de los que
+    quedan se conservan los max_continuaciones más frecuentes. Los unigramas
+    nunca se podan.
+    """
+    orden = len(contexto) + 1
+    if orden == 1:
+        return list(conteos)
+
+    minimo = conteo_minimo(poda, orden)
+    conservados = [id_palabra for id_palabra, veces in conteos.items() if veces >= minimo]
+
+    umbral = poda['umbral_entropia']
+    if umbral:
+        corto = contexto[1:]
+        conteo_corto = conteo(corto)
+        total_palabras = conteo(())
+        conservados = [
+            id_palabra for id_palabra in conservados
+            if perdida_entropia(conteos[id_palabra], conteo_contexto, conteo(corto + (id_palabra,)),
+                                conteo_corto, total_palabras) >= umbral
+        ]
+
+    maximo = poda['max_continuaciones']
+    if maximo and len(conservados) > maximo:
+        # A igual conteo gana el primero, como en las mejores palabras de la tabla
+        mejores = set(heapq.nlargest(maximo, conservados, key=conteos.__getitem__))
+        conservados = [id_palabra for id_palabra in conservados if id_palabra in mejores]
+    return conservados
+
+def iterar_ngramas_podados(trie, n, poda):
+    """Como trie.iterar_ngramas(n), sin los n-gramas que elimina la poda"""
+    if not poda:
+        yield from trie.iterar_ngramas(n)
+        return
+    for contexto, conteo_contexto, hijos in trie.contextos(n - 1):
+        conteos = {id_palabra: hijo[0] for id_palabra, hijo in hijos.items()}
+        for id_palabra in continuaciones_conservadas(poda, contexto, conteos, conteo_contexto, trie.conteo):
+            yield contexto + (id_palabra,), conteos[id_palabra], conteo_contexto
+
+
+class NivelesProbabilidad:
+    """
+    Cuantización logarítmica de probabilidades en 2**bits niveles repartidos
+    entre ln(1) y LOG_PROBABILIDAD_MINIMA. Cada probabilidad se reduce a un
+    entero pequeño, su nivel, y se representa con los valores de ese nivel,
+    que son objetos compartidos por todos los n-gramas del mismo nivel en
+    lugar de dos float propios por n-grama. Dentro de un contexto la
+    cuantización es monótona, así que no cambia el orden de las continuaciones.
+    Las continuaciones de los modelos guardan solo el nivel, en arrays de
+    tipo `tipo` (uno o dos bytes), y lo traducen a conteo al leerlo.
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.niveles = 2 ** bits
+        self.tipo = 'B' if self.niveles <= 256 else 'H'
+        self.paso = -LOG_PROBABILIDAD_MINIMA / (self.niveles - 1)
+        self.logaritmos = [-nivel * self.paso for nivel in range(self.niveles)]
+        self.probabilidades = [math.exp(logaritmo) for logaritmo in self.logaritmos]
+
+    def nivel(self, probabilidad):
+        return min(self.niveles - 1, round(-math.log(probabilidad) / self.paso))
+
+    def cuantizar(self, probabilidad):
+        """(probabilidad, log_probabilidad) del nivel que corresponde a la probabilidad"""
+        nivel = self.nivel(probabilidad)
+        return self.probabilidades[nivel], self.logaritmos[nivel]
+
+    def conteo(self, nivel, conteo_contexto):
+        """Conteo aproximado de una continuación por su nivel: C(h) · P(nivel), al menos 1"""
+        return max(1, round(self.probabilidades[nivel] * conteo_contexto))
@@ -0,0 +1,229 @@
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+# Carácter mayor que cualquier otro: prefijo + FIN_PREFIJO acota el rango
+FIN_PREFIJO = chr(0x10FFFF)
+
+# Las continuaciones de un contexto con más de estas palabras se indexan con
+# MejoresPorRango; las demás se recorren enteras al completar
+MAX_CONTINUACIONES_SIN_INDICE = 256
+
+
+def desplazar_rango(posiciones, rango):
+    """Rango de una palabra tras insertar palabras delante de `posiciones` (ver agregar_palabras)"""
+    return rango + bisect_right(posiciones, rango)
+
+
+def clave_continuaciones(conteos, cuantizador=None):
+    """
+    Orden de las posiciones de unas continuaciones, de más a menos probable y
+    a igualdad alfabético. Con cuantizador los conteos son niveles.
+    """
+    if cuantizador is None:
+        return lambda posicion: (-conteos[posicion], posicion)
+    return lambda posicion: (conteos[posicion], posicion)
+
+
+class MejoresPorRango:
+    """
+    Las k mejores posiciones de cualquier rango [inicio, fin) de un arreglo
+    sin recorrerlo entero. Es un árbol de segmentos: el nivel 0 guarda,
+    ordenadas, las posiciones de cada bloque de k y cada nivel siguiente las
+    k mejores de dos bloques consecutivos del anterior. Un rango se cubre con
+    O(log n) bloques más dos extremos de menos de k posiciones, que se
+    recorren. Ocupa unas 2n posiciones. `clave(posicion)` ordena de mejor a
+    peor; no se guarda, para que el índice se pueda serializar.
+    """
+
+    def __init__(self, total, k, clave):
+        self.k = k
+        self.niveles = []
+        bloques = [array('I', sorted(range(inicio, min(inicio + k, total)), key=clave))
+                   for inicio in range(0, total, k)]
+        while bloques:
+            self.niveles.append(bloques)
+            if len(bloques) == 1:
+                break
+            bloques = [self._fusionar(bloques[i:i + 2], clave) for i in range(0, len(bloques), 2)]
+
+    def _fusionar(self, hijos, clave):
+        return array('I', islice(heapq.merge(*hijos, key=clave), self.k))
+
+    def copia(self):
+        """Copia que se puede actualizar sin tocar esta (los bloques se sustituyen, no se modifican)"""
+        copia = object.__new__(MejoresPorRango)
+        copia.k = self.k
+        copia.niveles = [list(bloques) for bloques in self.niveles]
+        return copia
+
+    def actualizar(self, posiciones, clave):
+        """Recalcula los bloques que contienen las posiciones cuya clave ha cambiado"""
+        indices = {posicion // self.k for posicion in posiciones}
+        for nivel, bloques in enumerate(self.niveles):
+            for i in indices:
+                if nivel == 0:
+                    inicio = i * self.k
+                    bloques[i] = array('I', sorted(range(inicio, inicio + len(bloques[i])), key=clave))
+                else:
+                    bloques[i] = self._fusionar(self.niveles[nivel - 1][2 * i:2 * i + 2], clave)
+            indices = {i // 2 for i in indices}
+
+    def mejores(self, inicio, fin, k, clave):
+        """Las k mejores posiciones del rango (k no mayor que el del índice), de mejor a peor"""
+        tamano = self.k
+        primero = -(-inicio // tamano)
+        ultimo = fin // tamano
+        if primero >= ultimo:
+            return heapq.nsmallest(k, range(inicio, fin), key=clave)
+
+        candidatos = list(range(inicio, primero * tamano))
+        candidatos.extend(range(ultimo * tamano, fin))
+        # Bloques enteros de [primero, ultimo), subiendo de nivel como en un árbol de segmentos
+        for bloques in self.niveles:
+            if primero >= ultimo:
+                break
+            if primero & 1:
+                candidatos.extend(bloques[primero])
+                primero += 1
+            if ultimo & 1:
+                ultimo -= 1
+                candidatos.extend(bloques[ultimo])
+            primero //= 2
+            ultimo //= 2
+        return heapq.nsmallest(k, candidatos, key=clave)
+
+
+class IndicePrefijos:
+    """
+    Vocabulario ordenado alfabéticamente para completar la palabra que se está
+    escribiendo. Las palabras que empiezan por un prefijo forman un rango
+    contiguo de posiciones (rangos) en el arreglo ordenado, que se localiza con
+    búsqueda binaria; las k más frecuentes de cualquier rango, por largo que
+    sea, se obtienen con un MejoresPorRango sin recorrerlo.
+    """
+
+    def __init__(self, vocabulario, ids, top_k=20, frecuencias=None):
+        total = len(vocabulario)
+        self.top_k = top_k
+
+        # Si ya se conocen los conteos de cada id no hace falta recorrer el texto
+        if frecuencias is not None:
+            self.frecuencias = array('I', frecuencias)
+        else:
+            self.frecuencias = array('I', bytes(4 * total))
+            for id_palabra in ids:
+                self.frecuencias[id_palabra] += 1
+
+        # Posición alfabética -> id y su inversa id -> posición
+        orden = sorted(range(total), key=vocabulario.palabras.__getitem__)
+        self.palabras = [vocabulario.palabras[i] for i in orden]
+        self.ids = array('I', orden)
+        self.rangos = array('I', bytes(4 * total))
+        for rango, id_palabra in enumerate(orden):
+            self.rangos[id_palabra] = rango
+
+        self._mejores = MejoresPorRango(total, top_k, self._clave())
+
+    def _clave(self):
+        """Más frecuentes primero y, a igualdad, por id"""
+        frecuencias = self.frecuencias
+        ids = self.ids
+        return lambda rango: (-frecuencias[ids[rango]], ids[rango])
+
+    def copia(self):
+        """Índice independiente, para actualizarlo mientras otras peticiones leen este"""
+        copia = object.__new__(IndicePrefijos)
+        copia.top_k = self.top_k
+        copia.frecuencias = array('I', self.frecuencias)
+        copia.palabras = list(self.palabras)
+        copia.ids = array('I', self.ids)
+        copia.rangos = array('I', self.rangos)
+        copia._mejores = self._mejores.copia()
+        return copia
+
+    def agregar_palabras(self, vocabulario, desde):
+        """
+        Indexa las palabras del vocabulario con id >= desde (recién añadidas,
+        con frecuencia 0) insertando cada una en su posición alfabética, sin
+        volver a ordenar el vocabulario. Las palabras posteriores se desplazan:
+        devuelve las posiciones del índice anterior delante de las que se ha
+        insertado alguna palabra, ordenadas, para traducir con
+        desplazar_rango los rangos ya guardados.
+        """
+        nuevas = sorted(range(desde, len(vocabulario)), key=vocabulario.palabras.__getitem__)
+        if not nuevas:
+            return []
+        posiciones = [bisect_left(self.palabras, vocabulario.palabras[id_palabra]) for id_palabra in nuevas]
+
+        # De atrás hacia delante, para que las posiciones sigan siendo válidas
+        for posicion, id_palabra in reversed(list(zip(posiciones, nuevas))):
+            self.palabras.insert(posicion, vocabulario.palabras[id_palabra])
+            self.ids.insert(posicion, id_palabra)
+        self.frecuencias.extend([0] * len(nuevas))
+        self.rangos.extend([0] * len(nuevas))
+        for rango in range(posiciones[0], len(self.ids)):
+            self.rangos[self.ids[rango]] = rango
+        # Todas las posiciones posteriores han cambiado
+        self._mejores = MejoresPorRango(len(self.ids), self.top_k, self._clave())
+        return posiciones
+
+    def actualizar_frecuencias(self, cambios):
+        """
+        Aplica {id_palabra: cambio} a las frecuencias de palabras ya indexadas
+        y recalcula solo los bloques del índice que las contienen.
+        """
+        for id_palabra, cambio in cambios.items():
+            self.frecuencias[id_palabra] += cambio
+        self._mejores.actualizar([self.rangos[id_palabra] for id_palabra in cambios], self._clave())
+
+    def rango(self, prefijo):
+        """Posiciones [inicio, fin) de las palabras que empiezan por el prefijo"""
+        inicio = bisect_left(self.palabras, prefijo)
+        fin = bisect_left(self.palabras, prefijo + FIN_PREFIJO, inicio)
+        return inicio, fin
+
+    def completar(self, prefijo, k):
+        """Ids de las k palabras más frecuentes que empiezan por el prefijo"""
+        inicio, fin = self.rango(prefijo)
+        if k <= self.top_k:
+            mejores = self._mejores.mejores(inicio, fin, k, self._clave())
+        else:
+            mejores = heapq.nsmallest(k, range(inicio, fin), key=self._clave())
+        return [self.ids[rango] for rango in mejores]
+
+    def completar_en_contexto(self, prefijo, continuaciones, k, cuantizador=None, indice=None):
+        """
+        Las k continuaciones de un contexto que empiezan por el prefijo,
+        ordenadas por P(palabra|contexto). `continuaciones` es la tupla
+        (conteo_contexto, rangos, conteos) con los rangos ordenados, de modo que
+        las que coinciden con el prefijo también forman un bloque contiguo.
+        Con `cuantizador`, `conteos` son niveles y se traducen a conteos.
+        `indice` es el MejoresPorRango de los contextos con muchas
+        continuaciones (ver indexar_continuaciones).
+        Devuelve tuplas (id_palabra, conteo, conteo_contexto).
+        """
+        conteo_contexto, rangos, conteos = continuaciones
+        inicio, fin = self.rango(prefijo)
+        desde = bisect_left(rangos, inicio)
+        hasta = bisect_left(rangos, fin, desde)
+
+        clave = clave_continuaciones(conteos, cuantizador)
+        if indice is not None and k <= indice.k:
+            mejores = indice.mejores(desde, hasta, k, clave)
+        else:
+            mejores = heapq.nsmallest(k, range(desde, hasta), key=clave)
+        if cuantizador is None:
+            return [(self.ids[rangos[p]], conteos[p], conteo_contexto) for p in mejores]
+        return [(self.ids[rangos[p]], cuantizador.conteo(conteos[p], conteo_contexto), conteo_contexto)
+                for p in mejores]
+
+
+def indexar_continuaciones(continuaciones, k, cuantizador=None):
+    """{contexto: MejoresPorRango} de los contextos con más de MAX_CONTINUACIONES_SIN_INDICE continuaciones"""
+    return {
+        contexto: MejoresPorRango(len(conteos), k, clave_continuaciones(conteos, cuantizador))
+        for contexto, (_, _, conteos) in continuaciones.items()
+        if len(conteos) > MAX_CONTINUACIONES_SIN_INDICE
+    }
@@ -0,0 +1,160 @@
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Presupuesto por defecto si no se define MODELOS_MEMORIA_MAXIMA_MB
+MEMORIA_MAXIMA_MB_POR_DEFECTO = 512
+
+# LRU común a todos los registros: (nombre_registro, clave) -> tamaño estimado.
+# Al final quedan los usados más recientemente.
+_lru = OrderedDict()
+_candado = threading.RLock()
+_registros = {}
+
+
+def estimar_tamano(objeto):
+    """
+    Estimación en bytes de la memoria que ocupa un objeto y todo lo que
+    contiene. Cada objeto se cuenta una vez aunque aparezca varias veces;
+    los arrays cuentan su buffer y los mmap solo su cabecera, porque sus
+    páginas las gestiona el sistema y se comparten entre procesos.
+    """
+    vistos = set()
+    pendientes = [objeto]
+    total = 0
+    while pendientes:
+        actual = pendientes.pop()
+        if id(actual) in vistos:
+            continue
+        vistos.add(id(actual))
+        total += sys.getsizeof(actual)
+
+        if isinstance(actual, (str, bytes, int, float, bool, memoryview)) or actual is None:
+            continue
+        if isinstance(actual, array):
+            continue  # getsizeof ya incluye el buffer
+        if isinstance(actual, dict):
+            pendientes.extend(actual.keys())
+            pendientes.extend(actual.values())
+        elif isinstance(actual, (list, tuple, set, frozenset)):
+            pendientes.extend(actual)
+        elif hasattr(actual, '__dict__'):
+            pendientes.append(vars(actual))
+    return total
+
+def presupuesto_bytes():
+    """Memoria máxima para los modelos en memoria de este proceso"""
+    return int(getattr(settings, 'MODELOS_MEMORIA_MAXIMA_MB', MEMORIA_MAXIMA_MB_POR_DEFECTO) * 1024 * 1024)
+
+
+class RegistroModelos:
+    """
+    Modelos cargados en este proceso: clave -> (hash, valor). Todos los
+    registros comparten un presupuesto de memoria (MODELOS_MEMORIA_MAXIMA_MB):
+    al guardar un valor (con su tamaño estimado) se expulsan los menos usados
+    recientemente, sean del registro que sean, hasta que quepa.
+    """
+
+    def __init__(self, nombre, estimar=estimar_tamano):
+        self.nombre = nombre
+        self.estimar = estimar
+        self._entradas = {}
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        _registros[nombre] = self
+
+    def buscar(self, clave, hash_contenido, contar=True):
+        """
+        Valor guardado para la clave si corresponde al contenido actual, si no
+        None. Con contar=False (segunda consulta de la misma petición) no
+        cuenta como acierto ni como fallo.
+        """
+        with _candado:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[0] != hash_contenido:
+                self.fallos += contar
+                return None
+            self.aciertos += contar
+            _lru.move_to_end((self.nombre, clave))
+            return entrada[1]
+
+    def guardar(self, clave, hash_contenido, valor, tamano=None):
+        """Guarda el valor; `tamano` evita estimarlo si ya se conoce"""
+        if tamano is None:
+            tamano = self.estimar(valor)
+        with _candado:
+            self._quitar(clave)
+            self._entradas[clave] = (hash_contenido, valor)
+            _lru[(self.nombre, clave)] = tamano
+            _hacer_sitio(presupuesto_bytes(), (self.nombre, clave))
+
+    def tamano(self, clave):
+        """Tamaño estimado de la entrada guardada para la clave (None si no está)"""
+        with _candado:
+            return _lru.get((self.nombre, clave))
+
+    def eliminar_si(self, condicion):
+        """Quita las entradas cuya clave cumple la condición"""
+        with _candado:
+            for clave in [clave for clave in self._entradas if condicion(clave)]:
+                self._quitar(clave)
+
+    def _quitar(self, clave):
+        if self._entradas.pop(clave, None) is not None:
+            _lru.pop((self.nombre, clave), None)
+
+    def __contains__(self, clave):
+        return clave in self._entradas
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def bytes_usados(self):
+        with _candado:
+            return sum(tamano for (nombre, _), tamano in _lru.items() if nombre == self.nombre)
+
+    def estadisticas(self):
+        return {
+            'entradas': len(self),
+            'bytes': self.bytes_usados(),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'expulsiones': self.expulsiones,
+        }
+
+def _hacer_sitio(presupuesto, protegida):
+    """Expulsa las entradas menos usadas hasta respetar el presupuesto (nunca la recién guardada)"""
+    usado = sum(_lru.values())
+    for nombre, clave in list(_lru):
+        if usado <= presupuesto:
+            break
+        if (nombre, clave) == protegida:
+            continue
+        usado -= _lru.pop((nombre, clave))
+        registro = _registros[nombre]
+        registro._entradas.pop(clave, None)
+        registro.expulsiones += 1
+
+def guardar_juntos(guardados):
+    """
+    Guarda [(registro, clave, hash, valor, tamaño)] de una sola vez: ninguna
+    consulta ve unos valores nuevos y otros anteriores.
+    """
+    guardados = [(registro, clave, hash_contenido, valor, registro.estimar(valor) if tamano is None else tamano)
+                 for registro, clave, hash_contenido, valor, tamano in guardados]
+    with _candado:
+        for registro, clave, hash_contenido, valor, tamano in guardados:
+            registro.guardar(clave, hash_contenido, valor, tamano)
+
+def estadisticas_registros():
+    """Uso de memoria y contadores de todos los registros, para monitorización"""
+    with _candado:
+        return {
+            'presupuesto_bytes': presupuesto_bytes(),
+            'bytes_usados': sum(_lru.values()),
+            'registros': {nombre: registro.estadisticas() for nombre, registro in _registros.items()},
+        }
@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import TextoAnalizado, Corpus
+from .cache_modelos import invalidar_modelos, clave_corpus
+from .tareas import encolar_construccion_corpus
+
+
+@receiver(post_delete, sender=TextoAnalizado)
+def eliminar_modelos_en_cache(sender, instance, **kwargs):
+    """Borra los modelos compilados de un texto eliminado"""
+    invalidar_modelos(instance.id)
+
+@receiver(post_delete, sender=Corpus)
+def eliminar_modelos_corpus_en_cache(sender, instance, **kwargs):
+    """Borra los modelos compilados de un corpus eliminado"""
+    invalidar_modelos(clave_corpus(instance.id))
+
+@receiver(m2m_changed, sender=Corpus.textos.through)
+def reconstruir_modelos_corpus(sender, instance, action, reverse, pk_set, **kwargs):
+    """Al cambiar los textos de un corpus se vuelve a construir su modelo"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        ids_corpus = [instance.id]
+    elif pk_set:
+        ids_corpus = list(pk_set)
+    else:
+        # clear() desde un texto: sus corpus ya no se pueden consultar
+        return
+    for corpus_id in ids_corpus:
+        transaction.on_commit(lambda corpus_id=corpus_id: encolar_construccion_corpus(corpus_id))
@@ -0,0 +1,238 @@
+import heapq
+
+from .poda import continuaciones_conservadas
+
+ALFA_BACKOFF = 0.4
+DESCUENTO_POR_DEFECTO = 0.75
+
+# Posiciones de cada entrada de la tabla
+TOTAL, TOTAL_CONTINUACION, DISTINTOS, DISTINTOS_CONTINUACION, HIJOS, MEJORES, MEJORES_CONTINUACION = range(7)
+
+
+def _calcular_descuento(n1, n2):
+    """D = n1 / (n1 + 2*n2), con n1 y n2 el número de n-gramas vistos una y dos veces"""
+    if n1 == 0 or n2 == 0:
+        return DESCUENTO_POR_DEFECTO
+    return n1 / (n1 + 2 * n2)
+
+def _entrada(hijos, top_k):
+    """Entrada de la tabla para un contexto a partir de {id_palabra: (conteo, continuacion)}"""
+    return (
+        sum(conteo for conteo, _ in hijos.values()),
+        sum(continuacion for _, continuacion in hijos.values()),
+        len(hijos),
+        sum(1 for _, continuacion in hijos.values() if continuacion),
+        hijos,
+        heapq.nlargest(top_k, hijos, key=lambda w: hijos[w][0]),
+        heapq.nlargest(top_k, hijos, key=lambda w: hijos[w][1]),
+    )
+
+def _podar_entrada(entrada, conservados, top_k):
+    """
+    La entrada con solo las continuaciones conservadas (None si no queda
+    ninguna). Totales y distintos siguen siendo los del modelo sin podar, así
+    que las palabras que quedan conservan su puntuación.
+    """
+    if not conservados:
+        return None
+    hijos = {id_palabra: entrada[HIJOS][id_palabra] for id_palabra in conservados}
+    return entrada[:HIJOS] + (
+        hijos,
+        heapq.nlargest(top_k, hijos, key=lambda w: hijos[w][0]),
+        heapq.nlargest(top_k, hijos, key=lambda w: hijos[w][1]),
+    )
+
+def construir_tabla_suavizado(trie, orden_maximo, top_k=20, poda=None):
+    """
+    Construye, a partir de un TrieConteos, la única tabla que usan Stupid
+    Backoff y Kneser-Ney. La clave es el contexto (tupla de ids de longitud 0 a
+    orden_maximo-1, así que los órdenes no se mezclan) y el valor guarda, para
+    cada palabra que lo sigue, su conteo y su conteo de continuación
+    N1+(• contexto palabra), además de totales y las mejores top_k palabras.
+    Devuelve {'tabla', 'descuentos', 'conteos_descuento', 'orden_maximo',
+    'total_vocabulario'}; conteos_descuento guarda [n1, n2] de cada orden para
+    poder actualizar los descuentos sin recorrer la tabla.
+    Con opciones de poda (ver poda.py) cada contexto guarda solo las
+    continuaciones que la superan; los descuentos, totales y conteos de
+    continuación se calculan antes de podar.
+    """
+    hijos_por_contexto = {}
+    conservados = {}
+    descuentos = {}
+    conteos_descuento = {}
+    for orden in range(1, orden_maximo + 1):
+        n1 = n2 = 0
+        for contexto, conteo_contexto, hijos in trie.contextos(orden - 1):
+            if hijos:
+                hijos_por_contexto[contexto] = {id_palabra: [hijo[0], 0] for id_palabra, hijo in hijos.items()}
+                if poda:
+                    conservados[contexto] = continuaciones_conservadas(
+                        poda, contexto, {id_palabra: hijo[0] for id_palabra, hijo in hijos.items()},
+                        conteo_contexto, trie.conteo)
+                for hijo in hijos.values():
+                    if hijo[0] == 1:
+                        n1 += 1
+                    elif hijo[0] == 2:
+                        n2 += 1
+        conteos_descuento[orden] = [n1, n2]
+        descuentos[orden] = _calcular_descuento(n1, n2)
+
+    # N1+(• contexto palabra): cuántas palabras distintas preceden a cada n-grama
+    for orden in range(2, orden_maximo + 1):
+        for ngrama, _, _ in trie.iterar_ngramas(orden):
+            hijos_por_contexto[ngrama[1:-1]][ngrama[-1]][1] += 1
+
+    tabla = {}
+    for contexto, hijos in hijos_por_contexto.items():
+        entrada = _entrada({id_palabra: tuple(valores) for id_palabra, valores in hijos.items()}, top_k)
+        if poda:
+            entrada = _podar_entrada(entrada, conservados[contexto], top_k)
+            if entrada is None:
+                continue
+        tabla[contexto] = entrada
+
+    raiz = tabla.get((), None)
+    return {
+        'tabla': tabla,
+        'descuentos': descuentos,
+        'conteos_descuento': conteos_descuento,
+        'orden_maximo': orden_maximo,
+        'total_vocabulario': raiz[DISTINTOS] if raiz else 0
+    }
+
+def actualizar_tabla_suavizado(suavizado, delta, top_k=20):
+    """
+    Aplica a la tabla una diferencia de conteos {ngrama: cambio} (n-gramas de
+    orden 1 a orden_maximo), por ejemplo la de un texto al que se le añade un
+    final. Solo se recalculan los totales y las mejores palabras de los
+    contextos afectados; cada entrada se sustituye entera, sin modificar la
+    que pueda estar leyendo otra petición.
+    Devuelve {ngrama: (conteo_anterior, conteo_nuevo)}.
+    """
+    tabla = suavizado['tabla']
+    modificados = {}
+
+    def hijos_de(contexto):
+        hijos = modificados.get(contexto)
+        if hijos is None:
+            entrada = tabla.get(contexto)
+            hijos = modificados[contexto] = (
+                {id_palabra: list(valores) for id_palabra, valores in entrada[HIJOS].items()} if entrada else {}
+            )
+        return hijos
+
+    cambios = {}
+    for ngrama, cambio in delta.items():
+        valores = hijos_de(ngrama[:-1]).setdefault(ngrama[-1], [0, 0])
+        anterior = valores[0]
+        valores[0] += cambio
+        cambios[ngrama] = (anterior, valores[0])
+
+        n1_n2 = suavizado['conteos_descuento'][len(ngrama)]
+        for conteo, signo in ((anterior, -1), (valores[0], 1)):
+            if conteo in (1, 2):
+                n1_n2[conteo - 1] += signo
+
+    # N1+(• contexto palabra) cambia solo cuando un n-grama aparece o desaparece
+    for ngrama, (anterior, nuevo) in cambios.items():
+        if len(ngrama) > 1 and (anterior == 0) != (nuevo == 0):
+            hijos_de(ngrama[1:-1]).setdefault(ngrama[-1], [0, 0])[1] += 1 if nuevo else -1
+
+    for contexto, hijos in modificados.items():
+        hijos = {id_palabra: tuple(valores) for id_palabra, valores in hijos.items() if valores[0]}
+        if hijos:
+            tabla[contexto] = _entrada(hijos, top_k)
+        else:
+            tabla.pop(contexto, None)
+
+    for orden in {len(ngrama) for ngrama in delta}:
+        suavizado['descuentos'][orden] = _calcular_descuento(*suavizado['conteos_descuento'][orden])
+    raiz = tabla.get(())
+    suavizado['total_vocabulario'] = raiz[DISTINTOS] if raiz else 0
+    return cambios
+
+def _entradas_contexto(suavizado, contexto_ids):
+    """Consulta el contexto y todos sus sufijos: a lo sumo orden_maximo accesos"""
+    longitud = suavizado['orden_maximo'] - 1
+    contexto_ids = tuple(contexto_ids)[-longitud:] if longitud else ()
+    tabla = suavizado['tabla']
+    return [
+        (contexto_ids[inicio:], tabla.get(contexto_ids[inicio:]))
+        for inicio in range(len(contexto_ids) + 1)
+    ]
+
+def sugerir_stupid_backoff(suavizado, contexto_ids, k, alfa=ALFA_BACKOFF):
+    """
+    S(w|h) = C(h w) / C(h) si C(h w) > 0, si no alfa * S(w|h sin su primera palabra).
+    Devuelve tuplas (id_palabra, puntaje, conteo, conteo_contexto, orden).
+    """
+    puntajes = {}
+    consultadas = []
+    factor = 1.0
+    for contexto, entrada in _entradas_contexto(suavizado, contexto_ids):
+        if entrada:
+            # Con k candidatos ya vistos, un orden inferior no puede superarlos
+            if len(puntajes) >= k and factor <= heapq.nlargest(k, (p[0] for p in puntajes.values()))[-1]:
+                break
+            consultadas.append((contexto, entrada, factor))
+            for id_palabra in entrada[MEJORES]:
+                if id_palabra not in puntajes:
+                    # Un candidato de este orden puede seguir a un contexto más
+                    # largo sin estar entre sus mejores: se puntúa en el orden
+                    # más alto en que aparece
+                    for contexto_visto, entrada_vista, factor_visto in consultadas:
+                        valores = entrada_vista[HIJOS].get(id_palabra)
+                        if valores:
+                            break
+                    conteo, total = valores[0], entrada_vista[TOTAL]
+                    puntajes[id_palabra] = (factor_visto * conteo / total, conteo, total, len(contexto_visto) + 1)
+        factor *= alfa
+
+    mejores = heapq.nlargest(k, puntajes.items(), key=lambda x: x[1][0])
+    return [(id_palabra, *datos) for id_palabra, datos in mejores]
+
+def probabilidad_kneser_ney(suavizado, entradas, id_palabra):
+    """
+    P_KN(w|h) interpolado sobre las entradas ya consultadas (de la más larga a
+    la vacía). El orden más alto usa conteos, los inferiores conteos de
+    continuación, y la base es la distribución uniforme sobre el vocabulario.
+    """
+    probabilidad = 1.0 / max(suavizado['total_vocabulario'], 1)
+    ultimo = len(entradas) - 1
+    for posicion in range(ultimo, -1, -1):
+        contexto, entrada = entradas[posicion]
+        if not entrada:
+            continue
+        descuento = suavizado['descuentos'].get(len(contexto) + 1, DESCUENTO_POR_DEFECTO)
+        if posicion == 0:
+            total, distintos, indice = entrada[TOTAL], entrada[DISTINTOS], 0
+        else:
+            total, distintos, indice = entrada[TOTAL_CONTINUACION], entrada[DISTINTOS_CONTINUACION], 1
+        if not total:
+            continue
+        valores = entrada[HIJOS].get(id_palabra)
+        conteo = valores[indice] if valores else 0
+        probabilidad = max(conteo - descuento, 0) / total + descuento * distintos / total * probabilidad
+    return probabilidad
+
+def sugerir_kneser_ney(suavizado, contexto_ids, k):
+    """
+    Las k palabras con mayor P_KN(w|h). Los candidatos son las mejores
+    continuaciones de cada orden consultado; cada uno se puntúa con la
+    interpolación completa. Devuelve tuplas como sugerir_stupid_backoff.
+    """
+    entradas = _entradas_contexto(suavizado, contexto_ids)
+
+    candidatos = {}
+    for posicion, (contexto, entrada) in enumerate(entradas):
+        if entrada:
+            for id_palabra in entrada[MEJORES if posicion == 0 else MEJORES_CONTINUACION]:
+                if id_palabra not in candidatos:
+                    conteo = entrada[HIJOS][id_palabra][0]
+                    candidatos[id_palabra] = (conteo, entrada[TOTAL], len(contexto) + 1)
+
+    puntuados = [
+        (id_palabra, probabilidad_kneser_ney(suavizado, entradas, id_palabra), *datos)
+        for id_palabra, datos in candidatos.items()
+    ]
+    return heapq.nlargest(k, puntuados, key=lambda x: x[1])
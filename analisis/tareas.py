@@ -0,0 +1,128 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import TextoAnalizado, Corpus
+from .cache_modelos import obtener_corpus, obtener_modelo, obtener_modelo_corpus
+from .cache_modelos import obtener_modelo_binario, obtener_modelo_binario_corpus
+from .almacen import obtener_modelo_sql
+
+_ejecutor = None
+_candado = threading.Lock()
+
+# Trabajos en cola o en curso: (clase, id, n, fronteras); evita encolar dos veces
+_en_construccion = set()
+
+
+def _obtener_ejecutor():
+    global _ejecutor
+    with _candado:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'MODELOS_WORKERS_CONSTRUCCION', 2),
+                thread_name_prefix='construccion-modelos'
+            )
+    return _ejecutor
+
+def _actualizar_estado(clase, objeto_id, **campos):
+    clase.objects.filter(id=objeto_id).update(**campos)
+
+def _construir_con_estado(clase, objeto_id, pasos, construir_paso):
+    """
+    Ejecuta construir_paso(objeto, n, fronteras) para cada paso, registrando
+    en el objeto (TextoAnalizado o Corpus) el estado, el progreso y los tiempos.
+    """
+    close_old_connections()
+    inicio = time.perf_counter()
+
+    try:
+        objeto = clase.objects.get(id=objeto_id)
+        _actualizar_estado(
+            clase, objeto_id,
+            estado_modelo=clase.ESTADO_CONSTRUYENDO,
+            progreso_modelo=0,
+            inicio_construccion=timezone.now(),
+            fin_construccion=None,
+            duracion_construccion=None,
+            error_construccion=''
+        )
+
+        for numero, (n, fronteras) in enumerate(pasos, start=1):
+            construir_paso(objeto, n, fronteras)
+            _actualizar_estado(clase, objeto_id, progreso_modelo=int(100 * numero / len(pasos)))
+
+        _actualizar_estado(
+            clase, objeto_id,
+            estado_modelo=clase.ESTADO_LISTO,
+            fin_construccion=timezone.now(),
+            duracion_construccion=time.perf_counter() - inicio
+        )
+    except clase.DoesNotExist:
+        pass
+    except Exception as e:
+        _actualizar_estado(
+            clase, objeto_id,
+            estado_modelo=clase.ESTADO_ERROR,
+            fin_construccion=timezone.now(),
+            duracion_construccion=time.perf_counter() - inicio,
+            error_construccion=str(e)
+        )
+    finally:
+        with _candado:
+            for n, fronteras in pasos:
+                _en_construccion.discard((clase, objeto_id, n, fronteras))
+        close_old_connections()
+
+def _paso_texto(texto_obj, n, fronteras):
+    if n is None:
+        obtener_corpus(texto_obj, fronteras)
+    else:
+        obtener_modelo(texto_obj, n, fronteras)
+        obtener_modelo_binario(texto_obj, n, fronteras)
+        if getattr(settings, 'MODELOS_ALMACEN_SQL', False):
+            obtener_modelo_sql(texto_obj, n, fronteras)
+
+def _paso_corpus(corpus_obj, n, fronteras):
+    obtener_modelo_corpus(corpus_obj, n, fronteras)
+    obtener_modelo_binario_corpus(corpus_obj, n, fronteras)
+    if getattr(settings, 'MODELOS_ALMACEN_SQL', False):
+        obtener_modelo_sql(corpus_obj, n, fronteras)
+
+def _encolar(clase, objeto_id, pasos, construir_paso):
+    """Encola los pasos que no estén ya en cola; False si no queda ninguno"""
+    with _candado:
+        pasos = [(n, fronteras) for n, fronteras in pasos
+                 if (clase, objeto_id, n, fronteras) not in _en_construccion]
+        if not pasos:
+            return False
+        _en_construccion.update((clase, objeto_id, n, fronteras) for n, fronteras in pasos)
+
+    _obtener_ejecutor().submit(_construir_con_estado, clase, objeto_id, pasos, construir_paso)
+    return True
+
+def _ordenes_preconstruidos(ordenes):
+    if ordenes is None:
+        return getattr(settings, 'MODELOS_ORDENES_PRECONSTRUIDOS', [2, 3])
+    return ordenes
+
+def encolar_construccion(texto_id, ordenes=None, variantes_fronteras=(False, True)):
+    """
+    Encola en el pool local la construcción de los modelos de un texto.
+    Por defecto se preparan los órdenes de MODELOS_ORDENES_PRECONSTRUIDOS.
+    Devuelve False si todo lo pedido ya estaba en cola o construyéndose.
+    """
+    ordenes = _ordenes_preconstruidos(ordenes)
+    # Primero el texto codificado de cada variante, que comparten todos los órdenes
+    pasos = [(None, fronteras) for fronteras in variantes_fronteras]
+    pasos += [(n, fronteras) for fronteras in variantes_fronteras for n in ordenes]
+    return _encolar(TextoAnalizado, texto_id, pasos, _paso_texto)
+
+def encolar_construccion_corpus(corpus_id, ordenes=None, variantes_fronteras=(False, True)):
+    """Como encolar_construccion, para el modelo conjunto de un corpus"""
+    ordenes = _ordenes_preconstruidos(ordenes)
+    pasos = [(n, fronteras) for fronteras in variantes_fronteras for n in ordenes]
+    return _encolar(Corpus, corpus_id, pasos, _paso_corpus)
@@ -1,3 +1,835 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import shutil
+import unicodedata
+import tempfile
+import threading
+import time
+import unittest
+from array import array
+from datetime import datetime, timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.core.files.base import ContentFile
+from django.http import HttpResponse
+from django.db import IntegrityError, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+
+from .models import Corpus, ModeloNgramas, Ngrama, TextoAnalizado
+from .management.commands.reproducir_tecleo import formatear_ms, formatear_porcentaje
+from .metricas import MetricasMiddleware, etapa, percentil
+from .registro import _registros
+
+from . import cache_modelos, views
+from .almacen import obtener_modelo_sql
+from .columnar import np, calcular_probabilidad_ngramas_columnar
+from .conteo import TrieConteos
+from .frases import buscar_frases
+from .perplejidad import dividir_oraciones, evaluar_oraciones
+from .prefijos import IndicePrefijos, MejoresPorRango, clave_continuaciones
+from .poda import NivelesProbabilidad, iterar_ngramas_podados, opciones_poda
+from .suavizado import _entradas_contexto, construir_tabla_suavizado, probabilidad_kneser_ney
+from .suavizado import sugerir_kneser_ney, sugerir_stupid_backoff
+from .utils import STOPWORDS_ES, TOKENIZADOR, calcular_probabilidad_ngramas, construir_trie_conteos
+from .utils import completar_palabra, procesar_texto_completo
+from .vocabulario import Vocabulario
+
+
+def tabla_de(tokens, orden_maximo, top_k=20):
+    """Vocabulario y tabla de suavizado de una lista de tokens"""
+    vocabulario = Vocabulario()
+    trie = TrieConteos(orden_maximo)
+    trie.agregar_secuencia(vocabulario.codificar(tokens))
+    return vocabulario, construir_tabla_suavizado(trie, orden_maximo, top_k)
+
+class ArchivosTemporalesMixin:
+    """Media y modelos compilados en un directorio temporal propio de cada prueba"""
+
+    def setUp(self):
+        super().setUp()
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=os.path.join(directorio, 'media'),
+                                    MODELOS_CACHE_DIR=os.path.join(directorio, 'cache'))
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        # Los ids se reutilizan entre pruebas: nada cargado por otra debe valer
+        self.olvidar_memoria()
+        self.addCleanup(self.olvidar_memoria)
+
+    def crear_texto(self, contenido, titulo='prueba'):
+        texto = TextoAnalizado(titulo=titulo)
+        texto.archivo.save(f'{titulo}.txt', ContentFile(contenido.encode('utf-8')))
+        return texto
+
+    def post_json(self, url, **datos):
+        return self.client.post(url, json.dumps(datos), content_type='application/json')
+
+    def olvidar_memoria(self):
+        """Olvida los modelos en memoria, como un proceso nuevo"""
+        for registro in _registros.values():
+            registro.eliminar_si(lambda clave: True)
+
+    def vaciar_caches(self):
+        """Olvida los modelos en memoria y en disco, como un proceso nuevo sin caché"""
+        self.olvidar_memoria()
+        directorio = cache_modelos.obtener_directorio_cache()
+        for nombre in os.listdir(directorio):
+            os.remove(os.path.join(directorio, nombre))
+
+
+class StupidBackoffTests(TestCase):
+    def test_continuacion_fuera_de_las_mejores_usa_el_orden_mas_alto(self):
+        # 'a' va seguida de 30 palabras vistas una vez y de 'z', que además es
+        # el unigrama más frecuente pero no entra entre las 20 mejores de 'a'
+        tokens = []
+        for i in range(30):
+            tokens += ['a', f'w{i}']
+        tokens += ['a', 'z'] + ['z'] * 100
+        vocabulario, suavizado = tabla_de(tokens, 2)
+
+        sugerencias = sugerir_stupid_backoff(suavizado, [vocabulario.ids['a']], 40)
+        puntajes = {vocabulario.palabra(id_palabra): (puntaje, conteo, total, orden)
+                    for id_palabra, puntaje, conteo, total, orden in sugerencias}
+
+        self.assertEqual(puntajes['z'], (1 / 31, 1, 31, 2))
+        self.assertEqual(puntajes['w0'], (1 / 31, 1, 31, 2))
+        # 'a' nunca sigue a 'a': sí recurre al unigrama
+        self.assertEqual(puntajes['a'][3], 1)
+        self.assertAlmostEqual(puntajes['a'][0], 0.4 * 31 / len(tokens))
+
+    def test_palabra_sin_el_contexto_completo_se_penaliza(self):
+        vocabulario, suavizado = tabla_de(['a', 'b', 'a', 'b', 'c', 'c', 'c'], 2)
+
+        sugerencias = sugerir_stupid_backoff(suavizado, [vocabulario.ids['a']], 3)
+
+        self.assertEqual(sugerencias[0][:2], (vocabulario.ids['b'], 1.0))
+        c = [s for s in sugerencias if s[0] == vocabulario.ids['c']][0]
+        self.assertAlmostEqual(c[1], 0.4 * 3 / 7)
+        self.assertEqual(c[4], 1)
+
+
+@override_settings(METRICAS_ACTIVADAS=True)
+class MetricasMiddlewareTests(TestCase):
+    def test_cadena_asincrona_sin_pasar_por_un_hilo(self):
+        async def vista(request):
+            with etapa('prueba'):
+                pass
+            return HttpResponse('ok')
+
+        middleware = MetricasMiddleware(vista)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        respuesta = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertIn('prueba;dur=', respuesta['Server-Timing'])
+        self.assertIn('total;dur=', respuesta['Server-Timing'])
+
+    def test_cadena_sincrona(self):
+        middleware = MetricasMiddleware(lambda request: HttpResponse('ok'))
+        self.assertFalse(iscoroutinefunction(middleware))
+        self.assertIn('total;dur=', middleware(RequestFactory().get('/'))['Server-Timing'])
+
+
+@mock.patch('analisis.views.encolar_construccion')
+class ConstruccionFallidaTests(ArchivosTemporalesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.texto = self.crear_texto('el perro come y el gato duerme')
+        TextoAnalizado.objects.filter(id=self.texto.id).update(
+            estado_modelo=TextoAnalizado.ESTADO_ERROR,
+            error_construccion='codificación no válida',
+            fin_construccion=datetime.now(timezone.utc)
+        )
+
+    def test_error_reciente_se_devuelve_sin_volver_a_encolar(self, encolar):
+        respuesta = self.post_json('/api/sugerencias/', texto='el', texto_id=self.texto.id, n_grama=2)
+
+        self.assertEqual(respuesta.status_code, 500)
+        self.assertEqual(respuesta.json()['estado'], 'error')
+        self.assertEqual(respuesta.json()['error_construccion'], 'codificación no válida')
+        encolar.assert_not_called()
+
+    def test_reintentar_vuelve_a_encolar(self, encolar):
+        respuesta = self.post_json('/api/sugerencias/', texto='el', texto_id=self.texto.id, n_grama=2,
+                                   reintentar=True)
+
+        self.assertEqual(respuesta.status_code, 202)
+        encolar.assert_called_once_with(self.texto.id, [2], [False])
+
+    def test_tras_la_espera_se_vuelve_a_encolar(self, encolar):
+        TextoAnalizado.objects.filter(id=self.texto.id).update(
+            fin_construccion=datetime(2000, 1, 1, tzinfo=timezone.utc))
+
+        respuesta = self.post_json('/api/sugerencias/', texto='el', texto_id=self.texto.id, n_grama=2)
+
+        self.assertEqual(respuesta.status_code, 202)
+        encolar.assert_called_once()
+
+
+class BuscarFrasesTests(TestCase):
+    def test_contexto_corto_usa_toda_la_historia(self):
+        consultados = []
+
+        def expandir(contexto):
+            consultados.append(contexto)
+            return [(len(contexto) + 10, -1.0)]
+
+        buscar_frases(expandir, (1, 2), 4, 3, 1, 1, 10)
+
+        self.assertEqual(consultados, [(1, 2), (1, 2, 12), (1, 2, 12, 13)])
+
+    def test_contexto_largo_usa_las_ultimas_palabras(self):
+        consultados = []
+
+        def expandir(contexto):
+            consultados.append(contexto)
+            return [(9, -1.0)]
+
+        frases, truncada = buscar_frases(expandir, (1, 2, 3), 2, 2, 1, 1, 10)
+
+        self.assertEqual(consultados, [(2, 3), (3, 9)])
+        self.assertEqual(frases, [((9, 9), -2.0)])
+        self.assertFalse(truncada)
+
+    def test_sin_contexto(self):
+        consultados = []
+        buscar_frases(lambda contexto: consultados.append(contexto) or [(5, -1.0)], (1, 2), 0, 2, 1, 1, 10)
+        self.assertEqual(consultados, [(), ()])
+
+
+class IndicePrefijosTests(TestCase):
+    def setUp(self):
+        # Palabras de 1 a 7 letras de un alfabeto pequeño: muchos prefijos
+        # largos compartidos y muchos empates de frecuencia
+        self.azar = random.Random(5)
+        palabras = {''.join(self.azar.choice('abc') for _ in range(self.azar.randint(1, 7))) for _ in range(2000)}
+        self.vocabulario = Vocabulario(sorted(palabras, key=lambda _: self.azar.random()))
+        self.frecuencias = [self.azar.randint(0, 30) for _ in self.vocabulario.palabras]
+
+    def prefijos_de(self, palabras):
+        return {''} | {palabra[:longitud] for palabra in palabras for longitud in range(1, len(palabra) + 1)}
+
+    def esperado(self, prefijo, k):
+        ids = [i for i, palabra in enumerate(self.vocabulario.palabras) if palabra.startswith(prefijo)]
+        return sorted(ids, key=lambda i: (-self.frecuencias[i], i))[:k]
+
+    def comprobar(self, indice):
+        for prefijo in self.prefijos_de(self.vocabulario.palabras) | {'d', 'abcabcabc'}:
+            for k in (1, 5, 20, 30):
+                self.assertEqual(indice.completar(prefijo, k), self.esperado(prefijo, k), (prefijo, k))
+
+    def test_completar_cualquier_prefijo(self):
+        self.comprobar(IndicePrefijos(self.vocabulario, (), 20, self.frecuencias))
+
+    def test_completar_tras_actualizar(self):
+        indice = IndicePrefijos(self.vocabulario, (), 20, self.frecuencias)
+
+        cambiadas = self.azar.sample(range(len(self.frecuencias)), 40)
+        cambios = {i: self.azar.randint(-self.frecuencias[i], 20) for i in cambiadas}
+        indice.actualizar_frecuencias(cambios)
+        for i, cambio in cambios.items():
+            self.frecuencias[i] += cambio
+        self.comprobar(indice)
+
+        desde = len(self.vocabulario)
+        for palabra in ('aaaaaaaa', 'abcabcab', 'cc0', 'b1'):
+            self.vocabulario.agregar(palabra)
+            self.frecuencias.append(0)
+        indice.agregar_palabras(self.vocabulario, desde)
+        indice.actualizar_frecuencias({desde: 50, desde + 2: 3})
+        self.frecuencias[desde] += 50
+        self.frecuencias[desde + 2] += 3
+        self.comprobar(indice)
+
+    def test_completar_en_contexto_con_indice(self):
+        prefijos = IndicePrefijos(self.vocabulario, (), 20, self.frecuencias)
+        rangos = array('I', sorted(self.azar.sample(range(len(self.vocabulario)), 500)))
+        conteos = array('I', [self.azar.randint(1, 9) for _ in rangos])
+        continuaciones = (sum(conteos), rangos, conteos)
+        indice = MejoresPorRango(len(conteos), 20, clave_continuaciones(conteos))
+
+        for prefijo in self.prefijos_de(prefijos.palabras[rango] for rango in rangos):
+            coinciden = [p for p, rango in enumerate(rangos) if prefijos.palabras[rango].startswith(prefijo)]
+            esperado = [(prefijos.ids[rangos[p]], conteos[p], sum(conteos))
+                        for p in sorted(coinciden, key=lambda p: (-conteos[p], p))[:10]]
+            self.assertEqual(prefijos.completar_en_contexto(prefijo, continuaciones, 10, indice=indice), esperado)
+            self.assertEqual(prefijos.completar_en_contexto(prefijo, continuaciones, 10), esperado)
+
+
+class AnexarTextoTests(ArchivosTemporalesMixin, TestCase):
+    ORDENES = (2, 3)
+
+    def construir(self, texto):
+        for fronteras in (False, True):
+            for n in self.ORDENES:
+                cache_modelos.obtener_modelo(texto, n, fronteras)
+                cache_modelos.obtener_modelo_binario(texto, n, fronteras)
+
+    def estado(self, texto):
+        """Todo lo que guardan el corpus, los modelos y los binarios de un texto"""
+        estado = {}
+        for fronteras in (False, True):
+            corpus = cache_modelos.obtener_corpus(texto, fronteras, construir=False)
+            prefijos = corpus['prefijos']
+            estado[fronteras] = {
+                'ids': list(corpus['ids']),
+                'palabras': list(corpus['vocabulario'].palabras),
+                'prefijos': (prefijos.palabras, list(prefijos.ids), list(prefijos.rangos),
+                             list(prefijos.frecuencias), prefijos._mejores.niveles),
+            }
+            for n in self.ORDENES:
+                modelo = cache_modelos.obtener_modelo(texto, n, fronteras, construir=False)
+                suavizado = modelo['suavizado']
+                estado[fronteras][n] = {
+                    'totales': (modelo['total_palabras'], modelo['total_ngramas']),
+                    'tabla': suavizado['tabla'],
+                    'descuentos': (suavizado['descuentos'], suavizado['conteos_descuento'],
+                                   suavizado['total_vocabulario']),
+                    'continuaciones': {contexto: (conteo, list(rangos), list(conteos))
+                                       for contexto, (conteo, rangos, conteos) in modelo['continuaciones'].items()},
+                    'indice_continuaciones': {contexto: indice.niveles
+                                              for contexto, indice in modelo['indice_continuaciones'].items()},
+                }
+        directorio = cache_modelos.obtener_directorio_cache()
+        binarios = {}
+        for nombre in sorted(os.listdir(directorio)):
+            if nombre.endswith('.ngb'):
+                with open(os.path.join(directorio, nombre), 'rb') as f:
+                    binarios[nombre] = f.read()
+        return estado, binarios
+
+    def test_ampliar_equivale_a_reconstruir(self):
+        texto = self.crear_texto('El perro come carne. El gato duerme mucho y el perro ladra al gato.')
+        self.construir(texto)
+
+        for ampliacion in ('Abeja zumbona y zorro nuevos: el perro mira a la abeja.',
+                           'el gato come carne',
+                           'Ñandú, árbol y ábaco: palabras nuevas delante y detrás.'):
+            respuesta = self.post_json(f'/api/textos/{texto.id}/anexar/', texto=ampliacion)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual([actualizado['ordenes'] for actualizado in respuesta.json()['actualizados']],
+                             [list(self.ORDENES)] * 2)
+            incremental = self.estado(texto)
+
+            self.vaciar_caches()
+            self.construir(texto)
+            self.assertEqual(incremental, self.estado(texto))
+
+
+    def test_lectores_en_curso_no_ven_la_ampliacion(self):
+        texto = self.crear_texto('El perro come carne. El gato duerme mucho y el perro ladra al gato.')
+        self.construir(texto)
+        antes = self.estado(texto)[0]
+        corpus = cache_modelos.obtener_corpus(texto, True, construir=False)
+        modelo = cache_modelos.obtener_modelo(texto, 3, True, construir=False)
+        tabla = dict(modelo['suavizado']['tabla'])
+
+        self.post_json(f'/api/textos/{texto.id}/anexar/', texto='Abeja zumbona y zorro nuevos.')
+
+        self.assertIsNot(cache_modelos.obtener_corpus(texto, True, construir=False), corpus)
+        self.assertEqual(list(corpus['ids']), antes[True]['ids'])
+        self.assertEqual(list(corpus['vocabulario'].palabras), antes[True]['palabras'])
+        self.assertEqual(list(corpus['prefijos'].rangos), antes[True]['prefijos'][2])
+        self.assertEqual(modelo['suavizado']['tabla'], tabla)
+        self.assertEqual({contexto: (conteo, list(rangos), list(conteos))
+                          for contexto, (conteo, rangos, conteos) in modelo['continuaciones'].items()},
+                         antes[True][3]['continuaciones'])
+
+
+class ModeloCorpusTests(ArchivosTemporalesMixin, TestCase):
+    def recontados(self, corpus):
+        """Rutas de los textos que se cuentan al pedir el modelo del corpus"""
+        with mock.patch('analisis.cache_modelos.contar_documento', wraps=cache_modelos.contar_documento) as contar:
+            modelo = cache_modelos.obtener_modelo_corpus(corpus, 2)
+        return modelo, [llamada.args[0] for llamada in contar.call_args_list]
+
+    def test_solo_se_recuenta_el_texto_que_cambia(self):
+        textos = [self.crear_texto(contenido, f'parte{i}') for i, contenido in enumerate((
+            'el perro come carne y el gato duerme.', 'el loro habla y el perro ladra.', 'el gato come pescado.'))]
+        corpus = Corpus.objects.create(nombre='prueba')
+        corpus.textos.set(textos)
+        cache_modelos.obtener_modelo_corpus(corpus, 2)
+
+        with textos[1].archivo.open('a') as archivo:
+            archivo.write(' el loro come fruta.')
+        self.assertEqual(self.recontados(corpus)[1], [textos[1].archivo.path])
+
+        nuevo = self.crear_texto('el caballo come heno.', 'parte3')
+        corpus.textos.add(nuevo)
+        ampliado, contados = self.recontados(corpus)
+        self.assertEqual(contados, [nuevo.archivo.path])
+
+        self.vaciar_caches()
+        reconstruido = cache_modelos.obtener_modelo_corpus(corpus, 2)
+        self.assertEqual(ampliado['suavizado']['tabla'], reconstruido['suavizado']['tabla'])
+
+
+class ConteoFragmentadoTests(TestCase):
+    @mock.patch('analisis.utils.TOKENS_MINIMOS_FRAGMENTO', 200)
+    def test_fragmentos_en_paralelo_igual_que_secuencial(self):
+        # Pocas palabras distintas y muchos tokens: se repiten n-gramas a ambos
+        # lados de cada frontera entre fragmentos
+        ids = [(i * 7 + i // 5) % 13 for i in range(1000)]
+
+        secuencial = construir_trie_conteos(ids, 4)
+        fragmentado = construir_trie_conteos(ids, 4, workers=3)
+
+        for orden in range(1, 5):
+            self.assertEqual(sorted(fragmentado.iterar_ngramas(orden)), sorted(secuencial.iterar_ngramas(orden)))
+
+
+class AlmacenSQLTests(ArchivosTemporalesMixin, TestCase):
+    CONTENIDO = ('el perro come carne y el perro ladra mucho. el gato come pescado y el gato duerme. '
+                 'el perro come pienso y el loro habla.')
+
+    def continuaciones(self, modelo, contexto, decodificar=lambda palabra: palabra):
+        return sorted((decodificar(palabra), conteo, conteo_contexto)
+                      for palabra, conteo, conteo_contexto in modelo.sugerencias(contexto, 100))
+
+    def test_mismas_continuaciones_que_el_binario_con_poda(self):
+        texto = self.crear_texto(self.CONTENIDO)
+        for poda in ({}, {'conteo_minimo': {2: 2}}, {'max_continuaciones': 1}):
+            with self.subTest(poda=poda), self.settings(MODELOS_PODA=poda):
+                sql = obtener_modelo_sql(texto, 2)
+                binario = cache_modelos.obtener_modelo_binario(texto, 2)
+                for palabra in ('perro', 'come', 'gato'):
+                    self.assertEqual(
+                        self.continuaciones(sql, sql.codificar_contexto([palabra])),
+                        self.continuaciones(binario, binario.codificar_contexto([palabra]), binario.palabra))
+
+    def test_orden_mayor_solo_inserta_los_que_faltan(self):
+        texto = self.crear_texto(self.CONTENIDO)
+        obtener_modelo_sql(texto, 2)
+        antes = set(Ngrama.objects.values_list('id', 'orden'))
+
+        modelo = obtener_modelo_sql(texto, 3)
+
+        despues = set(Ngrama.objects.values_list('id', 'orden'))
+        self.assertEqual(ModeloNgramas.objects.count(), 1)
+        self.assertLessEqual(antes, despues)
+        self.assertEqual({orden for _, orden in despues - antes}, {3})
+        self.assertEqual(sorted(modelo.modelo_db.totales_ngramas), ['1', '2', '3'])
+        self.assertEqual(sorted(modelo.sugerencias(('perro', 'come'), 5)), [('carne', 1, 2), ('pienso', 1, 2)])
+
+    def test_ngrama_repetido_se_rechaza(self):
+        obtener_modelo_sql(self.crear_texto(self.CONTENIDO), 2)
+        repetido = Ngrama.objects.first()
+        repetido.pk = None
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            repetido.save()
+
+    def test_contextos_largos(self):
+        palabras = ['palabralarguisima%03d' % i for i in range(60)]
+        texto = self.crear_texto(' '.join(palabras))
+
+        modelo = obtener_modelo_sql(texto, 20)
+
+        self.assertEqual(modelo.sugerencias(tuple(palabras[:19]), 5), [(palabras[19], 1, 1)])
+
+
+class CacheModelosTests(ArchivosTemporalesMixin, TestCase):
+    def en_paralelo(self, funcion, hilos=2):
+        """Llama a funcion() desde varios hilos a la vez y devuelve sus resultados"""
+        barrera = threading.Barrier(hilos)
+        resultados = [None] * hilos
+        errores = []
+
+        def hilo(posicion):
+            barrera.wait()
+            try:
+                resultados[posicion] = funcion()
+            except Exception as e:
+                errores.append(e)
+
+        lanzados = [threading.Thread(target=hilo, args=(i,)) for i in range(hilos)]
+        for lanzado in lanzados:
+            lanzado.start()
+        for lanzado in lanzados:
+            lanzado.join()
+        self.assertEqual(errores, [])
+        return resultados
+
+    def test_escrituras_simultaneas_del_mismo_archivo(self):
+        directorio = cache_modelos.obtener_directorio_cache()
+        for _ in range(30):
+            self.en_paralelo(lambda: cache_modelos._guardar_modelo_disco(
+                directorio, '1_2_0_prueba.pickle', list(range(10000)), '1_2_0_'))
+        self.assertEqual(os.listdir(directorio), ['1_2_0_prueba.pickle'])
+
+    def test_modelo_pedido_a_la_vez_se_construye_una_vez(self):
+        texto = self.crear_texto('el perro come carne y el gato duerme')
+        compilar = cache_modelos.compilar_modelo_ngramas
+
+        def compilar_lento(*args, **kwargs):
+            time.sleep(0.05)
+            return compilar(*args, **kwargs)
+
+        with mock.patch('analisis.cache_modelos.compilar_modelo_ngramas', side_effect=compilar_lento) as contar:
+            modelos = self.en_paralelo(lambda: cache_modelos.obtener_modelo(texto, 2), hilos=4)
+        self.assertEqual(contar.call_count, 1)
+        self.assertTrue(all(modelo is modelos[0] for modelo in modelos))
+
+    def test_binario_pedido_a_la_vez_se_escribe_una_vez(self):
+        texto = self.crear_texto('el perro come carne y el gato duerme')
+        cache_modelos.obtener_modelo(texto, 2)
+        escribir = cache_modelos.escribir_modelo_binario
+
+        with mock.patch('analisis.cache_modelos.escribir_modelo_binario', side_effect=escribir) as contar:
+            binarios = self.en_paralelo(lambda: cache_modelos.obtener_modelo_binario(texto, 2), hilos=4)
+        self.assertEqual(contar.call_count, 1)
+        self.assertTrue(all(binario is binarios[0] for binario in binarios))
+        self.assertEqual(binarios[0].total_palabras, 5)
+
+    def test_tamano_se_estima_al_construir_y_no_al_cargar(self):
+        texto = self.crear_texto('el perro come carne y el gato duerme')
+        estimar = mock.Mock(wraps=cache_modelos._modelos_en_memoria.estimar)
+        with mock.patch.object(cache_modelos._modelos_en_memoria, 'estimar', estimar):
+            cache_modelos.obtener_modelo(texto, 2)
+            self.assertEqual(estimar.call_count, 1)
+            tamano = cache_modelos._modelos_en_memoria.tamano((texto.id, 2, False))
+
+            # Desde disco, como un proceso nuevo: el tamaño viene con el modelo
+            self.olvidar_memoria()
+            cache_modelos.obtener_modelo(texto, 2)
+            self.assertEqual(estimar.call_count, 1)
+            self.assertEqual(cache_modelos._modelos_en_memoria.tamano((texto.id, 2, False)), tamano)
+
+    @mock.patch('analisis.cache_modelos.MAX_HASHES_MEMORIZADOS', 2)
+    def test_hashes_memorizados_acotados(self):
+        textos = [self.crear_texto(f'texto numero {i}', f'prueba{i}') for i in range(3)]
+        for texto in textos:
+            cache_modelos.calcular_hash_archivo(texto.archivo)
+        self.assertLessEqual(len(cache_modelos._hashes_archivos), 2)
+
+        # Un archivo modificado reemplaza su hash en lugar de añadir otro
+        with textos[2].archivo.open('a') as archivo:
+            archivo.write(' y algo más')
+        cache_modelos.calcular_hash_archivo(textos[2].archivo)
+        self.assertEqual(list(cache_modelos._hashes_archivos).count(textos[2].archivo.path), 1)
+
+    def test_modificar_el_archivo_invalida_el_modelo(self):
+        texto = self.crear_texto('el perro come carne')
+        self.assertEqual(cache_modelos.obtener_modelo(texto, 2)['total_palabras'], 3)
+
+        with texto.archivo.open('w') as archivo:
+            archivo.write('el gato duerme y el loro habla')
+
+        self.assertIsNone(cache_modelos.obtener_modelo(texto, 2, construir=False))
+        self.assertEqual(cache_modelos.obtener_modelo(texto, 2)['total_palabras'], 4)
+        self.assertEqual(cache_modelos.obtener_modelo_binario(texto, 2).total_palabras, 4)
+
+
+def limpiar_texto_original(texto, usar_stopwords=True, fronteras=False):
+    """Limpieza anterior al Tokenizador, como referencia de sus resultados"""
+    def normalizar(texto):
+        texto = texto.replace('ñ', '__n_tilde__').replace('ü', '__u_dieresis__')
+        texto = texto.replace('Ñ', '__N_tilde__').replace('Ü', '__U_dieresis__')
+        texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+        texto = texto.replace('__n_tilde__', 'ñ').replace('__u_dieresis__', 'ü')
+        return texto.replace('__N_tilde__', 'Ñ').replace('__U_dieresis__', 'Ü')
+
+    stopwords = {normalizar(palabra) for palabra in STOPWORDS_ES}
+    texto_limpio = re.sub(r'[^\w\sñü]', ' ', normalizar(texto.lower()))
+    oraciones = re.split(r'[.!?]+', texto_limpio) if fronteras else [texto_limpio]
+    tokens = []
+    for oracion in oraciones:
+        palabras = oracion.split()
+        if usar_stopwords or fronteras:
+            palabras = [palabra for palabra in palabras if palabra not in stopwords and len(palabra) > 1]
+        if fronteras and oracion.strip():
+            palabras = ['<s>', *palabras, '</s>']
+        tokens.extend(palabras)
+    return tokens
+
+class TokenizadorTests(TestCase):
+    TEXTOS = [
+        'El Niño comió pingüinos y ÁRBOLES; ¿qué pasó?',
+        'Ñandú, cigüeña y camión: ¡acción!  El perro ladra.\nOtra línea aquí',
+        'a b c 123 __n_tilde__ x_y',
+        '   ',
+        'la de el y que',
+    ]
+
+    def test_mismos_tokens_que_la_limpieza_original(self):
+        for texto in self.TEXTOS:
+            with self.subTest(texto=texto):
+                self.assertEqual(TOKENIZADOR.limpiar(texto), limpiar_texto_original(texto))
+                self.assertEqual(TOKENIZADOR.limpiar(texto, usar_stopwords=False),
+                                 limpiar_texto_original(texto, usar_stopwords=False))
+                self.assertEqual(TOKENIZADOR.limpiar(texto, fronteras=True),
+                                 limpiar_texto_original(texto, fronteras=True))
+
+    def test_por_bloques_igual_que_el_texto_completo(self):
+        texto = ' '.join(self.TEXTOS) * 3
+        for tamano in (1, 3, 7, 64):
+            for fronteras in (False, True):
+                with self.subTest(tamano=tamano, fronteras=fronteras):
+                    bloques = [texto[i:i + tamano] for i in range(0, len(texto), tamano)]
+                    self.assertEqual(list(TOKENIZADOR.tokens_por_bloques(bloques, fronteras)),
+                                     TOKENIZADOR.limpiar(texto, fronteras))
+
+
+
+
+class KneserNeyTests(TestCase):
+    def test_distribucion_suma_uno(self):
+        tokens = TOKENIZADOR.limpiar('perro come carne perro come pienso gato come carne gato duerme '
+                                     'perro ladra gato come pescado loro habla perro come carne')
+        vocabulario, suavizado = tabla_de(tokens, 3)
+
+        for contexto in (['perro', 'come'], ['gato'], ['loro', 'habla'], []):
+            with self.subTest(contexto=contexto):
+                entradas = _entradas_contexto(suavizado, vocabulario.codificar(contexto))
+                total = sum(probabilidad_kneser_ney(suavizado, entradas, id_palabra)
+                            for id_palabra in range(len(vocabulario)))
+                self.assertAlmostEqual(total, 1.0)
+
+    def test_sugerencias_ordenadas_por_probabilidad_interpolada(self):
+        tokens = TOKENIZADOR.limpiar('perro come carne perro come pienso gato come carne gato duerme')
+        vocabulario, suavizado = tabla_de(tokens, 3)
+        contexto_ids = vocabulario.codificar(['perro', 'come'])
+
+        sugerencias = sugerir_kneser_ney(suavizado, contexto_ids, 3)
+
+        entradas = _entradas_contexto(suavizado, contexto_ids)
+        for id_palabra, probabilidad, *_ in sugerencias:
+            self.assertAlmostEqual(probabilidad, probabilidad_kneser_ney(suavizado, entradas, id_palabra))
+        self.assertEqual([vocabulario.palabra(s[0]) for s in sugerencias[:2]], ['carne', 'pienso'])
+        self.assertEqual([s[1] for s in sugerencias], sorted((s[1] for s in sugerencias), reverse=True))
+
+
+class PodaTests(ArchivosTemporalesMixin, TestCase):
+    # C(perro gato) = 3, C(perro loro) = 1, C(perro) = 4: la pérdida de
+    # entropía de "perro loro" es 1/8 · ln 2 ≈ 0.087 y la de las demás 3/8 · ln 2
+    CONTENIDO = 'perro gato perro gato perro gato perro loro'
+
+    def test_poda_por_entropia(self):
+        vocabulario = Vocabulario()
+        trie = TrieConteos(2)
+        trie.agregar_secuencia(vocabulario.codificar(self.CONTENIDO.split()))
+        with self.settings(MODELOS_PODA={'umbral_entropia': 0.1}):
+            poda = opciones_poda()
+
+        conservados = sorted(vocabulario.decodificar(ngrama) for ngrama, _, _ in iterar_ngramas_podados(trie, 2, poda))
+
+        self.assertEqual(conservados, ['gato perro', 'perro gato'])
+
+    def test_niveles_mantienen_el_orden(self):
+        niveles = NivelesProbabilidad(4)
+        probabilidades = [1.0, 0.9, 0.5, 0.3, 0.05, 1e-4, 1e-12]
+
+        asignados = [niveles.nivel(p) for p in probabilidades]
+        cuantizadas = [niveles.cuantizar(p)[0] for p in probabilidades]
+
+        self.assertEqual(asignados, sorted(asignados))
+        self.assertEqual(cuantizadas, sorted(cuantizadas, reverse=True))
+        self.assertEqual((asignados[0], asignados[-1]), (0, niveles.niveles - 1))
+        self.assertEqual((niveles.tipo, NivelesProbabilidad(9).tipo), ('B', 'H'))
+
+    def test_modelo_cuantizado_sirve_niveles(self):
+        texto = self.crear_texto(self.CONTENIDO)
+        with self.settings(MODELOS_PODA={'umbral_entropia': 0.1, 'bits_cuantizacion': 8}):
+            modelo = cache_modelos.obtener_modelo(texto, 2)
+            binario = cache_modelos.obtener_modelo_binario(texto, 2)
+        contexto = modelo['vocabulario'].codificar_contexto(['perro'])
+        gato, = modelo['vocabulario'].codificar_contexto(['gato'])
+
+        self.assertEqual(modelo['continuaciones'][contexto][2].typecode, 'B')
+        self.assertEqual(binario.conteos.format, 'B')
+        # P = 3/4 cae en un nivel que vuelve a dar 3 de 4
+        self.assertEqual(completar_palabra(modelo, contexto, '', 5), [(gato, 3, 4)])
+        self.assertEqual(binario.sugerencias(contexto, 5), [(gato, 3, 4)])
+
+
+class PerplejidadTests(ArchivosTemporalesMixin, TestCase):
+    def test_perplejidad_con_las_probabilidades_kneser_ney(self):
+        texto = self.crear_texto('perro come carne. gato come pescado. perro come pienso. loro habla.')
+        modelo = cache_modelos.obtener_modelo(texto, 3)
+        vocabulario, suavizado = modelo['vocabulario'], modelo['suavizado']
+        oraciones = dividir_oraciones('perro come pescado. gato come carne!\nloro vuela')
+        self.assertEqual([oracion.strip() for oracion in oraciones],
+                         ['perro come pescado', 'gato come carne', 'loro vuela'])
+
+        resultados = evaluar_oraciones(modelo, oraciones, [1, 2, 3])
+
+        for resultado in resultados:
+            n = resultado['n_grama']
+            with self.subTest(n=n):
+                # El contexto empieza en cada oración y vuelve a empezar tras
+                # "vuela", que está fuera del vocabulario
+                esperado = 0.0
+                for oracion in oraciones:
+                    ids = [vocabulario.ids.get(palabra) for palabra in oracion.split()]
+                    inicio = 0
+                    for posicion, id_palabra in enumerate(ids):
+                        if id_palabra is None:
+                            inicio = posicion + 1
+                            continue
+                        entradas = _entradas_contexto(suavizado, ids[max(inicio, posicion - n + 1):posicion])
+                        esperado += math.log(probabilidad_kneser_ney(suavizado, entradas, id_palabra))
+
+                self.assertAlmostEqual(resultado['log_verosimilitud'], esperado)
+                self.assertAlmostEqual(resultado['perplejidad'], math.exp(-esperado / 7))
+                self.assertEqual((resultado['tokens'], resultado['oov'], resultado['tasa_oov']), (7, 1, 1 / 8))
+                self.assertEqual([oracion['tokens'] for oracion in resultado['oraciones']], [3, 3, 1])
+        # Con más contexto, el texto conocido es más probable
+        self.assertLess(resultados[2]['perplejidad'], resultados[0]['perplejidad'])
+
+
+@unittest.skipIf(np is None, 'NumPy no está instalado')
+class MotorColumnarTests(TestCase):
+    TOKENS = TOKENIZADOR.limpiar('el perro come carne y el perro ladra. el gato come pescado y el gato '
+                                 'duerme. el perro come pienso, el gato come carne y el loro come pan.')
+
+    def test_mismo_resultado_que_el_motor_de_python(self):
+        with self.settings(MODELOS_PODA={'conteo_minimo': {2: 2, 3: 2}}):
+            podada = opciones_poda()
+        for n in (2, 3):
+            for poda in (None, podada):
+                with self.subTest(n=n, poda=poda):
+                    with self.settings(MOTOR_NGRAMAS='python'):
+                        python = calcular_probabilidad_ngramas(self.TOKENS, n, poda)
+                    with self.settings(MOTOR_NGRAMAS='numpy'):
+                        columnar = calcular_probabilidad_ngramas(self.TOKENS, n, poda)
+
+                    self.assertEqual(list(columnar), list(python))
+                    for ngrama, datos in python.items():
+                        for campo, valor in datos.items():
+                            if isinstance(valor, float):
+                                self.assertAlmostEqual(columnar[ngrama][campo], valor)
+                            else:
+                                self.assertEqual(columnar[ngrama][campo], valor)
+
+    def test_cuantizado_guarda_solo_el_nivel(self):
+        with self.settings(MODELOS_PODA={'bits_cuantizacion': 4}):
+            poda = opciones_poda()
+        with self.settings(MOTOR_NGRAMAS='python'):
+            python = calcular_probabilidad_ngramas(self.TOKENS, 2, poda)
+        with self.settings(MOTOR_NGRAMAS='numpy'):
+            columnar = calcular_probabilidad_ngramas(self.TOKENS, 2, poda)
+
+        self.assertEqual(columnar.niveles.dtype, np.uint8)
+        self.assertIsNone(columnar.probabilidades)
+        self.assertEqual(dict(columnar.items()), python)
+
+    def test_pagina_de_analisis_con_el_motor_columnar(self):
+        contenido = ' '.join(self.TOKENS)
+        with self.settings(MOTOR_NGRAMAS='python'):
+            python = procesar_texto_completo(contenido, 3, False, [2, 3, 4])
+        with mock.patch('analisis.utils.calcular_probabilidad_ngramas_columnar',
+                        wraps=calcular_probabilidad_ngramas_columnar) as columnar, \
+                self.settings(MOTOR_NGRAMAS='numpy'):
+            resultado = procesar_texto_completo(contenido, 3, False, [2, 3, 4])
+
+        self.assertEqual(columnar.call_count, 3)
+        self.assertEqual(resultado['ngramas_comunes'], python['ngramas_comunes'])
+        for n in (2, 4):
+            self.assertEqual(list(resultado['ngramas_comparacion'][n]), list(python['ngramas_comparacion'][n]))
+
+
+
+class VistasTests(ArchivosTemporalesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.texto = self.crear_texto('el perro come carne y el gato come pescado. el perro come pienso.')
+
+    @mock.patch('analisis.views.encolar_construccion')
+    def test_modelo_sin_construir_responde_202_y_encola(self, encolar):
+        respuesta = self.post_json('/api/sugerencias/', texto='perro', texto_id=self.texto.id, n_grama=2)
+
+        self.assertEqual(respuesta.status_code, 202)
+        self.assertEqual(respuesta.json()['n_grama'], 2)
+        encolar.assert_called_once_with(self.texto.id, [2], [False])
+
+    # La plantilla no interviene en el ETag
+    @mock.patch('analisis.views.render', lambda *args, **kwargs: HttpResponse('ok'))
+    def test_etag_de_la_pagina_de_analisis(self):
+        url = f'/analizar/{self.texto.id}/?n_grama=2'
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        etag = respuesta['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Otros parámetros u otro contenido cambian el ETag
+        self.assertNotEqual(self.client.get(f'/analizar/{self.texto.id}/?n_grama=3')['ETag'], etag)
+        with self.texto.archivo.open('a') as archivo:
+            archivo.write(' el loro habla')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @mock.patch('analisis.views.render', lambda *args, **kwargs: HttpResponse('ok'))
+    def test_archivo_que_no_es_utf8_se_muestra_vacio(self):
+        texto = TextoAnalizado(titulo='latin1')
+        texto.archivo.save('latin1.txt', ContentFile('el niño come'.encode('latin-1')))
+
+        for url in (f'/analizar/{texto.id}/', f'/procesamiento/{texto.id}/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_comparacion_guarda_solo_totales_y_mejores(self):
+        with mock.patch('analisis.views.render', return_value=HttpResponse('ok')) as render:
+            self.client.get(f'/comparar/{self.texto.id}/?n_grama=2')
+
+        plantilla, contexto = render.call_args.args[1:]
+        self.assertEqual(plantilla, 'comparacion.html')
+        for variante in ('sin_fronteras', 'con_fronteras'):
+            self.assertEqual(set(contexto[variante]), {'total_palabras', 'total_ngramas', 'top_ngramas'})
+        self.assertEqual(contexto['sin_fronteras']['total_palabras'], 9)
+        self.assertEqual(contexto['sin_fronteras']['top_ngramas'][0][0], 'perro come')
+
+    def test_lote_ndjson(self):
+        cache_modelos.obtener_modelo_binario(self.texto, 2)
+
+        respuesta = self.post_json('/api/sugerencias/lote/', textos=['el perro', '', 'gato come'],
+                                   texto_id=self.texto.id, n_grama=2)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson')
+        lineas = [json.loads(linea) for linea in b''.join(respuesta.streaming_content).decode().splitlines()]
+        self.assertEqual([linea['indice'] for linea in lineas], [0, 1, 2])
+        self.assertEqual([s['palabra'] for s in lineas[0]['sugerencias']], ['come'])
+        self.assertEqual(lineas[1], {'indice': 1, 'texto': '', 'error': 'Texto vacío'})
+        self.assertEqual({s['palabra'] for s in lineas[2]['sugerencias']}, {'carne', 'pescado', 'pienso'})
+
+
+class SugerenciasAsincronasTests(ArchivosTemporalesMixin, TransactionTestCase):
+    # La carga se hace en otro hilo, con su propia conexión: los datos de la
+    # prueba tienen que estar confirmados
+    @mock.patch('analisis.views.encolar_construccion')
+    def test_async_peticiones_simultaneas_esperan_una_sola_carga(self, encolar):
+        texto = self.crear_texto('el perro come carne y el gato come pescado.')
+        cargar = views._cargar_modelo_sugerencias
+
+        def cargar_lento(parametros):
+            time.sleep(0.05)
+            return cargar(parametros)
+
+        def peticion():
+            datos = {'texto': 'perro', 'texto_id': texto.id, 'n_grama': 2}
+            return RequestFactory().post('/api/sugerencias/async/', json.dumps(datos), content_type='application/json')
+
+        async def simultaneas():
+            return await asyncio.gather(*(views.obtener_sugerencias_async(peticion()) for _ in range(3)))
+
+        with mock.patch('analisis.views._cargar_modelo_sugerencias', side_effect=cargar_lento) as contar:
+            respuestas = async_to_sync(simultaneas)()
+
+        self.assertEqual(contar.call_count, 1)
+        self.assertEqual([respuesta.status_code for respuesta in respuestas], [202] * 3)
+        self.assertEqual(len({id(respuesta) for respuesta in respuestas}), 3)
+        encolar.assert_called_once_with(texto.id, [2], [False])
+        self.assertEqual(views._cargas_en_curso, {})
+
+
+class PercentilTests(TestCase):
+    def test_lista_vacia(self):
+        self.assertIsNone(percentil([], 95))
+        self.assertEqual((formatear_ms(None), formatear_porcentaje(None)), ('n/a', 'n/a'))
+
+    def test_rango_mas_cercano(self):
+        self.assertEqual([percentil([3, 1, 2, 4], p) for p in (0, 50, 95, 100)], [1, 2, 4, 4])
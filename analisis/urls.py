@@ -6,10 +6,16 @@ urlpatterns = [
     path('', views.lista_textos, name='lista_textos'),
     path('analizar/<int:texto_id>/', views.analizar_texto, name='analizar_texto'),
     path('procesamiento/<int:texto_id>/', views.ver_procesamiento, name='ver_procesamiento'),
+    path('api/textos/<int:texto_id>/anexar/', views.ampliar_texto, name='ampliar_texto'),
     
     # Nuevas rutas
     path('autocompletado/', views.autocompletado_view, name='autocompletado'),
     path('api/sugerencias/', views.obtener_sugerencias, name='obtener_sugerencias'),
+    path('api/sugerencias/lote/', views.obtener_sugerencias_lote, name='obtener_sugerencias_lote'),
+    path('api/sugerencias/async/', views.obtener_sugerencias_async, name='obtener_sugerencias_async'),
+    path('api/perplejidad/', views.puntuar_texto, name='puntuar_texto'),
+    path('api/modelos/estadisticas/', views.estadisticas_modelos, name='estadisticas_modelos'),
+    path('metrics', views.ver_metricas, name='metricas'),
     path('entrenar-modelo/', views.entrenar_modelo, name='entrenar_modelo'),
     
     # SOLO ESTA RUTA PARA COMPARACIÓN
@@ -1,7 +1,22 @@
 import re
 import unicodedata
 import math  
+import multiprocessing
+from array import array
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from .columnar import calcular_probabilidad_ngramas_columnar, usar_motor_columnar
+from .conteo import TrieConteos
+from .metricas import etapa
+from .poda import continuaciones_conservadas, cuantizador_poda, iterar_ngramas_podados
+from .prefijos import MAX_CONTINUACIONES_SIN_INDICE, MejoresPorRango, clave_continuaciones
+from .prefijos import desplazar_rango, indexar_continuaciones
+from .suavizado import HIJOS, construir_tabla_suavizado, actualizar_tabla_suavizado
+from .vocabulario import Vocabulario
+
+# Máximo de sugerencias que se guardan por contexto (el límite de la API)
+TOP_K_INDICE = 20
 
 # Lista de stopwords en español (incluyendo versiones acentuadas)
 STOPWORDS_ES = {
@@ -49,66 +64,118 @@ STOPWORDS_ES = {
     'vuestras', 'cuyo', 'cuya', 'cuyos', 'cuyas'
 }
 
+# Marcadores con los que normalizar_acentos protege ñ y ü durante la
+# descomposición NFKD; un texto que ya los contenga también se convierte
+MARCADORES_PROTEGIDOS = (
+    ('__n_tilde__', 'ñ'), ('__u_dieresis__', 'ü'),
+    ('__N_tilde__', 'Ñ'), ('__U_dieresis__', 'Ü'),
+)
+
 def normalizar_acentos(texto):
     """Normaliza los caracteres acentuados preservando ñ y ü"""
-    texto = texto.replace('ñ', '__n_tilde__').replace('ü', '__u_dieresis__')
-    texto = texto.replace('Ñ', '__N_tilde__').replace('Ü', '__U_dieresis__')
-    texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
-    texto = texto.replace('__n_tilde__', 'ñ').replace('__u_dieresis__', 'ü')
-    texto = texto.replace('__N_tilde__', 'Ñ').replace('__U_dieresis__', 'Ü')
+    if not texto.isascii():
+        for marcador, letra in MARCADORES_PROTEGIDOS:
+            texto = texto.replace(letra, marcador)
+        texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+    
+    # Un texto ASCII no cambia con NFKD: solo hay que restaurar los marcadores
+    if '__' in texto:
+        for marcador, letra in MARCADORES_PROTEGIDOS:
+            texto = texto.replace(marcador, letra)
     return texto
 
-def limpiar_texto(texto, usar_stopwords=True):
-    """Limpia el texto: minúsculas, elimina puntuación y stopwords"""
-    texto = texto.lower()
-    texto = normalizar_acentos(texto)
+# Separadores seguros para cortar un texto en bloques: los espacios que no es
+# ASCII (p. ej. U+2028) pueden desaparecer al normalizar y unir dos palabras
+ESPACIOS_ASCII = ' \n\t\r\x0b\x0c\x1c\x1d\x1e\x1f'
+
+# Tamaño (en caracteres) de los bloques al leer archivos de texto
+TAMANO_BLOQUE_LECTURA = 1024 * 1024
+
+# Por debajo de este número de tokens por fragmento no compensa repartir el conteo
+TOKENS_MINIMOS_FRAGMENTO = 100000
+
+class Tokenizador:
+    """
+    Tokenizador precompilado equivalente a limpiar_texto y
+    limpiar_texto_con_fronteras: el conjunto de stopwords normalizadas y la
+    expresión regular se preparan una sola vez y los tokens se entregan con un
+    generador.
+    """
+    
+    def __init__(self, stopwords=STOPWORDS_ES):
+        self.stopwords = frozenset(normalizar_acentos(palabra) for palabra in stopwords)
+        # Tras normalizar solo quedan ASCII, ñ y ü: cualquier racha de símbolos
+        # que no sean letras, dígitos o espacios separa palabras
+        self.patron_simbolos = re.compile(r'[^\w\s]+')
     
-    # Eliminar símbolos de puntuación y caracteres especiales
-    texto_limpio = re.sub(r'[^\w\sñü]', ' ', texto)
+    def palabras(self, texto):
+        """Todas las palabras del texto normalizado, sin filtrar stopwords"""
+        return self.patron_simbolos.sub(' ', normalizar_acentos(texto.lower())).split()
     
-    # Tokenizar
-    palabras = texto_limpio.split()
+    def _filtrar(self, palabras, usar_stopwords):
+        if not usar_stopwords:
+            return palabras
+        stopwords = self.stopwords
+        return [palabra for palabra in palabras if palabra not in stopwords and len(palabra) > 1]
+    
+    def limpiar(self, texto, fronteras=False, usar_stopwords=True):
+        """
+        Lista de tokens limpios del texto. Con fronteras se añaden <s> y </s>.
+        La puntuación se elimina antes de buscar el final de oración, así que
+        (igual que hacía limpiar_texto_con_fronteras) todo el texto es una
+        sola oración.
+        """
+        palabras = self.palabras(texto)
+        tokens = self._filtrar(palabras, usar_stopwords)
+        
+        if fronteras and palabras:
+            tokens.insert(0, '<s>')
+            tokens.append('</s>')
+        return tokens
     
-    # Eliminar stopwords si se solicita
-    if usar_stopwords:
-        stopwords_normalizadas = {normalizar_acentos(palabra) for palabra in STOPWORDS_ES}
-        palabras = [palabra for palabra in palabras if palabra not in stopwords_normalizadas and len(palabra) > 1]
+    def tokens(self, texto, fronteras=False, usar_stopwords=True):
+        """Generador con los mismos tokens que limpiar()"""
+        yield from self.limpiar(texto, fronteras, usar_stopwords)
     
-    return palabras
+    def tokens_por_bloques(self, bloques, fronteras=False, usar_stopwords=True):
+        """
+        Igual que tokens() pero recibiendo el texto en bloques (por ejemplo,
+        leídos de un archivo enorme). Cada bloque se corta en su último espacio
+        ASCII y el resto se arrastra al siguiente, así ninguna palabra queda
+        partida; el resultado es idéntico al de procesar el texto completo.
+        """
+        pendiente = ''
+        abierta = False
+        
+        for bloque in bloques:
+            bloque = pendiente + bloque
+            corte = max(map(bloque.rfind, ESPACIOS_ASCII)) + 1
+            pendiente = bloque[corte:]
+            
+            palabras = self.palabras(bloque[:corte])
+            if fronteras and palabras and not abierta:
+                abierta = True
+                yield '<s>'
+            yield from self._filtrar(palabras, usar_stopwords)
+        
+        palabras = self.palabras(pendiente)
+        if fronteras and palabras and not abierta:
+            abierta = True
+            yield '<s>'
+        yield from self._filtrar(palabras, usar_stopwords)
+        
+        if abierta:
+            yield '</s>'
+
+TOKENIZADOR = Tokenizador()
+
+def limpiar_texto(texto, usar_stopwords=True):
+    """Limpia el texto: minúsculas, elimina puntuación y stopwords"""
+    return TOKENIZADOR.limpiar(texto, usar_stopwords=usar_stopwords)
 
 def limpiar_texto_con_fronteras(texto):
     """Limpia el texto incluyendo fronteras de oración <s> y </s>"""
-    texto = texto.lower()
-    texto = normalizar_acentos(texto)
-    
-    # Eliminar símbolos de puntuación y caracteres especiales
-    texto_limpio = re.sub(r'[^\w\sñü]', ' ', texto)
-    
-    # Dividir en oraciones usando puntuación
-    oraciones = re.split(r'[.!?]+', texto_limpio)
-    
-    # Procesar cada oración por separado
-    todas_palabras = []
-    for oracion in oraciones:
-        oracion = oracion.strip()
-        if oracion:
-            # Añadir marcador de inicio de oración
-            todas_palabras.append('<s>')
-            
-            # Tokenizar y filtrar stopwords
-            palabras = oracion.split()
-            stopwords_normalizadas = {normalizar_acentos(palabra) for palabra in STOPWORDS_ES}
-            palabras_filtradas = [
-                palabra for palabra in palabras 
-                if palabra not in stopwords_normalizadas and len(palabra) > 1
-            ]
-            
-            todas_palabras.extend(palabras_filtradas)
-            
-            # Añadir marcador de fin de oración
-            todas_palabras.append('</s>')
-    
-    return todas_palabras
+    return TOKENIZADOR.limpiar(texto, fronteras=True)
 
 def generar_ngramas(tokens, n=2):
     """Genera n-gramas a partir de una lista de tokens"""
@@ -122,56 +189,148 @@ def generar_ngramas(tokens, n=2):
     
     return ngramas
 
-def calcular_probabilidad_ngramas_general(tokens, n):
+def construir_trie_conteos(ids, orden_maximo, workers=1):
     """
-    Calcula probabilidades para n-gramas usando la fórmula:
-    P(w_i|w_{i-n+1}^{i-1}) = C(w_{i-n+1}^{i}) / C(w_{i-n+1}^{i-1})
+    Cuenta en una sola pasada los n-gramas de todos los órdenes hasta orden_maximo.
+    Con workers > 1 y un texto grande, el conteo se reparte en fragmentos
+    (ver construir_trie_conteos_fragmentado); el resultado es el mismo.
+    """
+    if workers > 1 and len(ids) >= 2 * TOKENS_MINIMOS_FRAGMENTO:
+        return construir_trie_conteos_fragmentado(ids, orden_maximo, workers)
+    trie = TrieConteos(orden_maximo)
+    trie.agregar_secuencia(ids)
+    return trie
+
+def pool_procesos(workers):
+    """
+    Pool de procesos para contar en paralelo. Los procesos se crean con spawn
+    y no con fork: el pool se abre desde el servidor web y desde los hilos
+    de construcción, y un fork heredaría candados tomados por otros hilos.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def contar_fragmento(ids, orden_maximo):
+    """Cuenta un fragmento de ids como si fuera un texto independiente"""
+    trie = construir_trie_conteos(ids, orden_maximo)
+    trie.cortar()
+    return trie
+
+def construir_trie_conteos_fragmentado(ids, orden_maximo, workers):
+    """
+    Parte los ids en fragmentos contiguos, cuenta cada uno en un pool de
+    procesos y suma los tries. Cada fragmento solo ve sus propias ventanas, así
+    que después se cuentan las que cruzan cada frontera entre fragmentos: las
+    que empiezan en las orden_maximo-1 posiciones anteriores y terminan en las
+    orden_maximo-1 siguientes. Sus prefijos o también cruzan la frontera o
+    caen dentro del fragmento anterior, de modo que los conteos coinciden
+    exactamente con los del conteo secuencial.
+    """
+    total = len(ids)
+    fragmentos = max(1, min(workers, total // TOKENS_MINIMOS_FRAGMENTO))
+    fronteras = [total * i // fragmentos for i in range(fragmentos + 1)]
+    # Ids distintos que usa el texto: los del vocabulario, de 0 al mayor
+    total_vocabulario = max(ids) + 1 if total else 0
+
+    trie = TrieConteos(orden_maximo)
+    with pool_procesos(fragmentos) as pool:
+        parciales = pool.map(contar_fragmento,
+                             [ids[inicio:fin] for inicio, fin in zip(fronteras, fronteras[1:])],
+                             [orden_maximo] * fragmentos)
+        for parcial in parciales:
+            # Todos comparten el vocabulario: el mapa de ids es la identidad
+            trie.sumar(parcial, range(total_vocabulario))
+
+    for frontera in fronteras[1:-1]:
+        for fin in range(frontera, min(frontera + orden_maximo - 1, total)):
+            for inicio in range(max(0, fin - orden_maximo + 1), frontera):
+                trie.contar(ids[inicio:fin + 1])
+    return trie
+
+def probabilidades_desde_trie(trie, n, poda=None):
+    """
+    Deriva del trie las probabilidades de orden n:
+    P(w_i|contexto) = C(contexto, w_i) / C(contexto)
+    Con opciones de poda (ver poda.py) se omiten los n-gramas podados y, si
+    se piden bits de cuantización, las probabilidades se guardan por niveles.
     """
     if n < 2:
         return {}
     
-    # Generar n-gramas
-    ngramas = generar_ngramas(tokens, n)
-    
-    # Generar (n-1)-gramas (contextos)
-    n_minus1_gramas = generar_ngramas(tokens, n-1)
-    
-    # Contar frecuencias
-    freq_ngramas = Counter(ngramas)
-    freq_contextos = Counter(n_minus1_gramas)
-    
-    # Calcular probabilidades
+    niveles = cuantizador_poda(poda)
     probabilidades = {}
-    for ngrama, count_ngrama in freq_ngramas.items():
-        # Extraer el contexto (primeras n-1 palabras)
-        palabras = ngrama.split()
-        contexto = ' '.join(palabras[:-1])
-        
-        count_contexto = freq_contextos.get(contexto, 0)
-        
-        if count_contexto > 0:
-            probabilidad = count_ngrama / count_contexto
+    for ngrama, count_ngrama, count_contexto in iterar_ngramas_podados(trie, n, poda):
+        probabilidad = count_ngrama / count_contexto
+        if niveles:
+            probabilidad, log_probabilidad = niveles.cuantizar(probabilidad)
         else:
-            probabilidad = 0.0
-        
-        # Calcular log probabilidad
-        log_probabilidad = math.log(probabilidad) if probabilidad > 0 else float('-inf')
+            log_probabilidad = math.log(probabilidad)
         
         probabilidades[ngrama] = {
             'frecuencia_ngrama': count_ngrama,
-            'contexto': contexto,
+            'contexto': ngrama[:-1],
             'frecuencia_contexto': count_contexto,
             'probabilidad': probabilidad,
             'log_probabilidad': log_probabilidad,
-            'palabra_objetivo': palabras[-1],
+            'palabra_objetivo': ngrama[-1],
             'orden_ngrama': n
         }
     
     return probabilidades
 
-def calcular_probabilidad_ngramas(tokens, n):
+def calcular_probabilidad_ngramas_codificados(ids, n, workers=1, poda=None):
+    """
+    Calcula las probabilidades de n-gramas sobre una secuencia de ids.
+    Las claves, el contexto y la palabra objetivo son enteros (tuplas de ids);
+    ver decodificar_probabilidades para obtener la versión legible.
+    """
+    if n < 2:
+        return {}
+    
+    return probabilidades_desde_trie(construir_trie_conteos(ids, n, workers), n, poda)
+
+def decodificar_probabilidades(probabilidades, vocabulario):
+    """Convierte un resultado codificado en el formato con cadenas que usan las plantillas"""
+    decodificar = vocabulario.decodificar
+    palabras = vocabulario.palabras
+    
+    return {
+        decodificar(ngrama): {
+            **datos,
+            'contexto': decodificar(datos['contexto']),
+            'palabra_objetivo': palabras[datos['palabra_objetivo']]
+        }
+        for ngrama, datos in probabilidades.items()
+    }
+
+def calcular_probabilidad_ngramas_general(tokens, n, poda=None):
+    """
+    Calcula probabilidades para n-gramas usando la fórmula:
+    P(w_i|w_{i-n+1}^{i-1}) = C(w_{i-n+1}^{i}) / C(w_{i-n+1}^{i-1})
+    Con MOTOR_NGRAMAS = 'numpy' se calcula con el motor columnar (ver columnar.py).
+    """
+    if n < 2:
+        return {}
+    if usar_motor_columnar():
+        return calcular_probabilidad_ngramas_columnar(tokens, n, poda)
+    
+    vocabulario = Vocabulario()
+    ids = vocabulario.codificar(tokens)
+    probabilidades = calcular_probabilidad_ngramas_codificados(ids, n, poda=poda)
+    
+    return decodificar_probabilidades(probabilidades, vocabulario)
+
+def calcular_probabilidad_ngramas(tokens, n, poda=None):
     """Función wrapper para mantener compatibilidad"""
-    return calcular_probabilidad_ngramas_general(tokens, n)
+    return calcular_probabilidad_ngramas_general(tokens, n, poda)
+
+def ngramas_mas_frecuentes(probabilidades, k):
+    """
+    Los k n-gramas más frecuentes (ngrama, datos). Con el motor columnar solo
+    se crean los datos de esos k.
+    """
+    if hasattr(probabilidades, 'mas_frecuentes'):
+        return probabilidades.mas_frecuentes(k)
+    return sorted(probabilidades.items(), key=lambda x: x[1]['frecuencia_ngrama'], reverse=True)[:k]
 
 def generar_tabla_probabilidades_avanzada(probabilidades_dict, n_grama, titulo):
     """Genera una tabla HTML con las probabilidades condicionales para n-gramas"""
@@ -179,11 +338,7 @@ def generar_tabla_probabilidades_avanzada(probabilidades_dict, n_grama, titulo):
         return f"<p>No hay {titulo.lower()} para mostrar</p>"
     
     # Ordenar por frecuencia descendente
-    items_ordenados = sorted(
-        probabilidades_dict.items(), 
-        key=lambda x: x[1]['frecuencia_ngrama'], 
-        reverse=True
-    )
+    items_ordenados = ngramas_mas_frecuentes(probabilidades_dict, 15)
     
     # Determinar la fórmula según el tipo de n-grama
     if n_grama == 2:
@@ -231,16 +386,17 @@ def generar_tabla_probabilidades_avanzada(probabilidades_dict, n_grama, titulo):
     
     return html
 
-def procesar_texto_completo(contenido, n_grama=1, usar_fronteras=False, n_gramas_comparacion=None):
-    """Función principal para procesar el texto"""
+def procesar_texto_completo(contenido, n_grama=1, usar_fronteras=False, n_gramas_comparacion=None, poda=None):
+    """Función principal para procesar el texto (con poda, ver probabilidades_desde_trie)"""
     if n_gramas_comparacion is None:
         n_gramas_comparacion = [2, 3, 4, 5]
     
     # Limpiar el texto (con o sin fronteras)
-    if usar_fronteras:
-        palabras_limpias = limpiar_texto_con_fronteras(contenido)
-    else:
-        palabras_limpias = limpiar_texto(contenido)
+    with etapa('limpieza'):
+        if usar_fronteras:
+            palabras_limpias = limpiar_texto_con_fronteras(contenido)
+        else:
+            palabras_limpias = limpiar_texto(contenido)
     
     # Generar histograma con palabras individuales
     contador_palabras = Counter(palabras_limpias)
@@ -251,17 +407,36 @@ def procesar_texto_completo(contenido, n_grama=1, usar_fronteras=False, n_gramas
     ngramas_probabilidades = {}
     ngramas_comparacion = {}
     
+    if usar_motor_columnar():
+        # El motor columnar cuenta cada orden sobre arrays (ver columnar.py)
+        def calcular(n):
+            return calcular_probabilidad_ngramas_general(palabras_limpias, n, poda)
+    else:
+        with etapa('conteo'):
+            # Codificar una sola vez; todos los órdenes comparten el vocabulario
+            vocabulario = Vocabulario()
+            ids = vocabulario.codificar(palabras_limpias)
+            
+            # Un único recorrido cuenta todos los órdenes que se van a mostrar
+            ordenes = [n for n in [n_grama] + list(n_gramas_comparacion) if n > 1 and len(palabras_limpias) >= n]
+            trie = construir_trie_conteos(ids, max(ordenes)) if ordenes else None
+        
+        def calcular(n):
+            return decodificar_probabilidades(probabilidades_desde_trie(trie, n, poda), vocabulario)
+    
     if n_grama > 1 and len(palabras_limpias) >= n_grama:
-        ngramas = generar_ngramas(palabras_limpias, n_grama)
-        if ngramas:
-            contador_ngramas = Counter(ngramas)
-            ngramas_comunes = contador_ngramas.most_common(20)
-            ngramas_probabilidades = calcular_probabilidad_ngramas(palabras_limpias, n_grama)
+        with etapa('probabilidades'):
+            ngramas_probabilidades = calcular(n_grama)
+            ngramas_comunes = [
+                (ngrama, datos['frecuencia_ngrama'])
+                for ngrama, datos in ngramas_mas_frecuentes(ngramas_probabilidades, 20)
+            ]
     
     # Calcular n-gramas para comparación
-    for n in n_gramas_comparacion:
-        if n != n_grama and len(palabras_limpias) >= n:
-            ngramas_comparacion[n] = calcular_probabilidad_ngramas(palabras_limpias, n)
+    with etapa('ordenes_comparacion'):
+        for n in n_gramas_comparacion:
+            if n != n_grama and len(palabras_limpias) >= n:
+                ngramas_comparacion[n] = calcular(n)
     
     return {
         'palabras_comunes': palabras_comunes,
@@ -275,46 +450,270 @@ def procesar_texto_completo(contenido, n_grama=1, usar_fronteras=False, n_gramas
         'n_gramas_comparacion': n_gramas_comparacion
     }
 
-def predecir_siguiente_palabra(contexto, ngramas_probabilidades, n=2):
+def leer_por_bloques(archivo, tamano=TAMANO_BLOQUE_LECTURA):
+    """Genera el contenido de un archivo abierto en modo texto en bloques de tamaño fijo"""
+    return iter(lambda: archivo.read(tamano), '')
+
+def codificar_texto(contenido, usar_fronteras=False):
     """
-    Predice la siguiente palabra dado un contexto y un modelo de n-gramas
+    Limpia el texto y lo codifica con un vocabulario nuevo: devuelve (vocabulario, ids).
+    `contenido` puede ser una cadena o un iterable de bloques (ver
+    leer_por_bloques): en ese caso nunca se tiene el texto completo en memoria,
+    solo el array de ids, que ocupa 4 bytes por token.
     """
-    sugerencias = []
-    
-    for ngrama, datos in ngramas_probabilidades.items():
-        if datos['contexto'] == contexto:
-            sugerencias.append((datos['palabra_objetivo'], datos['probabilidad']))
-    
-    # Ordenar por probabilidad descendente
-    sugerencias.sort(key=lambda x: x[1], reverse=True)
+    if isinstance(contenido, str):
+        tokens = TOKENIZADOR.tokens(contenido, fronteras=usar_fronteras)
+    else:
+        tokens = TOKENIZADOR.tokens_por_bloques(contenido, fronteras=usar_fronteras)
     
-    return sugerencias
+    vocabulario = Vocabulario()
+    if usar_fronteras:
+        # Ids fijos para las fronteras: al ampliar el texto (ver anexar_texto)
+        # el </s> final se mueve sin que cambien los ids de las palabras nuevas
+        vocabulario.agregar('<s>')
+        vocabulario.agregar('</s>')
+    return vocabulario, vocabulario.codificar(tokens)
 
-def generar_modelo_autocompletado(tokens, n=2):
+def compilar_modelo_ngramas(ids, vocabulario, n_grama, usar_fronteras=False, prefijos=None, workers=1, poda=None):
     """
-    Genera un modelo de autocompletado basado en n-gramas
+    Construye el modelo que usa la API de sugerencias (solo el orden pedido,
+    sin los órdenes de comparación de procesar_texto_completo).
+    Los n-gramas se guardan como tuplas de ids; las palabras se recuperan con
+    el vocabulario del corpus, compartido por todos sus modelos.
+    Si se pasa el índice de prefijos del corpus, se guardan además las
+    continuaciones completas de cada contexto, que sirven para completar
+    palabras y para escribir el modelo binario (ver binario.py), y el índice
+    de las mejores continuaciones de los contextos con muchas.
+    Con opciones de poda (ver poda.py) la tabla y las continuaciones solo
+    guardan los n-gramas que la superan, con los conteos de contexto sin
+    podar: las continuaciones que quedan mantienen probabilidad y orden.
+    Con bits de cuantización, las continuaciones (y el modelo binario que se
+    escribe a partir de ellas) guardan el nivel de probabilidad en lugar del
+    conteo; `cuantizador` es el NivelesProbabilidad que lo traduce. La tabla
+    de suavizado conserva los conteos exactos, que necesitan los descuentos
+    de Kneser-Ney.
     """
-    if n < 2:
-        return {}
+    trie = construir_trie_conteos(ids, n_grama, workers)
+    return compilar_modelo_desde_trie(trie, vocabulario, n_grama, usar_fronteras, prefijos, poda)
+
+def compilar_modelo_desde_trie(trie, vocabulario, n_grama, usar_fronteras=False, prefijos=None, poda=None):
+    """Igual que compilar_modelo_ngramas, a partir de conteos ya hechos"""
+    modelo = {
+        'n_grama': n_grama,
+        'usar_fronteras': usar_fronteras,
+        'total_palabras': trie.raiz[0],
+        'total_ngramas': sum(len(hijos) for _, _, hijos in trie.contextos(n_grama - 1)),
+        'suavizado': construir_tabla_suavizado(trie, n_grama, TOP_K_INDICE, poda),
+        'vocabulario': vocabulario,
+        'cuantizador': cuantizador_poda(poda)
+    }
+    if prefijos is not None:
+        modelo['continuaciones'] = construir_continuaciones(trie, n_grama, prefijos, poda)
+        modelo['indice_continuaciones'] = indexar_continuaciones(
+            modelo['continuaciones'], TOP_K_INDICE, modelo['cuantizador'])
     
-    # Calcular probabilidades de n-gramas
-    ngramas_prob = calcular_probabilidad_ngramas(tokens, n)
+    return modelo
+
+def contar_documento(ruta, orden_maximo, usar_fronteras=False):
+    """
+    Fase map del modelo de un corpus: lee un documento por bloques y cuenta
+    sus n-gramas hasta orden_maximo. Devuelve (vocabulario, trie) con ids
+    propios del documento. Solo recibe la ruta para poder ejecutarse en otro
+    proceso.
+    """
+    with open(ruta, 'r') as archivo:
+        vocabulario, ids = codificar_texto(leer_por_bloques(archivo), usar_fronteras)
+    trie = construir_trie_conteos(ids, orden_maximo)
+    trie.cortar()
+    return vocabulario, trie
+
+def fusionar_conteos(parciales, orden_maximo):
+    """
+    Fase reduce: suma los conteos de cada documento en un único trie con un
+    vocabulario común. Como cada documento se contó por separado, ningún
+    n-grama cruza el límite entre dos documentos.
+    """
+    vocabulario = Vocabulario()
+    trie = TrieConteos(orden_maximo)
+    for vocabulario_documento, trie_documento in parciales:
+        mapa_ids = [vocabulario.agregar(palabra) for palabra in vocabulario_documento.palabras]
+        trie.sumar(trie_documento, mapa_ids)
+    return vocabulario, trie
+
+def construir_continuaciones(trie, n_grama, prefijos, poda=None):
+    """
+    Para cada contexto de n-1 palabras guarda (conteo_contexto, rangos, conteos):
+    todas sus continuaciones ordenadas alfabéticamente (por su posición en el
+    índice de prefijos), en arrays compactos. Con poda, solo las que la
+    superan; los contextos sin ninguna no se guardan. Si la poda cuantiza,
+    `conteos` guarda el nivel de cada continuación (menor cuanto más probable)
+    en un array de uno o dos bytes.
+    """
+    cuantizador = cuantizador_poda(poda)
+    continuaciones = {}
+    for contexto, conteo_contexto, hijos in trie.contextos(n_grama - 1):
+        if poda:
+            conservados = continuaciones_conservadas(
+                poda, contexto, {id_palabra: hijo[0] for id_palabra, hijo in hijos.items()},
+                conteo_contexto, trie.conteo)
+            if not conservados:
+                continue
+            hijos = {id_palabra: hijos[id_palabra] for id_palabra in conservados}
+        pares = sorted((prefijos.rangos[id_palabra], hijo[0]) for id_palabra, hijo in hijos.items())
+        if cuantizador:
+            conteos = array(cuantizador.tipo, [cuantizador.nivel(conteo / conteo_contexto) for _, conteo in pares])
+        else:
+            conteos = array('I', [conteo for _, conteo in pares])
+        continuaciones[contexto] = (conteo_contexto, array('I', [rango for rango, _ in pares]), conteos)
     
-    # Organizar por contextos
-    modelo = {}
-    for ngrama, datos in ngramas_prob.items():
+    return continuaciones
+
+def contar_incremento(anteriores, cola, orden_maximo, signo=1):
+    """
+    Cambio de conteos {ngrama: cambio} hasta orden_maximo al añadir (signo=1)
+    o quitar (signo=-1) los ids de `cola` justo detrás de `anteriores`: solo
+    se cuentan las ventanas que terminan en la cola, con los últimos
+    orden_maximo-1 ids anteriores como contexto, así que el coste depende
+    solo de la longitud de la cola.
+    """
+    secuencia = list(anteriores[max(0, len(anteriores) - orden_maximo + 1):])
+    inicio = len(secuencia)
+    secuencia.extend(cola)
+    delta = defaultdict(int)
+    for fin in range(inicio, len(secuencia)):
+        for orden in range(1, min(orden_maximo, fin + 1) + 1):
+            delta[tuple(secuencia[fin - orden + 1:fin + 1])] += signo
+    return dict(delta)
+
+def _conteo_en_tabla(tabla, ngrama):
+    entrada = tabla.get(ngrama[:-1])
+    valores = entrada[HIJOS].get(ngrama[-1]) if entrada else None
+    return valores[0] if valores else 0
+
+def copiar_modelo_compilado(modelo):
+    """
+    Copia de un modelo compilado que actualizar_modelo_compilado puede
+    modificar sin afectar a las peticiones que leen el original: se copian
+    los diccionarios que cambian, no las entradas, que siempre se sustituyen.
+    """
+    suavizado = modelo['suavizado']
+    copia = dict(modelo)
+    copia['suavizado'] = {
+        **suavizado,
+        'tabla': dict(suavizado['tabla']),
+        'descuentos': dict(suavizado['descuentos']),
+        'conteos_descuento': {orden: list(n1_n2) for orden, n1_n2 in suavizado['conteos_descuento'].items()},
+    }
+    if modelo.get('continuaciones') is not None:
+        copia['continuaciones'] = dict(modelo['continuaciones'])
+        copia['indice_continuaciones'] = dict(modelo['indice_continuaciones'])
+    return copia
+
+def actualizar_modelo_compilado(modelo, delta, prefijos=None, inserciones=None):
+    """
+    Aplica a un modelo compilado la diferencia de conteos de contar_incremento
+    sin volver a contar el texto: se actualizan la tabla de suavizado, los
+    totales y las continuaciones de los contextos afectados. Si el vocabulario
+    ha crecido, `inserciones` son las posiciones del índice de prefijos
+    anterior en las que se insertaron palabras (ver
+    IndicePrefijos.agregar_palabras): los rangos guardados de todas las
+    continuaciones se desplazan, así que ese caso cuesta un recorrido de las
+    continuaciones del modelo y no solo de lo añadido.
+    """
+    n_grama = modelo['n_grama']
+    delta = {ngrama: cambio for ngrama, cambio in delta.items() if len(ngrama) <= n_grama}
+    cambios = actualizar_tabla_suavizado(modelo['suavizado'], delta, TOP_K_INDICE)
+    
+    modelo['total_palabras'] += sum(cambio for ngrama, cambio in delta.items() if len(ngrama) == 1)
+    for ngrama, (anterior, nuevo) in cambios.items():
+        if len(ngrama) == n_grama and (anterior == 0) != (nuevo == 0):
+            modelo['total_ngramas'] += 1 if nuevo else -1
+    
+    continuaciones = modelo.get('continuaciones')
+    if continuaciones is None:
+        return
+    
+    # Las palabras nuevas desplazan las posiciones alfabéticas pero no cambian
+    # el orden relativo: basta con traducir los rangos
+    if inserciones:
+        for contexto, (conteo_contexto, rangos, conteos) in continuaciones.items():
+            if rangos and rangos[-1] >= inserciones[0]:
+                continuaciones[contexto] = (
+                    conteo_contexto, array('I', (desplazar_rango(inserciones, r) for r in rangos)), conteos)
+    
+    # Los índices de las mejores continuaciones van por posición dentro del
+    # contexto, que no cambia al traducir los rangos
+    indice = modelo['indice_continuaciones']
+    tabla = modelo['suavizado']['tabla']
+    afectados = {ngrama[:-1] for ngrama in delta if len(ngrama) == n_grama}
+    afectados.update(ngrama for ngrama in delta if len(ngrama) == n_grama - 1)
+    for contexto in afectados:
+        conteo_contexto = _conteo_en_tabla(tabla, contexto)
+        indice.pop(contexto, None)
+        if not conteo_contexto:
+            continuaciones.pop(contexto, None)
+            continue
+        entrada = tabla.get(contexto)
+        hijos = entrada[HIJOS] if entrada else {}
+        pares = sorted((prefijos.rangos[id_palabra], valores[0]) for id_palabra, valores in hijos.items())
+        conteos = array('I', [conteo for _, conteo in pares])
+        continuaciones[contexto] = (conteo_contexto, array('I', [rango for rango, _ in pares]), conteos)
+        if len(conteos) > MAX_CONTINUACIONES_SIN_INDICE:
+            indice[contexto] = MejoresPorRango(len(conteos), TOP_K_INDICE, clave_continuaciones(conteos))
+
+def construir_indice_contextos(ngramas_probabilidades, top_k=None):
+    """
+    Agrupa los n-gramas por contexto y deja cada lista ordenada por
+    probabilidad (y frecuencia) descendente, recortada a top_k elementos.
+    Buscar sugerencias pasa a ser un acceso al diccionario más un slice.
+    """
+    indice = {}
+    for ngrama, datos in ngramas_probabilidades.items():
         contexto = datos['contexto']
-        if contexto not in modelo:
-            modelo[contexto] = []
+        if contexto not in indice:
+            indice[contexto] = []
         
-        modelo[contexto].append({
+        indice[contexto].append({
             'palabra': datos['palabra_objetivo'],
             'probabilidad': datos['probabilidad'],
-            'frecuencia': datos['frecuencia_ngrama']
+            'frecuencia': datos['frecuencia_ngrama'],
+            'frecuencia_contexto': datos['frecuencia_contexto']
         })
     
-    # Ordenar cada lista de sugerencias por probabilidad
-    for contexto in modelo:
-        modelo[contexto].sort(key=lambda x: x['probabilidad'], reverse=True)
+    for contexto, sugerencias in indice.items():
+        sugerencias.sort(key=lambda x: (x['probabilidad'], x['frecuencia']), reverse=True)
+        if top_k is not None:
+            del sugerencias[top_k:]
+    
+    return indice
+
+def completar_palabra(modelo, contexto_ids, prefijo, k):
+    """
+    Completa la palabra a medio escribir: las k continuaciones del contexto que
+    empiezan por el prefijo, ordenadas por P(palabra|contexto). Si el contexto
+    no existe o ninguna continuación coincide, recurre a las palabras más
+    frecuentes del vocabulario con ese prefijo.
+    Devuelve tuplas (id_palabra, frecuencia, frecuencia_contexto).
+    """
+    prefijos = modelo['prefijos']
+    
+    continuaciones = modelo['continuaciones'].get(contexto_ids) if contexto_ids else None
+    if continuaciones:
+        resultado = prefijos.completar_en_contexto(prefijo, continuaciones, k, modelo['cuantizador'],
+                                                   modelo['indice_continuaciones'].get(contexto_ids))
+        if resultado:
+            return resultado
+    
+    total = modelo['total_palabras']
+    return [(id_palabra, prefijos.frecuencias[id_palabra], total) for id_palabra in prefijos.completar(prefijo, k)]
+
+def generar_modelo_autocompletado(tokens, n=2):
+    """
+    Genera un modelo de autocompletado basado en n-gramas
+    """
+    if n < 2:
+        return {}
     
-    return modelo
\ No newline at end of file
+    # Calcular probabilidades de n-gramas y organizarlas por contexto
+    ngramas_prob = calcular_probabilidad_ngramas(tokens, n)
+    return construir_indice_contextos(ngramas_prob)
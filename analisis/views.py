@@ -1,28 +1,139 @@
 # views.py - Actualizar las importaciones
+import os
 import re
 import json
+import math
+import asyncio
+from datetime import datetime, timezone
 from collections import Counter
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse, Http404
+from django.views.decorators.http import condition
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.conf import settings
 from .forms import TextoAnalizadoForm
-from .models import TextoAnalizado
+from .models import TextoAnalizado, Corpus
 from .utils import procesar_texto_completo, limpiar_texto, limpiar_texto_con_fronteras, calcular_probabilidad_ngramas
+from .utils import normalizar_acentos, completar_palabra, ngramas_mas_frecuentes
+from .utils import calcular_probabilidad_ngramas_codificados, decodificar_probabilidades
+from .vocabulario import Vocabulario
+from .cache_modelos import obtener_modelo, obtener_corpus, obtener_modelo_corpus, obtener_workers_fragmentos
+from .cache_modelos import obtener_modelo_binario, obtener_modelo_binario_corpus
+from .cache_modelos import VERSION_MODELO, calcular_hash_archivo, obtener_artefacto, anexar_texto
+from .cache_modelos import calcular_hash_corpus
+from .suavizado import sugerir_stupid_backoff, sugerir_kneser_ney
+from .poda import firma_poda, opciones_poda
+from .perplejidad import dividir_oraciones, evaluar_oraciones
+from .frases import buscar_frases, expandir_memorizado
+from .frases import expansor_binario, expansor_continuaciones, expansor_suavizado
+from .almacen import obtener_modelo_sql
+from .tareas import encolar_construccion, encolar_construccion_corpus
+from .registro import estadisticas_registros
+from .metricas import etapa, exportar_texto, metricas_activadas
+
+# Métodos de suavizado que acepta la API de sugerencias
+METODOS_SUAVIZADO = {
+    'backoff': sugerir_stupid_backoff,
+    'kneser_ney': sugerir_kneser_ney,
+}
+
+# Máximo de textos por petición en la API de sugerencias por lotes
+MAX_TEXTOS_LOTE = 10000
+
+# Órdenes que se evalúan por defecto en la API de perplejidad (los de analizar_texto)
+ORDENES_PERPLEJIDAD = [2, 3, 4, 5, 6]
+
+# Completado de frases (palabras_frase > 1): máximos de palabras y de ancho
+# del haz, y presupuesto de tiempo por petición (ms) por defecto y máximo
+MAX_PALABRAS_FRASE = 10
+MAX_ANCHO_HAZ = 20
+PRESUPUESTO_FRASES_MS = 50
+MAX_PRESUPUESTO_FRASES_MS = 1000
+
+# Segundos tras una construcción fallida durante los que las consultas
+# devuelven el error en lugar de volver a encolarla (salvo con reintentar)
+ESPERA_REINTENTO_CONSTRUCCION = 300
+
+# Cargas de modelos en curso de la vista asíncrona: (bucle, clave) -> tarea
+_cargas_en_curso = {}
+# Parámetros de sugerencias que determinan qué modelo se carga (y qué se
+# responde si no está): la clave de _cargas_en_curso
+CAMPOS_CARGA_MODELO = ('corpus_id', 'texto_id', 'n_grama', 'usar_fronteras', 'usar_binario', 'reintentar')
+
+# Órdenes de n-grama que se comparan en la página de análisis
+N_GRAMAS_COMPARACION = [2, 3, 4, 5, 6]
+
+def _firma_texto(texto_id):
+    """(hash del contenido, fecha de modificación) del archivo de un texto, o None"""
+    texto_obj = TextoAnalizado.objects.filter(id=texto_id).first()
+    if texto_obj is None:
+        return None
+    try:
+        hash_contenido = calcular_hash_archivo(texto_obj.archivo)
+        modificado = os.path.getmtime(texto_obj.archivo.path)
+    except (OSError, ValueError):
+        return None
+    return hash_contenido, datetime.fromtimestamp(modificado, tz=timezone.utc)
+
+def _etag_texto(texto_id, *partes):
+    """
+    ETag de una página calculada a partir de un texto: cambia con el contenido,
+    con los parámetros de la página, con el formato de los artefactos y con
+    las opciones de poda
+    """
+    firma = _firma_texto(texto_id)
+    if firma is None:
+        return None
+    poda = firma_poda(opciones_poda())
+    return '-'.join([firma[0][:32], *map(str, partes), f"v{VERSION_MODELO}", *([poda] if poda else [])])
+
+def _ultima_modificacion_texto(request, texto_id, **kwargs):
+    firma = _firma_texto(texto_id)
+    return firma[1] if firma else None
 
 def subir_texto(request):
     if request.method == 'POST':
         form = TextoAnalizadoForm(request.POST, request.FILES)
         if form.is_valid():
-            form.save()
+            texto_obj = form.save()
+            # Los modelos se construyen en segundo plano, fuera de la petición
+            transaction.on_commit(lambda: encolar_construccion(texto_obj.id))
             return redirect('lista_textos')
     else:
         form = TextoAnalizadoForm()
     return render(request, 'subir.html', {'form': form})
 
+def ampliar_texto(request, texto_id):
+    """
+    API para añadir texto al final de un texto ya subido ("texto" en el JSON).
+    Sus modelos en caché se actualizan contando solo lo añadido.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
+    try:
+        contenido = json.loads(request.body).get('texto', '')
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Se esperaba un objeto JSON'}, status=400)
+    if not isinstance(contenido, str) or not contenido.strip():
+        return JsonResponse({'error': 'Texto vacío'}, status=400)
+    
+    try:
+        with etapa('ampliar_texto'):
+            resultado = anexar_texto(texto_obj, contenido)
+    except OSError:
+        return JsonResponse({'error': 'Error al escribir el archivo'}, status=500)
+    
+    return JsonResponse({'texto_id': texto_obj.id, **resultado})
+
 def lista_textos(request):
     textos = TextoAnalizado.objects.all().order_by('-fecha_subida')
     return render(request, 'lista.html', {'textos': textos})
 
-def analizar_texto(request, texto_id, n_grama=1):
+def _parametros_analisis(request, n_grama=1):
+    """n_grama y fronteras pedidos en la URL de la página de análisis"""
     if 'n_grama' in request.GET:
         try:
             n_grama = int(request.GET.get('n_grama', 1))
@@ -35,186 +146,602 @@ def analizar_texto(request, texto_id, n_grama=1):
     
     # Verificar si se solicitan fronteras de oración
     usar_fronteras = request.GET.get('fronteras', 'false').lower() == 'true'
-    
-    # Obtener n-gramas para comparación
-    n_gramas_comparacion = [2, 3, 4, 5, 6]
+    return n_grama, usar_fronteras
+
+def _etag_analisis(request, texto_id, n_grama=1):
+    return _etag_texto(texto_id, 'analisis', *_parametros_analisis(request, n_grama))
+
+@condition(etag_func=_etag_analisis, last_modified_func=_ultima_modificacion_texto)
+def analizar_texto(request, texto_id, n_grama=1):
+    n_grama, usar_fronteras = _parametros_analisis(request, n_grama)
     
     texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
     
-    # Leer el contenido del archivo
+    def calcular(contenido):
+        resultado = procesar_texto_completo(contenido, n_grama, usar_fronteras, N_GRAMAS_COMPARACION,
+                                            opciones_poda())
+        # La lista de palabras no se muestra: no hace falta guardarla
+        del resultado['palabras_limpias']
+        return resultado
+    
+    # El resultado se calcula una vez por contenido y parámetros
     try:
-        with texto_obj.archivo.open('r') as archivo:
-            contenido = archivo.read()
-    except:
-        contenido = ""
-    
-    # Procesar el texto
-    resultado = procesar_texto_completo(contenido, n_grama, usar_fronteras, n_gramas_comparacion)
-    
-    # Guardar el contenido original y procesado en la sesión
-    request.session['texto_original'] = contenido
-    request.session['texto_procesado'] = ' '.join(resultado['palabras_limpias'])
-    
-    return render(request, 'resultado.html', {
-        'texto': texto_obj,
-        'palabras_comunes': resultado['palabras_comunes'],
-        'ngramas_comunes': resultado['ngramas_comunes'],
-        'ngramas_probabilidades': resultado['ngramas_probabilidades'],
-        'ngramas_comparacion': resultado['ngramas_comparacion'],
-        'total_palabras': resultado['total_palabras'],
-        'n_grama': n_grama,
-        'usar_fronteras': usar_fronteras,
-        'n_gramas_comparacion': resultado['n_gramas_comparacion'],
-        'texto_id': texto_id
-    })
+        resultado = obtener_artefacto(texto_obj, f"analisis{n_grama}", usar_fronteras,
+                                      lambda: calcular(_leer_contenido(texto_obj)))
+    # Un archivo ilegible o que no es UTF-8 se muestra como vacío
+    except (OSError, ValueError):
+        resultado = calcular("")
+    
+    # La sesión guarda solo una referencia al último análisis, no el texto
+    referencia = {'texto_id': texto_obj.id, 'n_grama': n_grama, 'fronteras': usar_fronteras}
+    if request.session.get('ultimo_analisis') != referencia:
+        request.session['ultimo_analisis'] = referencia
+    
+    with etapa('plantilla'):
+        return render(request, 'resultado.html', {
+            'texto': texto_obj,
+            'palabras_comunes': resultado['palabras_comunes'],
+            'ngramas_comunes': resultado['ngramas_comunes'],
+            'ngramas_probabilidades': resultado['ngramas_probabilidades'],
+            'ngramas_comparacion': resultado['ngramas_comparacion'],
+            'total_palabras': resultado['total_palabras'],
+            'n_grama': n_grama,
+            'usar_fronteras': usar_fronteras,
+            'n_gramas_comparacion': resultado['n_gramas_comparacion'],
+            'texto_id': texto_id
+        })
+
+def _leer_contenido(texto_obj):
+    with etapa('leer_archivo'), texto_obj.archivo.open('r') as archivo:
+        return archivo.read()
     
+def _etag_procesamiento(request, texto_id):
+    return _etag_texto(texto_id, 'procesamiento')
+
+@condition(etag_func=_etag_procesamiento, last_modified_func=_ultima_modificacion_texto)
 def ver_procesamiento(request, texto_id):
     """Vista para mostrar los detalles del procesamiento aplicado"""
     texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
     
-    # Leer el contenido del archivo
+    def calcular(contenido):
+        # Obtener el texto original y procesado
+        texto_original = contenido
+        with etapa('limpieza'):
+            palabras_limpias = limpiar_texto(contenido)
+        texto_procesado = ' '.join(palabras_limpias)
+        
+        # Contar estadísticas
+        palabras_originales = re.findall(r'\b[a-zA-ZáéíóúÁÉÍÓÚñÑüÜ]+\b', texto_original.lower())
+        stopwords_eliminadas = len(palabras_originales) - len(palabras_limpias)
+        
+        # Encontrar símbolos eliminados
+        simbolos_eliminados = set()
+        for palabra in texto_original.split():
+            simbolos = re.findall(r'[^\w\sáéíóúñüÁÉÍÓÚÑÜ]', palabra)
+            simbolos_eliminados.update(simbolos)
+        
+        # Encontrar palabras con acentos en el texto original
+        palabras_con_acentos = []
+        for palabra in palabras_originales:
+            if re.search(r'[áéíóúÁÉÍÓÚñÑüÜ]', palabra):
+                palabras_con_acentos.append(palabra)
+        
+        return {
+            'texto_original': texto_original,
+            'texto_procesado': texto_procesado,
+            'total_palabras_original': len(palabras_originales),
+            'total_palabras_limpias': len(palabras_limpias),
+            'stopwords_eliminadas': stopwords_eliminadas,
+            'simbolos_eliminados': ', '.join(simbolos_eliminados) if simbolos_eliminados else 'Ninguno',
+            'palabras_con_acentos': palabras_con_acentos[:20]
+        }
+    
     try:
-        with texto_obj.archivo.open('r') as archivo:
-            contenido = archivo.read()
-    except:
-        contenido = ""
-    
-    # Obtener el texto original y procesado
-    texto_original = contenido
-    palabras_limpias = limpiar_texto(contenido)
-    texto_procesado = ' '.join(palabras_limpias)
-    
-    # Contar estadísticas
-    palabras_originales = re.findall(r'\b[a-zA-ZáéíóúÁÉÍÓÚñÑüÜ]+\b', texto_original.lower())
-    stopwords_eliminadas = len(palabras_originales) - len(palabras_limpias)
-    
-    # Encontrar símbolos eliminados
-    simbolos_eliminados = set()
-    for palabra in texto_original.split():
-        simbolos = re.findall(r'[^\w\sáéíóúñüÁÉÍÓÚÑÜ]', palabra)
-        simbolos_eliminados.update(simbolos)
-    
-    # Encontrar palabras con acentos en el texto original
-    palabras_con_acentos = []
-    for palabra in palabras_originales:
-        if re.search(r'[áéíóúÁÉÍÓÚñÑüÜ]', palabra):
-            palabras_con_acentos.append(palabra)
-    
-    return render(request, 'procesamiento.html', {
-        'texto': texto_obj,
-        'texto_original': texto_original,
-        'texto_procesado': texto_procesado,
-        'total_palabras_original': len(palabras_originales),
-        'total_palabras_limpias': len(palabras_limpias),
-        'stopwords_eliminadas': stopwords_eliminadas,
-        'simbolos_eliminados': ', '.join(simbolos_eliminados) if simbolos_eliminados else 'Ninguno',
-        'palabras_con_acentos': palabras_con_acentos[:20]
-    })
+        datos = obtener_artefacto(texto_obj, 'procesamiento', False,
+                                  lambda: calcular(_leer_contenido(texto_obj)))
+    # Un archivo ilegible o que no es UTF-8 se muestra como vacío
+    except (OSError, ValueError):
+        datos = calcular("")
+    
+    with etapa('plantilla'):
+        return render(request, 'procesamiento.html', {'texto': texto_obj, **datos})
 
 def autocompletado_view(request):
     """Vista principal para el autocompletado"""
     textos = TextoAnalizado.objects.all().order_by('-fecha_subida')
     return render(request, 'autocompletado.html', {
-        'textos': textos
+        'textos': textos,
+        'corpus': Corpus.objects.all().order_by('nombre')
     })
 
+def _parametros_sugerencias(data):
+    """Parámetros comunes de las APIs de sugerencias, ya validados"""
+    n_grama = int(data.get('n_grama', 3))
+    max_sugerencias = int(data.get('max_sugerencias', 5))
+    
+    # Validar n_grama
+    if n_grama < 2:
+        n_grama = 2
+    elif n_grama > 20:
+        n_grama = 20
+        
+    # Validar max_sugerencias
+    if max_sugerencias < 1:
+        max_sugerencias = 1
+    elif max_sugerencias > 20:
+        max_sugerencias = 20
+    
+    completar = bool(data.get('completar', False))
+    suavizado = data.get('suavizado', 'ninguno')
+    
+    # Completado de frases: palabras por frase, ancho del haz y presupuesto
+    palabras_frase = min(max(int(data.get('palabras_frase', 1)), 1), MAX_PALABRAS_FRASE)
+    ancho_haz = min(max(int(data.get('ancho_haz', 5)), 1), MAX_ANCHO_HAZ)
+    presupuesto_ms = min(max(float(data.get('presupuesto_ms', PRESUPUESTO_FRASES_MS)), 1), MAX_PRESUPUESTO_FRASES_MS)
+    
+    return {
+        'texto_id': data.get('texto_id'),
+        'corpus_id': data.get('corpus_id'),
+        'n_grama': n_grama,
+        'max_sugerencias': max_sugerencias,
+        'usar_fronteras': bool(data.get('fronteras', False)),
+        'reintentar': bool(data.get('reintentar', False)),
+        'completar': completar,
+        'suavizado': suavizado,
+        'palabras_frase': palabras_frase,
+        'ancho_haz': ancho_haz,
+        'presupuesto_ms': presupuesto_ms,
+        # La consulta básica (sin completar ni suavizado) se responde con el
+        # modelo binario en mmap, compartido por todos los procesos, o con
+        # el almacén de n-gramas en la base de datos si está activado
+        'usar_binario': not completar and suavizado not in METODOS_SUAVIZADO
+    }
+
+def _resolver_origen(parametros):
+    """
+    Texto o corpus pedido, la función que obtiene su modelo para la consulta
+    y la que encola su construcción: (origen, obtener, encolar)
+    """
+    usar_binario = parametros['usar_binario']
+    
+    # Obtener el texto o el corpus seleccionado
+    if parametros['corpus_id']:
+        origen = get_object_or_404(Corpus, id=parametros['corpus_id'])
+        obtener = obtener_modelo_binario_corpus if usar_binario else obtener_modelo_corpus
+        encolar = encolar_construccion_corpus
+    else:
+        origen = get_object_or_404(TextoAnalizado, id=parametros['texto_id'])
+        obtener = obtener_modelo_binario if usar_binario else obtener_modelo
+        encolar = encolar_construccion
+    if usar_binario and getattr(settings, 'MODELOS_ALMACEN_SQL', False):
+        obtener = obtener_modelo_sql
+    return origen, obtener, encolar
+
+def _totales_modelo(modelo, parametros):
+    """(total_palabras, total_ngramas) de cualquiera de los tipos de modelo"""
+    if parametros['usar_binario']:
+        return modelo.total_palabras, modelo.total_ngramas
+    return modelo['total_palabras'], modelo['total_ngramas']
+
+def _error_palabras_insuficientes(n_grama, total_palabras):
+    return JsonResponse({
+        'error': f'El texto no tiene suficientes palabras para {n_grama}-gramas. Solo tiene {total_palabras} palabras.'
+    }, status=400)
+
+def _cargar_modelo_sugerencias(parametros):
+    """
+    Devuelve (modelo, total_ngramas, None) con el modelo que corresponde a los
+    parámetros, o (None, None, respuesta) si no se puede responder todavía:
+    el modelo se está construyendo, su construcción falló, no se pudo leer o
+    el texto es muy corto.
+    """
+    n_grama = parametros['n_grama']
+    usar_fronteras = parametros['usar_fronteras']
+    origen, obtener, encolar = _resolver_origen(parametros)
+    
+    # Obtener el modelo compilado; si todavía no existe se encola su
+    # construcción y se responde sin bloquear la petición
+    try:
+        with etapa('cargar_modelo'):
+            modelo = obtener(origen, n_grama, usar_fronteras, construir=False)
+    except (OSError, ValueError):
+        return None, None, JsonResponse({'error': 'Error al leer el archivo'}, status=500)
+    
+    if modelo is None:
+        # Una construcción que acaba de fallar no se repite en cada consulta:
+        # solo si se pide explícitamente o cuando ha pasado la espera
+        if origen.estado_modelo == origen.ESTADO_ERROR and not parametros['reintentar']:
+            fallo = origen.fin_construccion
+            if fallo and (datetime.now(timezone.utc) - fallo).total_seconds() < ESPERA_REINTENTO_CONSTRUCCION:
+                return None, None, JsonResponse({
+                    'estado': origen.ESTADO_ERROR,
+                    'error': f'No se pudo construir el modelo: {origen.error_construccion}',
+                    'error_construccion': origen.error_construccion,
+                    'n_grama': n_grama
+                }, status=500)
+        
+        encolar(origen.id, [n_grama], [usar_fronteras])
+        origen.refresh_from_db()
+        return None, None, JsonResponse({
+            'estado': origen.ESTADO_CONSTRUYENDO,
+            'progreso': origen.progreso_modelo,
+            'n_grama': n_grama
+        }, status=202)
+    
+    total_palabras, total_ngramas = _totales_modelo(modelo, parametros)
+    
+    # Verificar si hay suficientes palabras
+    if total_palabras < n_grama:
+        return None, None, _error_palabras_insuficientes(n_grama, total_palabras)
+    
+    return modelo, total_ngramas, None
+
+def _clave_frases(parametros):
+    """
+    Identifica el modelo de una consulta de frases y su contenido: las
+    expansiones memorizadas dejan de usarse en cuanto cambia el texto, el
+    corpus o la poda
+    """
+    if parametros['corpus_id']:
+        corpus_obj = get_object_or_404(Corpus, id=parametros['corpus_id'])
+        hash_contenido = calcular_hash_corpus(list(corpus_obj.textos.order_by('id')))
+    else:
+        hash_contenido = calcular_hash_archivo(get_object_or_404(TextoAnalizado, id=parametros['texto_id']).archivo)
+    return ('k' if parametros['corpus_id'] else 't', parametros['corpus_id'] or parametros['texto_id'],
+            hash_contenido, firma_poda(opciones_poda()), parametros['n_grama'], parametros['usar_fronteras'])
+
+def _calcular_frases(texto_parcial, modelo, total_ngramas, parametros):
+    """
+    Las max_sugerencias mejores continuaciones de hasta palabras_frase
+    palabras (búsqueda en haz, ver frases.py), con el mismo modelo y el mismo
+    contexto que las sugerencias de una palabra. Las expansiones de cada
+    contexto se memorizan entre peticiones.
+    """
+    n_grama = parametros['n_grama']
+    haz = parametros['ancho_haz']
+    completar = parametros['completar']
+    suavizado = parametros['suavizado']
+    
+    palabras = texto_parcial.split()
+    prefijo = None
+    iniciales = None
+    
+    if parametros['usar_binario']:
+        # ModeloBinario o ModeloSQL: el id de </s> sale de la misma codificación
+        contexto_ids = modelo.codificar_contexto(palabras[-(n_grama-1):]) or ()
+        expandir, tipo = expansor_binario(modelo, haz), type(modelo).__name__
+        palabra, fin = modelo.palabra, (modelo.codificar_contexto(['</s>']) or (None,))[0]
+    else:
+        vocabulario = modelo['vocabulario']
+        palabra, fin = vocabulario.palabra, vocabulario.ids.get('</s>')
+        if completar:
+            # La última palabra está a medio escribir: la primera palabra de
+            # cada frase la completa
+            prefijo = normalizar_acentos(palabras[-1])
+            palabras = palabras[:-1]
+        if suavizado in METODOS_SUAVIZADO:
+            ids_palabras = [vocabulario.ids.get(palabra_contexto) for palabra_contexto in palabras[-(n_grama-1):]]
+            while None in ids_palabras:
+                ids_palabras = ids_palabras[ids_palabras.index(None) + 1:]
+            contexto_ids = tuple(ids_palabras)
+            expandir, tipo = expansor_suavizado(METODOS_SUAVIZADO[suavizado], modelo['suavizado'], haz), suavizado
+        else:
+            contexto_ids = vocabulario.codificar_contexto(palabras[-(n_grama-1):]) or ()
+            expandir, tipo = expansor_continuaciones(modelo, haz), 'continuaciones'
+        if completar:
+            iniciales = [
+                (id_palabra, math.log(frecuencia / frecuencia_contexto))
+                for id_palabra, frecuencia, frecuencia_contexto in completar_palabra(modelo, contexto_ids, prefijo, haz)
+                if frecuencia and frecuencia_contexto
+            ]
+    
+    clave = (*_clave_frases(parametros), tipo, haz)
+    mejores, truncada = buscar_frases(
+        lambda contexto: expandir_memorizado(clave, expandir, contexto),
+        contexto_ids, n_grama - 1, parametros['palabras_frase'], parametros['max_sugerencias'], haz,
+        parametros['presupuesto_ms'] / 1000, fin, iniciales
+    )
+    
+    contexto = ' '.join(palabras[-(n_grama-1):])
+    frases = []
+    for ids, log_probabilidad in mejores:
+        continuacion = [palabra(id_palabra) for id_palabra in ids]
+        frases.append({
+            'frase': ' '.join(continuacion),
+            'palabras': continuacion,
+            'probabilidad': math.exp(log_probabilidad),
+            'log_probabilidad': log_probabilidad,
+            'frase_completa': ' '.join(palabras[-(n_grama-1):] + continuacion)
+        })
+    
+    resultado = {
+        'frases': frases,
+        'contexto': contexto,
+        'n_grama': n_grama,
+        'palabras_frase': parametros['palabras_frase'],
+        'ancho_haz': haz,
+        'truncada': truncada,
+        'total_frases': len(frases),
+        'total_ngramas_modelo': total_ngramas
+    }
+    if prefijo is not None:
+        resultado['prefijo'] = prefijo
+    return resultado
+
+def _calcular_sugerencias(texto_parcial, modelo, total_ngramas, parametros):
+    """Sugerencias para un texto parcial, con el modelo ya cargado"""
+    if parametros['palabras_frase'] > 1:
+        return _calcular_frases(texto_parcial, modelo, total_ngramas, parametros)
+    
+    n_grama = parametros['n_grama']
+    max_sugerencias = parametros['max_sugerencias']
+    completar = parametros['completar']
+    suavizado = parametros['suavizado']
+    usar_binario = parametros['usar_binario']
+    
+    palabras = texto_parcial.split()
+    
+    if usar_binario:
+        # Contexto: las últimas n-1 palabras
+        contexto = ' '.join(palabras[-(n_grama-1):])
+        contexto_ids = modelo.codificar_contexto(contexto.split())
+        candidatos = modelo.sugerencias(contexto_ids, max_sugerencias) if contexto_ids else []
+        
+        sugerencias = []
+        for id_palabra, frecuencia, frecuencia_contexto in candidatos:
+            palabra = modelo.palabra(id_palabra)
+            sugerencias.append({
+                'palabra': palabra,
+                'probabilidad': frecuencia / frecuencia_contexto,
+                'frecuencia_ngrama': frecuencia,
+                'frecuencia_contexto': frecuencia_contexto,
+                'ngrama_completo': f"{contexto} {palabra}"
+            })
+        
+        return {
+            'sugerencias': sugerencias,
+            'contexto': contexto,
+            'n_grama': n_grama,
+            'total_sugerencias': len(sugerencias),
+            'total_ngramas_modelo': total_ngramas
+        }
+    
+    vocabulario = modelo['vocabulario']
+    
+    if completar:
+        # La última palabra está a medio escribir: es un prefijo y el
+        # contexto son las n-1 palabras anteriores
+        prefijo = normalizar_acentos(palabras[-1])
+        palabras_contexto = palabras[:-1][-(n_grama-1):]
+        contexto = ' '.join(palabras_contexto)
+        contexto_ids = vocabulario.codificar_contexto(palabras_contexto)
+        
+        sugerencias = []
+        for id_palabra, frecuencia, frecuencia_contexto in completar_palabra(
+                modelo, contexto_ids, prefijo, max_sugerencias):
+            palabra = vocabulario.palabra(id_palabra)
+            sugerencias.append({
+                'palabra': palabra,
+                'probabilidad': frecuencia / frecuencia_contexto if frecuencia_contexto else 0.0,
+                'frecuencia_ngrama': frecuencia,
+                'frecuencia_contexto': frecuencia_contexto,
+                'ngrama_completo': f"{contexto} {palabra}".strip()
+            })
+        
+        return {
+            'sugerencias': sugerencias,
+            'contexto': contexto,
+            'prefijo': prefijo,
+            'n_grama': n_grama,
+            'total_sugerencias': len(sugerencias),
+            'total_ngramas_modelo': total_ngramas
+        }
+    
+    if suavizado in METODOS_SUAVIZADO:
+        # Contexto: las últimas n-1 palabras, desde la última desconocida
+        ids_palabras = [vocabulario.ids.get(palabra) for palabra in palabras[-(n_grama-1):]]
+        while None in ids_palabras:
+            ids_palabras = ids_palabras[ids_palabras.index(None) + 1:]
+        
+        sugerencias = []
+        for id_palabra, puntaje, frecuencia, frecuencia_contexto, orden in METODOS_SUAVIZADO[suavizado](
+                modelo['suavizado'], ids_palabras, max_sugerencias):
+            palabra = vocabulario.palabra(id_palabra)
+            sugerencias.append({
+                'palabra': palabra,
+                'probabilidad': puntaje,
+                'frecuencia_ngrama': frecuencia,
+                'frecuencia_contexto': frecuencia_contexto,
+                'orden_usado': orden,
+                'ngrama_completo': ' '.join(palabras[len(palabras) - orden + 1:] + [palabra])
+            })
+        
+        return {
+            'sugerencias': sugerencias,
+            'contexto': vocabulario.decodificar(ids_palabras),
+            'suavizado': suavizado,
+            'n_grama': n_grama,
+            'total_sugerencias': len(sugerencias),
+            'total_ngramas_modelo': total_ngramas
+        }
+
 def obtener_sugerencias(request):
     """API para obtener sugerencias de autocompletado"""
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             texto_parcial = data.get('texto', '').strip().lower()
-            texto_id = data.get('texto_id')
-            n_grama = int(data.get('n_grama', 3))
-            max_sugerencias = int(data.get('max_sugerencias', 5))
-            usar_fronteras = data.get('fronteras', False)
-            
-            # Validar n_grama
-            if n_grama < 2:
-                n_grama = 2
-            elif n_grama > 20:
-                n_grama = 20
-                
-            # Validar max_sugerencias
-            if max_sugerencias < 1:
-                max_sugerencias = 1
-            elif max_sugerencias > 20:
-                max_sugerencias = 20
+            parametros = _parametros_sugerencias(data)
             
             if not texto_parcial:
                 return JsonResponse({'error': 'Texto vacío'}, status=400)
-                
-            # Obtener el texto seleccionado
-            texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
-            
-            # Leer el contenido del archivo
-            try:
-                with texto_obj.archivo.open('r') as archivo:
-                    contenido = archivo.read()
-            except:
-                return JsonResponse({'error': 'Error al leer el archivo'}, status=500)
-            
-            # Procesar el texto
-            resultado = procesar_texto_completo(contenido, n_grama, usar_fronteras)
-            palabras_limpias = resultado['palabras_limpias']
-            
-            # Verificar si hay suficientes palabras
-            if len(palabras_limpias) < n_grama:
-                return JsonResponse({
-                    'error': f'El texto no tiene suficientes palabras para {n_grama}-gramas. Solo tiene {len(palabras_limpias)} palabras.'
-                }, status=400)
-            
-            # Generar n-gramas y calcular probabilidades
-            ngramas_probabilidades = calcular_probabilidad_ngramas(palabras_limpias, n_grama)
-            
-            # Obtener el contexto (últimas n-1 palabras)
-            palabras = texto_parcial.split()
-            contexto = ""
-            
-            if n_grama > 1 and len(palabras) >= n_grama - 1:
-                contexto = ' '.join(palabras[-(n_grama-1):])
-            elif palabras:
-                contexto = ' '.join(palabras)
-            else:
-                contexto = texto_parcial
-            
-            # Buscar sugerencias
-            sugerencias = []
-            for ngrama, datos in ngramas_probabilidades.items():
-                if datos['contexto'] == contexto:
-                    sugerencias.append({
-                        'palabra': datos['palabra_objetivo'],
-                        'probabilidad': datos['probabilidad'],
-                        'frecuencia_ngrama': datos['frecuencia_ngrama'],
-                        'frecuencia_contexto': datos['frecuencia_contexto'],
-                        'ngrama_completo': ngrama
-                    })
             
-            # Ordenar por probabilidad descendente
-            sugerencias.sort(key=lambda x: (x['probabilidad'], x['frecuencia_ngrama']), reverse=True)
+            modelo, total_ngramas, respuesta = _cargar_modelo_sugerencias(parametros)
+            if respuesta is not None:
+                return respuesta
             
-            # Limitar a las mejores sugerencias
-            sugerencias = sugerencias[:max_sugerencias]
-            
-            return JsonResponse({
-                'sugerencias': sugerencias,
-                'contexto': contexto,
-                'n_grama': n_grama,
-                'total_sugerencias': len(sugerencias),
-                'total_ngramas_modelo': len(ngramas_probabilidades)
-            })
+            with etapa('sugerencias'):
+                resultado = _calcular_sugerencias(texto_parcial, modelo, total_ngramas, parametros)
+            return JsonResponse(resultado)
             
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
     return JsonResponse({'error': 'Método no permitido'}, status=405)
 
+async def _cargar_una_vez(clave, cargar):
+    """
+    Ejecuta cargar() en un hilo, fuera del bucle de eventos, y hace que todas
+    las peticiones simultáneas con la misma clave esperen esa misma carga
+    en lugar de lanzar una cada una.
+    """
+    clave = (asyncio.get_running_loop(), clave)
+    tarea = _cargas_en_curso.get(clave)
+    if tarea is None:
+        tarea = asyncio.ensure_future(sync_to_async(cargar, thread_sensitive=False)())
+        _cargas_en_curso[clave] = tarea
+        tarea.add_done_callback(lambda _: _cargas_en_curso.pop(clave, None))
+    # shield: si un cliente se desconecta, la carga sigue para los demás
+    return await asyncio.shield(tarea)
+
+async def obtener_sugerencias_async(request):
+    """
+    Versión asíncrona de obtener_sugerencias para el despliegue ASGI, con la
+    misma carga del modelo (_cargar_modelo_sugerencias): si no existe se
+    encola su construcción y se responde 202. La carga se hace en un hilo y
+    las peticiones simultáneas con los mismos parámetros esperan una única
+    carga.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        texto_parcial = data.get('texto', '').strip().lower()
+        parametros = _parametros_sugerencias(data)
+        
+        if not texto_parcial:
+            return JsonResponse({'error': 'Texto vacío'}, status=400)
+        
+        clave = tuple(parametros[campo] for campo in CAMPOS_CARGA_MODELO)
+        modelo, total_ngramas, respuesta = await _cargar_una_vez(clave, lambda: _cargar_modelo_sugerencias(parametros))
+        if respuesta is not None:
+            # La respuesta se comparte entre las peticiones que esperaban la
+            # misma carga: cada una devuelve la suya
+            return HttpResponse(respuesta.content, status=respuesta.status_code,
+                                content_type=respuesta['Content-Type'])
+        
+        # El almacén SQL consulta la base de datos: también fuera del bucle
+        with etapa('sugerencias'):
+            resultado = await sync_to_async(_calcular_sugerencias)(texto_parcial, modelo, total_ngramas, parametros)
+        return JsonResponse(resultado)
+    
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+def obtener_sugerencias_lote(request):
+    """
+    API de sugerencias por lotes: recibe una lista de textos ("textos") con los
+    mismos parámetros que /api/sugerencias/, carga el modelo una sola vez y
+    devuelve una línea JSON (NDJSON) por texto a medida que se calculan.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        textos = data.get('textos', [])
+        if not isinstance(textos, list) or not textos:
+            return JsonResponse({'error': 'Se esperaba una lista de textos no vacía'}, status=400)
+        if len(textos) > MAX_TEXTOS_LOTE:
+            return JsonResponse({'error': f'Como máximo {MAX_TEXTOS_LOTE} textos por lote'}, status=400)
+        
+        parametros = _parametros_sugerencias(data)
+        modelo, total_ngramas, respuesta = _cargar_modelo_sugerencias(parametros)
+        if respuesta is not None:
+            return respuesta
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    def lineas():
+        for indice, texto in enumerate(textos):
+            texto_parcial = str(texto).strip().lower()
+            if not texto_parcial:
+                resultado = {'error': 'Texto vacío'}
+            else:
+                try:
+                    with etapa('sugerencias'):
+                        resultado = _calcular_sugerencias(texto_parcial, modelo, total_ngramas, parametros)
+                except Exception as e:
+                    resultado = {'error': str(e)}
+            yield json.dumps({'indice': indice, 'texto': texto, **resultado}, ensure_ascii=False) + '\n'
+    
+    return StreamingHttpResponse(lineas(), content_type='application/x-ndjson')
+
+def puntuar_texto(request):
+    """
+    API de perplejidad: puntúa con el modelo de un texto o corpus un
+    documento de prueba ("texto", que se divide en oraciones) o una lista de
+    oraciones ("oraciones"). Para cada orden de "ordenes" devuelve la
+    log-verosimilitud total, la perplejidad, la tasa de palabras fuera del
+    vocabulario y la perplejidad de cada oración (Kneser-Ney interpolado).
+    Todos los órdenes se evalúan con el modelo del orden mayor.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        oraciones = data.get('oraciones')
+        if oraciones is None:
+            oraciones = dividir_oraciones(str(data.get('texto', '')))
+        if not isinstance(oraciones, list) or not oraciones:
+            return JsonResponse({'error': 'Se esperaba un texto o una lista de oraciones no vacía'}, status=400)
+        if len(oraciones) > MAX_TEXTOS_LOTE:
+            return JsonResponse({'error': f'Como máximo {MAX_TEXTOS_LOTE} oraciones por petición'}, status=400)
+        
+        ordenes = data.get('ordenes', ORDENES_PERPLEJIDAD)
+        if not isinstance(ordenes, list) or not ordenes:
+            return JsonResponse({'error': 'Se esperaba una lista de órdenes no vacía'}, status=400)
+        ordenes = sorted({min(max(int(n), 2), 20) for n in ordenes})
+        
+        # El modelo compilado del orden mayor (nunca el binario: hace falta la tabla de suavizado)
+        parametros = {**_parametros_sugerencias({**data, 'n_grama': ordenes[-1]}), 'usar_binario': False}
+        modelo, _, respuesta = _cargar_modelo_sugerencias(parametros)
+        if respuesta is not None:
+            return respuesta
+        
+        with etapa('perplejidad'):
+            resultados = evaluar_oraciones(modelo, [str(oracion) for oracion in oraciones], ordenes)
+        return JsonResponse({'total_oraciones': len(oraciones), 'ordenes': resultados})
+    
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+def estadisticas_modelos(request):
+    """Memoria usada por los modelos cargados en este proceso y aciertos, fallos y expulsiones"""
+    return JsonResponse(estadisticas_registros())
+
+def ver_metricas(request):
+    """Histogramas de etapas y peticiones y uso de los modelos en memoria, en formato de texto de Prometheus"""
+    if not metricas_activadas():
+        raise Http404('Métricas desactivadas')
+    
+    registros = estadisticas_registros()
+    extra = [('analisis_modelos_presupuesto_bytes', {}, registros['presupuesto_bytes'])]
+    for nombre, datos in registros['registros'].items():
+        for clave, valor in datos.items():
+            extra.append((f'analisis_modelos_{clave}', {'registro': nombre}, valor))
+    
+    return HttpResponse(exportar_texto(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def entrenar_modelo(request):
     """Vista para entrenar y visualizar el modelo de n-gramas"""
     if request.method == 'POST':
         texto_id = request.POST.get('texto_id')
         n_grama = int(request.POST.get('n_grama', 3))
         usar_fronteras = request.POST.get('fronteras', False) == 'true'
+        workers = obtener_workers_fragmentos() if request.POST.get('paralelo') == 'true' else 1
         
         # Validar n_grama
         if n_grama < 2:
@@ -224,33 +751,30 @@ def entrenar_modelo(request):
         
         texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
         
-        # Leer el contenido del archivo
+        # Leer el archivo por bloques y codificarlo (queda en caché para la API)
         try:
-            with texto_obj.archivo.open('r') as archivo:
-                contenido = archivo.read()
-        except:
-            contenido = ""
-        
-        # Procesar el texto
-        resultado = procesar_texto_completo(contenido, n_grama, usar_fronteras)
-        palabras_limpias = resultado['palabras_limpias']
+            corpus = obtener_corpus(texto_obj, usar_fronteras)
+            vocabulario, ids = corpus['vocabulario'], corpus['ids']
+        except (OSError, ValueError):
+            vocabulario, ids = Vocabulario(), []
         
         # Verificar si hay suficientes palabras
-        if len(palabras_limpias) < n_grama:
+        if len(ids) < n_grama:
             return render(request, 'entrenar_modelo.html', {
                 'textos': TextoAnalizado.objects.all().order_by('-fecha_subida'),
-                'error': f'El texto no tiene suficientes palabras para {n_grama}-gramas. Solo tiene {len(palabras_limpias)} palabras.'
+                'error': f'El texto no tiene suficientes palabras para {n_grama}-gramas. Solo tiene {len(ids)} palabras.'
             })
         
         # Calcular probabilidades
-        ngramas_probabilidades = calcular_probabilidad_ngramas(palabras_limpias, n_grama)
+        ngramas_probabilidades = calcular_probabilidad_ngramas_codificados(ids, n_grama, workers, opciones_poda())
         
-        # Preparar datos para la visualización
+        # Preparar datos para la visualización (solo se decodifican los mostrados)
         ngramas_ordenados = sorted(
             ngramas_probabilidades.items(), 
             key=lambda x: x[1]['frecuencia_ngrama'], 
             reverse=True
         )[:50]
+        ngramas_ordenados = list(decodificar_probabilidades(dict(ngramas_ordenados), vocabulario).items())
         
         return render(request, 'modelo_entrenado.html', {
             'texto': texto_obj,
@@ -258,7 +782,7 @@ def entrenar_modelo(request):
             'usar_fronteras': usar_fronteras,
             'ngramas_probabilidades': ngramas_ordenados,
             'total_ngramas': len(ngramas_probabilidades),
-            'palabras_limpias': palabras_limpias,
+            'total_palabras': len(ids),
             'max_mostrar': 50
         })
     
@@ -267,8 +791,8 @@ def entrenar_modelo(request):
         'textos': textos
     })
 
-def vista_comparacion_avanzada(request, texto_id):
-    """Vista principal para comparación MLE - usa parámetros GET"""
+def _n_grama_comparacion(request):
+    """n_grama pedido en la URL de la comparación MLE"""
     # Valor por defecto
     n_grama = 3
     
@@ -283,9 +807,16 @@ def vista_comparacion_avanzada(request, texto_id):
                 n_grama = 20
         except (ValueError, TypeError):
             n_grama = 3
-    
+    return n_grama
+
+def _etag_comparacion(request, texto_id):
+    return _etag_texto(texto_id, 'comparacion', _n_grama_comparacion(request))
+
+@condition(etag_func=_etag_comparacion, last_modified_func=_ultima_modificacion_texto)
+def vista_comparacion_avanzada(request, texto_id):
+    """Vista principal para comparación MLE - usa parámetros GET"""
     # Llamar a la función de comparación
-    return comparar_probabilidades(request, texto_id, n_grama)
+    return comparar_probabilidades(request, texto_id, _n_grama_comparacion(request))
 
 def comparar_probabilidades(request, texto_id, n_grama=3):
     """Función helper para comparar probabilidades con/sin fronteras"""
@@ -297,56 +828,54 @@ def comparar_probabilidades(request, texto_id, n_grama=3):
     
     texto_obj = get_object_or_404(TextoAnalizado, id=texto_id)
     
-    # Leer contenido
-    try:
-        with texto_obj.archivo.open('r') as archivo:
-            contenido = archivo.read()
-    except Exception as e:
-        return render(request, 'error.html', {
-            'error': f'Error al leer el archivo: {str(e)}',
-            'texto': texto_obj
-        })
-    
-    try:
+    def calcular():
+        contenido = _leer_contenido(texto_obj)
+        
         # Procesar SIN fronteras
-        palabras_sin_fronteras = limpiar_texto(contenido, usar_stopwords=True)
-        ngramas_prob_sin = calcular_probabilidad_ngramas(palabras_sin_fronteras, n_grama) if palabras_sin_fronteras else {}
+        with etapa('limpieza'):
+            palabras_sin_fronteras = limpiar_texto(contenido, usar_stopwords=True)
+        with etapa('probabilidades'):
+            ngramas_prob_sin = calcular_probabilidad_ngramas(palabras_sin_fronteras, n_grama, opciones_poda()) if palabras_sin_fronteras else {}
         
         # Procesar CON fronteras
-        palabras_con_fronteras = limpiar_texto_con_fronteras(contenido)
-        ngramas_prob_con = calcular_probabilidad_ngramas(palabras_con_fronteras, n_grama) if palabras_con_fronteras else {}
-        
-        # Obtener top n-gramas para comparación
-        top_sin = sorted(ngramas_prob_sin.items(), 
-                        key=lambda x: x[1]['frecuencia_ngrama'], 
-                        reverse=True)[:15] if ngramas_prob_sin else []
+        with etapa('limpieza'):
+            palabras_con_fronteras = limpiar_texto_con_fronteras(contenido)
+        with etapa('probabilidades'):
+            ngramas_prob_con = calcular_probabilidad_ngramas(palabras_con_fronteras, n_grama, opciones_poda()) if palabras_con_fronteras else {}
         
-        top_con = sorted(ngramas_prob_con.items(), 
-                        key=lambda x: x[1]['frecuencia_ngrama'], 
-                        reverse=True)[:15] if ngramas_prob_con else []
-        
-        return render(request, 'comparacion.html', {
-            'texto': texto_obj,
-            'n_grama': n_grama,
+        # Solo se guarda lo que muestra la comparación: los totales y los
+        # n-gramas más frecuentes, no los tokens ni todas las probabilidades
+        return {
             'sin_fronteras': {
-                'palabras': palabras_sin_fronteras,
                 'total_palabras': len(palabras_sin_fronteras),
-                'ngramas_probabilidades': ngramas_prob_sin,
-                'top_ngramas': top_sin,
+                'top_ngramas': ngramas_mas_frecuentes(ngramas_prob_sin, 15) if ngramas_prob_sin else [],
                 'total_ngramas': len(ngramas_prob_sin)
             },
             'con_fronteras': {
-                'palabras': palabras_con_fronteras,
                 'total_palabras': len(palabras_con_fronteras),
-                'ngramas_probabilidades': ngramas_prob_con,
-                'top_ngramas': top_con,
+                'top_ngramas': ngramas_mas_frecuentes(ngramas_prob_con, 15) if ngramas_prob_con else [],
                 'total_ngramas': len(ngramas_prob_con)
             }
-        })
+        }
     
+    # Leer y procesar (o recuperar la comparación ya calculada)
+    try:
+        datos = obtener_artefacto(texto_obj, f"comparacion{n_grama}", False, calcular)
+    except OSError as e:
+        return render(request, 'error.html', {
+            'error': f'Error al leer el archivo: {str(e)}',
+            'texto': texto_obj
+        })
     except Exception as e:
         return render(request, 'error.html', {
             'error': f'Error en el procesamiento: {str(e)}',
             'texto': texto_obj,
             'n_grama': n_grama
+        })
+    
+    with etapa('plantilla'):
+        return render(request, 'comparacion.html', {
+            'texto': texto_obj,
+            'n_grama': n_grama,
+            **datos
         })
\ No newline at end of file
@@ -0,0 +1,67 @@
+import sys
+from array import array
+
+
+class Vocabulario:
+    """
+    Tabla de símbolos de un corpus: asigna a cada palabra un id entero.
+    Todos los modelos construidos a partir del mismo texto comparten la misma
+    instancia, de modo que los n-gramas se guardan como tuplas de enteros y
+    las cadenas solo se reconstruyen al mostrar resultados.
+    """
+
+    def __init__(self, palabras=()):
+        self.palabras = []
+        self.ids = {}
+        for palabra in palabras:
+            self.agregar(palabra)
+
+    def __len__(self):
+        return len(self.palabras)
+
+    def __contains__(self, palabra):
+        return palabra in self.ids
+
+    def agregar(self, palabra):
+        """Devuelve el id de la palabra, registrándola si es nueva"""
+        id_palabra = self.ids.get(palabra)
+        if id_palabra is None:
+            id_palabra = len(self.palabras)
+            palabra = sys.intern(palabra)
+            self.palabras.append(palabra)
+            self.ids[palabra] = id_palabra
+        return id_palabra
+
+    def codificar(self, tokens):
+        """Convierte una secuencia de palabras en un array compacto de ids"""
+        agregar = self.agregar
+        return array('I', (agregar(token) for token in tokens))
+
+    def codificar_contexto(self, palabras):
+        """Tupla de ids de un contexto consultado; None si alguna palabra no existe"""
+        try:
+            return tuple(self.ids[palabra] for palabra in palabras)
+        except KeyError:
+            return None
+
+    def copia(self):
+        """Vocabulario independiente con las mismas palabras, para ampliarlo sin tocar este"""
+        copia = Vocabulario()
+        copia.palabras = list(self.palabras)
+        copia.ids = dict(self.ids)
+        return copia
+
+    def palabra(self, id_palabra):
+        return self.palabras[id_palabra]
+
+    def decodificar(self, ids):
+        """Reconstruye el texto (palabras separadas por espacio) de una tupla de ids"""
+        palabras = self.palabras
+        return ' '.join(palabras[i] for i in ids)
+
+    def __getstate__(self):
+        return {'palabras': self.palabras}
+
+    def __setstate__(self, estado):
+        self.palabras = [sys.intern(palabra) for palabra in estado['palabras']]
+        self.ids = {palabra: i for i, palabra in enumerate(self.palabras)}
@@ -119,4 +119,33 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Directorio donde se guardan los modelos de n-gramas compilados
+MODELOS_CACHE_DIR = os.path.join(BASE_DIR, 'cache_modelos')
+# Hilos que construyen modelos en segundo plano al subir un texto
+MODELOS_WORKERS_CONSTRUCCION = 2
+# Órdenes de n-grama que se preconstruyen al subir un texto
+MODELOS_ORDENES_PRECONSTRUIDOS = [2, 3]
+# Procesos que cuentan en paralelo los textos de un corpus (None: uno por CPU)
+MODELOS_WORKERS_CONTEO = None
+# Procesos que cuentan en paralelo los fragmentos de un texto grande (None: uno por CPU)
+MODELOS_WORKERS_FRAGMENTOS = None
+# Responder las sugerencias básicas desde la tabla de n-gramas de la base de
+# datos en lugar de los modelos en memoria (despliegues con poca memoria)
+MODELOS_ALMACEN_SQL = False
+# Memoria máxima (MB) para los modelos cargados en cada proceso; al superarla
+# se descartan los menos usados recientemente
+MODELOS_MEMORIA_MAXIMA_MB = 512
+# Poda de los modelos al construirlos y cuantización de las probabilidades
+# del análisis (ver analisis/poda.py), p. ej. {'conteo_minimo': {3: 2},
+# 'max_continuaciones': 50, 'umbral_entropia': 1e-7, 'bits_cuantizacion': 8}.
+# Vacío: modelos completos
+MODELOS_PODA = {}
+# Motor de calcular_probabilidad_ngramas: 'python' o 'numpy' (columnar,
+# necesita NumPy instalado; ver analisis/columnar.py)
+MOTOR_NGRAMAS = 'python'
+# Medir las etapas de cada petición (cabecera Server-Timing y /metrics); si
+# está desactivado las mediciones no hacen nada y el middleware no se instala
+METRICAS_ACTIVADAS = True
+if METRICAS_ACTIVADAS:
+    MIDDLEWARE.insert(0, 'analisis.metricas.MetricasMiddleware')